@@ -0,0 +1,255 @@
+import json
+import math
+import queue
+import socket
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from sensors import Sensor, DEFAULT_SENSOR
+from backends import SensorlibBackend
+from filters import createFilter
+from instrumentation import timings
+
+"""
+A single sensor reading: wall-clock timestamp, raw ADC value, ppm, the name
+of the sensor it came from, for filtered reads the variance of ppm, and the
+monotonic clock when it was read, which the SampleHub schedules on (NaN when
+unknown; the wall time is only the stored timestamp)
+"""
+Sample = namedtuple("Sample", ["time", "raw", "ppm", "sensor", "variance", "monotonic"],
+                    defaults=(DEFAULT_SENSOR, math.nan, math.nan))
+
+
+# loopback port the headless daemon serves samples on
+DAEMON_PORT = 50420
+
+
+"""
+Line-delimited JSON encoding used between the daemon and attached viewers
+"""
+def encodeSample(sample):
+    return (json.dumps(sample._asdict()) + "\n").encode()
+
+def decodeSample(line):
+    values = json.loads(line)
+    return Sample(values["time"], values["raw"], values["ppm"], values.get("sensor", DEFAULT_SENSOR),
+                  values.get("variance", math.nan), values.get("monotonic", math.nan))
+
+
+"""
+Base for threads producing samples. Samples are published to a thread-safe
+queue which the consumer (the Tk loop or the daemon) drains.
+"""
+class SampleSource(threading.Thread):
+    def __init__(self, name, maxQueued=600):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.samples = queue.Queue(maxsize=maxQueued)
+        self.stopEvent = threading.Event()
+
+    """
+    queues a sample, dropping the oldest one if the consumer has fallen behind
+    """
+    def publish(self, sample):
+        while True:
+            try:
+                self.samples.put_nowait(sample)
+                return
+            except queue.Full:
+                try:
+                    self.samples.get_nowait()
+                except queue.Empty:
+                    pass
+
+    """
+    returns all samples queued since the last call (never blocks)
+    """
+    def drain(self):
+        drained = []
+        while True:
+            try:
+                drained.append(self.samples.get_nowait())
+            except queue.Empty:
+                return drained
+
+    """
+    waits up to timeout seconds for the next sample; None if there was none
+    """
+    def next(self, timeout):
+        try:
+            return self.samples.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        self.stopEvent.set()
+
+
+"""
+Background thread that owns the sensors and samples them on their own clock,
+so a slow ADC read never blocks the GUI. Every sensor is polled by its own
+thread from a pool, so one slow channel cannot delay the others. The backend
+(see backends.py) does the actual reads and sets the pace.
+
+With a filter (see filters.py; filterSpec, or a sensor's own "filter") every
+tick reads a burst of raw values and publishes only the filtered value and
+its variance.
+"""
+class SensorWorker(SampleSource):
+    def __init__(self, getSettings, sensors=None, backend=None, period=1.0, maxQueued=600, filterSpec=None):
+        SampleSource.__init__(self, "SensorWorker", maxQueued * len(sensors or [None]))
+        # callable returning the global settings (optVal); read fresh every
+        # sample so calibration changes made in the options tab apply immediately
+        self.getSettings = getSettings
+        self.sensors = sensors or [Sensor(DEFAULT_SENSOR)]
+        self.backend = backend or SensorlibBackend()
+        self.period = period
+        self.missedTicks = 0
+        # sensor name -> filter, for sensors read in bursts
+        self.filters = {}
+        for sensor in self.sensors:
+            spec = sensor.filter or filterSpec
+            if spec:
+                self.filters[sensor.name] = createFilter(spec)
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=len(self.sensors), thread_name_prefix="SensorPoll") as pool:
+            for sensor in self.sensors:
+                pool.submit(self.poll, sensor)
+
+    """
+    reads on a fixed monotonic deadline grid, so read time never adds up to
+    drift. A read that is late is done at once; ticks that were missed
+    entirely (e.g. a read blocking for several periods) are skipped and counted.
+    """
+    def poll(self, sensor):
+        nextTick = time.monotonic()
+        while not self.stopEvent.is_set():
+            try:
+                self.publish(self.readSample(sensor))
+            except Exception as e:
+                print("sensor read failed:", sensor.name, e)
+            delay = self.backend.delay(sensor, self.period)
+            nextTick += delay
+            late = time.monotonic() - nextTick
+            if delay > 0 and late >= delay:
+                missed = int(late // delay)
+                nextTick += missed * delay
+                self.missedTicks += missed
+                print("sensor", sensor.name, "missed", missed, "ticks")
+            self.stopEvent.wait(nextTick - time.monotonic())
+
+    """
+    one backend read (or burst) per tick; ppm is derived from that same raw value
+    """
+    @timings.timed("sensor read")
+    def readSample(self, sensor):
+        # the sample is timestamped when the read starts, not when it returns
+        now = time.time()
+        monotonicNow = time.monotonic()
+        settings = self.getSettings()
+        noiseFilter = self.filters.get(sensor.name)
+        if noiseFilter is None:
+            raw, ppm = self.backend.read(sensor, settings)
+            return Sample(now, raw, ppm, sensor.name, math.nan, monotonicNow)
+        raw, variance = noiseFilter.update(self.backend.readBurst(sensor, settings, noiseFilter.count))
+        v400, v40000 = sensor.calibration(settings)
+        ppm = self.backend.rawToPPM(raw, v400, v40000)
+        # one standard deviation of raw carried through the (non-linear) calibration
+        deviation = self.backend.rawToPPM(raw + math.sqrt(variance), v400, v40000) - ppm
+        return Sample(now, raw, ppm, sensor.name, deviation * deviation, monotonicNow)
+
+
+"""
+Receives samples from a running co2daemon instead of reading the sensor.
+Reconnects on its own when the daemon restarts.
+"""
+class DaemonClient(SampleSource):
+    def __init__(self, host, port, maxQueued=600, retryDelay=2):
+        SampleSource.__init__(self, "DaemonClient", maxQueued)
+        self.host = host
+        self.port = port
+        self.retryDelay = retryDelay
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            try:
+                with socket.create_connection((self.host, self.port), timeout=5) as connection:
+                    connection.settimeout(None)
+                    print("attached to daemon at", self.host, self.port)
+                    for line in connection.makefile("rb"):
+                        if self.stopEvent.is_set():
+                            return
+                        self.publish(decodeSample(line))
+            except (OSError, ValueError) as e:
+                print("daemon connection failed:", e)
+            self.stopEvent.wait(self.retryDelay)
+
+
+"""
+Fans every sample out to all subscribers, each at its own rate per sensor.
+publish() runs the callbacks on the calling thread (the Tk loop for the GUI).
+
+Deliveries follow a deadline grid (first sample, then every interval after
+it) rather than "interval after the previous delivery", so a late sample
+doesn't push every later one back. When no sample came for whole intervals,
+subscribers asking for gaps get one gap sample (ppm and raw NaN) at the
+first missed deadline before the next real sample.
+
+The grid runs on the samples' monotonic clock, so a wall clock step (NTP)
+neither stalls deliveries nor fakes gaps; samples without one (NaN) use
+their wall time. A clock that goes back all the same (a restarted daemon
+sends a new monotonic clock) re-anchors the grid at that sample, as does a
+change of the interval.
+"""
+class SampleHub:
+    # samples arriving this early still count as on time for a subscriber
+    slack = 0.25
+
+    def __init__(self):
+        self.subscribers = []
+        self.latest = None
+
+    """
+    interval is in seconds (a number or a callable returning one); 0 means every sample
+    """
+    def subscribe(self, callback, interval=0, gaps=False):
+        # (next deadline, interval it was set with) per sensor
+        subscriber = {"callback": callback, "interval": interval, "gaps": gaps, "due": {}}
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def publish(self, sample):
+        self.latest = sample
+        clock = sample.time if math.isnan(sample.monotonic) else sample.monotonic
+        for subscriber in list(self.subscribers):
+            interval = subscriber["interval"]
+            if callable(interval):
+                interval = interval()
+            due, dueInterval = subscriber["due"].get(sample.sensor, (None, interval))
+            if due is None or interval <= 0 or interval != dueInterval or clock < due - interval - self.slack:
+                # first sample, every sample, a new interval (whose deadlines weren't missed), or
+                # before the last deadline: the clock went back
+                subscriber["due"][sample.sensor] = (clock + interval, interval)
+                self.deliver(subscriber, sample)
+            elif clock >= due - self.slack:
+                # deadlines this sample is late for; all but the last were missed
+                passed = math.floor((clock + self.slack - due) / interval)
+                if passed >= 1 and subscriber["gaps"]:
+                    # stored at the wall time of the missed deadline
+                    self.deliver(subscriber, Sample(sample.time - (clock - due), math.nan, math.nan, sample.sensor,
+                                                    math.nan, due))
+                subscriber["due"][sample.sensor] = (due + (passed + 1) * interval, interval)
+                self.deliver(subscriber, sample)
+            else:
+                subscriber["due"][sample.sensor] = (due, interval)
+
+    def deliver(self, subscriber, sample):
+        try:
+            subscriber["callback"](sample)
+        except Exception as e:
+            print("sample subscriber failed:", e)
@@ -0,0 +1,164 @@
+import json
+import shlex
+import subprocess
+from collections import namedtuple
+from datetime import datetime
+
+"""
+Threshold alerts evaluated on the sample stream. Every sensor has one small
+state machine per threshold, updated in O(1) per sample, so nothing is ever
+re-averaged or rescanned:
+
+    clear --(ppm past the threshold for alertDwell s)--> raised
+    raised --(ppm back past threshold -/+ alertHysteresis for alertDwell s)--> cleared
+
+Alerts go to sinks, callables taking an Alert. createSink() builds the
+built-in ones from a command line spec:
+
+    log               prints the alert
+    file:<path>       appends it as a JSON line
+    command:<cmd>     runs cmd with the alert as arguments (sensor threshold
+                      state ppm limit time) without waiting for it
+"""
+
+# threshold setting, True when exceeding means ppm above it
+THRESHOLDS = (("veryHighCO2", True), ("highCO2", True), ("lowCO2", False))
+# how often the thresholds are re-read from the settings, in seconds
+SETTINGS_REFRESH = 1.0
+
+Alert = namedtuple("Alert", ["time", "sensor", "threshold", "state", "ppm", "limit"])
+
+
+"""
+The threshold band a ppm value is in: "very high", "high", "low" or "normal"
+"""
+def level(ppm, sensor, settings):
+    if ppm >= sensor.get("veryHighCO2", settings):
+        return "very high"
+    if ppm >= sensor.get("highCO2", settings):
+        return "high"
+    if ppm <= sensor.get("lowCO2", settings):
+        return "low"
+    return "normal"
+
+
+"""
+State of one threshold of one sensor
+"""
+class ThresholdState:
+    def __init__(self, name, above):
+        self.name = name
+        self.above = above
+        self.active = False
+        # time the value first stood on the other side, None while it doesn't
+        self.since = None
+
+    """
+    returns "raised" or "cleared" when the state changes, else None
+    """
+    def update(self, time, ppm, limit, hysteresis, dwell):
+        if self.active:
+            crossed = ppm < limit - hysteresis if self.above else ppm > limit + hysteresis
+        else:
+            crossed = ppm >= limit if self.above else ppm <= limit
+        if not crossed:
+            self.since = None
+            return None
+        if self.since is None:
+            self.since = time
+        if time - self.since < dwell:
+            return None
+        self.active = not self.active
+        self.since = None
+        return "raised" if self.active else "cleared"
+
+
+"""
+Feeds every sample through its sensor's threshold states and hands state
+changes to the sinks. check() is a SampleHub callback.
+"""
+class AlertEngine:
+    def __init__(self, settings, sensors, sinks):
+        self.settings = settings
+        self.sensors = {sensor.name: sensor for sensor in sensors}
+        self.sinks = list(sinks)
+        self.states = {name: [ThresholdState(threshold, above) for threshold, above in THRESHOLDS]
+                       for name in self.sensors}
+        # sensor name -> (time read, {threshold: limit}, hysteresis, dwell)
+        self.limits = {}
+
+    """
+    the thresholds of a sensor, re-read at most every SETTINGS_REFRESH seconds
+    so a settings change applies without a lookup per sample
+    """
+    def sensorLimits(self, name, time):
+        limits = self.limits.get(name)
+        if limits is None or time - limits[0] >= SETTINGS_REFRESH or time < limits[0]:
+            sensor = self.sensors[name]
+            limits = (time, {threshold: sensor.get(threshold, self.settings) for threshold, above in THRESHOLDS},
+                      sensor.get("alertHysteresis", self.settings), sensor.get("alertDwell", self.settings))
+            self.limits[name] = limits
+        return limits
+
+    def check(self, sample):
+        # gap samples (NaN) neither raise nor clear anything
+        if sample.sensor not in self.states or sample.ppm != sample.ppm:
+            return
+        readAt, limits, hysteresis, dwell = self.sensorLimits(sample.sensor, sample.time)
+        for state in self.states[sample.sensor]:
+            change = state.update(sample.time, sample.ppm, limits[state.name], hysteresis, dwell)
+            if change is not None:
+                self.emit(Alert(sample.time, sample.sensor, state.name, change, sample.ppm, limits[state.name]))
+
+    def emit(self, alert):
+        for sink in self.sinks:
+            try:
+                sink(alert)
+            except Exception as e:
+                print("alert sink failed:", e)
+
+    """
+    thresholds currently raised, as (sensor, threshold) pairs
+    """
+    def active(self):
+        return [(name, state.name) for name, states in self.states.items() for state in states if state.active]
+
+
+def formatAlert(alert):
+    return "%s %s %s %s (%d ppm, limit %d)" % (
+        datetime.fromtimestamp(alert.time).strftime("%y-%m-%d %H:%M:%S"), alert.sensor, alert.threshold,
+        alert.state, alert.ppm, alert.limit)
+
+
+def logSink(alert):
+    print("alert:", formatAlert(alert))
+
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, alert):
+        with open(self.path, "a") as handle:
+            handle.write(json.dumps(alert._asdict()) + "\n")
+
+
+class CommandSink:
+    def __init__(self, command):
+        self.command = shlex.split(command)
+
+    def __call__(self, alert):
+        # not waited for, a slow command must not hold up the samples
+        subprocess.Popen(self.command + [alert.sensor, alert.threshold, alert.state, "%g" % alert.ppm,
+                                         "%g" % alert.limit, "%.3f" % alert.time])
+
+
+def createSink(spec):
+    name, _, argument = spec.partition(":")
+    if name == "log":
+        return logSink
+    if name == "file" and argument:
+        return FileSink(argument)
+    if name == "command" and argument:
+        return CommandSink(argument)
+    raise ValueError("unknown alert sink: " + spec)
@@ -0,0 +1,141 @@
+import numpy as np
+
+"""
+Vectorized analytics for recordings (times in epoch ms, values in ppm).
+NaN values mark gaps in a recording and are skipped.
+"""
+
+def deltas(values):
+    return np.diff(np.asarray(values, dtype=np.float64))
+
+"""
+trailing mean over the last window samples (shorter at the start); NaN
+where the window holds no values
+"""
+def rollingMean(values, window):
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    cumsum = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (cumsum[ends] - cumsum[starts]) / (counts[ends] - counts[starts])
+
+"""
+time in ms spent above threshold; a value holds until the next sample
+"""
+def timeAbove(times, values, threshold):
+    times = np.asarray(times)
+    values = np.asarray(values)
+    return int(np.diff(times)[values[:-1] > threshold].sum())
+
+"""
+Air change rate (1/h) from the decay of CO2 towards the outdoor baseline:
+ln((peak - baseline) / (value - baseline)) / hours between the two samples
+"""
+def decayRate(peakTime, peak, time, value, baseline):
+    hours = (time - peakTime) / 3600000
+    if hours <= 0 or peak <= baseline or not baseline < value < peak:
+        return None
+    return float(np.log((peak - baseline) / (value - baseline)) / hours)
+
+
+"""
+Incrementally maintained statistics of one recording. extend() processes
+new samples in a single vectorized pass over just those samples, so a running
+recording never has to be rescanned.
+
+Peak events are runs above highCO2; each event records its peak and, once
+the value falls back below highCO2, the ventilation decay rate from the
+peak down to that first sample below the threshold. Gaps neither end nor
+split an event.
+"""
+class RecordingAnalytics:
+    def __init__(self, lowCO2, highCO2, veryHighCO2):
+        self.thresholds = (lowCO2, highCO2, veryHighCO2)
+        self.lowCO2 = lowCO2
+        self.highCO2 = highCO2
+        self.veryHighCO2 = veryHighCO2
+        self.count = 0
+        self.sum = 0.0
+        self.first = None
+        self.last = None
+        self.lastValid = None
+        self.timeAboveHigh = 0
+        self.timeAboveVeryHigh = 0
+        self.events = []
+        self.openEvent = None
+
+    def extend(self, times, values):
+        times = np.asarray(times, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(times) == 0:
+            return
+        valid = ~np.isnan(values)
+        # events skip the gaps and join up with the previous value
+        eventTimes, eventValues = times[valid], values[valid]
+        if self.lastValid is not None:
+            eventTimes = np.concatenate(([self.lastValid[0]], eventTimes))
+            eventValues = np.concatenate(([self.lastValid[1]], eventValues))
+        if valid.any():
+            if self.first is None:
+                self.first = (int(times[valid][0]), float(values[valid][0]))
+            self.lastValid = (int(times[valid][-1]), float(values[valid][-1]))
+        self.count += int(np.count_nonzero(valid))
+        self.sum += float(values[valid].sum())
+
+        # carry the previous sample so intervals join up across calls
+        if self.last is not None:
+            times = np.concatenate(([self.last[0]], times))
+            values = np.concatenate(([self.last[1]], values))
+        self.last = (int(times[-1]), float(values[-1]))
+
+        self.timeAboveHigh += timeAbove(times, values, self.highCO2)
+        self.timeAboveVeryHigh += timeAbove(times, values, self.veryHighCO2)
+        self.findEvents(eventTimes, eventValues)
+
+    def findEvents(self, times, values):
+        above = np.concatenate(([False], values > self.highCO2, [False]))
+        edges = np.flatnonzero(np.diff(above.view(np.int8)))
+        for start, end in zip(edges[::2], edges[1::2]):
+            # run covers samples start .. end-1
+            peakIndex = start + int(np.argmax(values[start:end]))
+            event = self.openEvent if start == 0 and self.openEvent is not None else None
+            if event is None:
+                event = {"start": int(times[start]), "end": None, "peak": float(values[peakIndex]),
+                         "peakTime": int(times[peakIndex]), "decayRate": None}
+                self.events.append(event)
+            elif values[peakIndex] > event["peak"]:
+                event["peak"] = float(values[peakIndex])
+                event["peakTime"] = int(times[peakIndex])
+
+            if end < len(values):
+                event["end"] = int(times[end])
+                event["decayRate"] = decayRate(event["peakTime"], event["peak"], times[end], values[end],
+                                               self.lowCO2)
+                self.openEvent = None
+            else:
+                self.openEvent = event
+
+    """
+    mean of the values; NaN for a recording of gaps only
+    """
+    def mean(self):
+        if self.count == 0:
+            return float("nan")
+        return self.sum / self.count
+
+    """
+    mean change per sample, i.e. the mean of all deltas
+    """
+    def meanDelta(self):
+        if self.count < 2:
+            return 0
+        return (self.lastValid[1] - self.first[1]) / (self.count - 1)
+
+    """
+    events whose span overlaps start..end (epoch ms)
+    """
+    def eventsBetween(self, start, end):
+        return [e for e in self.events if e["start"] <= end and (e["end"] is None or e["end"] >= start)]
@@ -0,0 +1,216 @@
+import os
+import struct
+import zlib
+import numpy as np
+
+"""
+Compressed archive of a recording (<name>.co2a) for old recordings on slow
+SD cards. CO2 series are smooth, so neighbouring samples differ little:
+
+    time    delta of delta (a steady interval is all zeros)
+    ppm     delta of ppm in 1/PPM_SCALE ppm steps
+    raw     delta of raw in 1/RAW_SCALE steps
+
+each as zigzag varints, then deflated. NaN values (gaps, raw of old
+recordings) are stored as a list of their positions. ppm and raw are kept to
+two decimals; times are exact.
+
+The samples are split into blocks of BLOCK_SIZE that decode on their own, so
+a reader streams block by block and can skip blocks outside a time range
+without decoding them.
+
+    header                      magic, version, count, blocks, v400, v40000,
+                                measurementInterval, ppm scale, raw scale
+    per block: block header     count, first time, last time, payload lengths
+               time, ppm, raw payloads
+"""
+ARCHIVE_MAGIC = b"CO2A"
+ARCHIVE_VERSION = 1
+ARCHIVE_EXT = ".co2a"
+ARCHIVE_HEADER = struct.Struct("<4sHxxqqddddd")
+BLOCK_HEADER = struct.Struct("<IqqIII")
+BLOCK_SIZE = 65536
+PPM_SCALE = 100.0
+RAW_SCALE = 100.0
+# the varint of a 64 bit value takes at most 10 bytes
+MAX_VARINT_BYTES = 10
+
+
+"""
+zigzag varint bytes of an int64 array, vectorized
+"""
+def encodeVarints(values):
+    values = np.asarray(values, dtype=np.int64)
+    zigzag = ((values << 1) ^ (values >> 63)).view(np.uint64)
+    lengths = np.ones(len(zigzag), dtype=np.int64)
+    rest = zigzag >> np.uint64(7)
+    for i in range(MAX_VARINT_BYTES - 1):
+        more = rest > 0
+        if not more.any():
+            break
+        lengths += more
+        rest >>= np.uint64(7)
+    owner = np.repeat(np.arange(len(zigzag)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(len(owner)) - starts[owner]
+    encoded = ((zigzag[owner] >> (7 * position).astype(np.uint64)) & np.uint64(0x7f)).astype(np.uint8)
+    # every byte but the last of a value has the continuation bit
+    encoded[position < lengths[owner] - 1] |= 0x80
+    return encoded.tobytes()
+
+
+def decodeVarints(data):
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    if len(encoded) == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(encoded < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)
+    parts = (encoded & 0x7f).astype(np.uint64) << (7 * position).astype(np.uint64)
+    zigzag = np.add.reduceat(parts, starts)
+    return (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+
+
+def encodeTimes(times):
+    deltas = np.diff(np.asarray(times, dtype=np.int64))
+    return zlib.compress(encodeVarints(np.diff(deltas, prepend=0)))
+
+
+def decodeTimes(payload, first):
+    deltas = np.cumsum(decodeVarints(zlib.decompress(payload)))
+    return first + np.concatenate(([0], np.cumsum(deltas)))
+
+
+"""
+NaN positions (delta coded) and the quantized deltas of the other values
+"""
+def encodeValues(values, scale):
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.flatnonzero(np.isnan(values))
+    quantized = np.round(values[~np.isnan(values)] * scale).astype(np.int64)
+    return zlib.compress(encodeVarints(np.concatenate(([len(missing)], np.diff(missing, prepend=0),
+                                                       np.diff(quantized, prepend=0)))))
+
+
+def decodeValues(payload, count, scale):
+    decoded = decodeVarints(zlib.decompress(payload))
+    nanCount = decoded[0]
+    values = np.full(count, np.nan, dtype=np.float32)
+    valid = np.ones(count, dtype=bool)
+    valid[np.cumsum(decoded[1:1 + nanCount])] = False
+    values[valid] = np.cumsum(decoded[1 + nanCount:]) / scale
+    return values
+
+
+"""
+Writes an archive block by block; append() takes chunks of any size.
+The file is replaced atomically on close().
+"""
+class ArchiveWriter:
+    def __init__(self, path, header, blockSize=BLOCK_SIZE):
+        self.path = path
+        self.header = header
+        self.blockSize = blockSize
+        self.count = 0
+        self.blocks = 0
+        self.pending = []
+        self.pendingCount = 0
+        self.handle = open(path + ".tmp", "wb")
+        # written again with the counts on close
+        self.handle.write(self.packHeader())
+
+    def packHeader(self):
+        return ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, self.count, self.blocks, self.header["v400"],
+                                   self.header["v40000"], self.header["measurementInterval"], PPM_SCALE, RAW_SCALE)
+
+    def append(self, times, ppm, raw):
+        self.pending.append((np.asarray(times, dtype=np.int64), np.asarray(ppm), np.asarray(raw)))
+        self.pendingCount += len(times)
+        if self.pendingCount >= self.blockSize:
+            self.flush(final=False)
+
+    def flush(self, final):
+        if not self.pending:
+            return
+        times, ppm, raw = (np.concatenate(column) for column in zip(*self.pending))
+        end = len(times) if final else len(times) - len(times) % self.blockSize
+        for first in range(0, end, self.blockSize):
+            self.writeBlock(times[first:first + self.blockSize], ppm[first:first + self.blockSize],
+                            raw[first:first + self.blockSize])
+        self.pending = [(times[end:], ppm[end:], raw[end:])] if end < len(times) else []
+        self.pendingCount = len(times) - end
+
+    def writeBlock(self, times, ppm, raw):
+        payloads = [encodeTimes(times), encodeValues(ppm, PPM_SCALE), encodeValues(raw, RAW_SCALE)]
+        self.handle.write(BLOCK_HEADER.pack(len(times), int(times[0]), int(times[-1]), *map(len, payloads)))
+        self.handle.write(b"".join(payloads))
+        self.count += len(times)
+        self.blocks += 1
+
+    def close(self):
+        self.flush(final=True)
+        self.handle.seek(0)
+        self.handle.write(self.packHeader())
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.handle.close()
+        os.replace(self.path + ".tmp", self.path)
+        return self.path
+
+    def discard(self):
+        self.handle.close()
+        os.remove(self.path + ".tmp")
+
+
+def writeArchive(path, header, times, ppm, raw, blockSize=BLOCK_SIZE):
+    writer = ArchiveWriter(path, header, blockSize)
+    writer.append(times, ppm, raw)
+    return writer.close()
+
+
+def readHeader(handle, path):
+    magic, version, count, blocks, v400, v40000, interval, ppmScale, rawScale = ARCHIVE_HEADER.unpack(
+        handle.read(ARCHIVE_HEADER.size))
+    if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+        raise ValueError("not a recording archive: " + path)
+    header = {"v400": v400, "v40000": v40000, "measurementInterval": interval}
+    return header, count, blocks, ppmScale, rawScale
+
+
+"""
+Yields (times, ppm, raw) per block; blocks entirely outside start..end
+(epoch ms) are skipped without being read or decoded
+"""
+def iterArchive(path, start=None, end=None):
+    with open(path, "rb") as handle:
+        header, count, blocks, ppmScale, rawScale = readHeader(handle, path)
+        for i in range(blocks):
+            blockCount, first, last, timeLength, ppmLength, rawLength = BLOCK_HEADER.unpack(
+                handle.read(BLOCK_HEADER.size))
+            if (start is not None and last < start) or (end is not None and first > end):
+                handle.seek(timeLength + ppmLength + rawLength, os.SEEK_CUR)
+                continue
+            times = decodeTimes(handle.read(timeLength), first)
+            ppm = decodeValues(handle.read(ppmLength), blockCount, ppmScale)
+            raw = decodeValues(handle.read(rawLength), blockCount, rawScale)
+            yield times, ppm, raw
+
+
+"""
+Returns (header, times, ppm, raw) of a whole archive, decoded block by
+block into preallocated columns
+"""
+def readArchive(path):
+    with open(path, "rb") as handle:
+        header, count, blocks, ppmScale, rawScale = readHeader(handle, path)
+    times = np.empty(count, dtype="<i8")
+    ppm = np.empty(count, dtype="<f4")
+    raw = np.empty(count, dtype="<f4")
+    filled = 0
+    for blockTimes, blockPPM, blockRaw in iterArchive(path):
+        size = len(blockTimes)
+        times[filled:filled + size] = blockTimes
+        ppm[filled:filled + size] = blockPPM
+        raw[filled:filled + size] = blockRaw
+        filled += size
+    return header, times, ppm, raw
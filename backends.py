@@ -0,0 +1,173 @@
+import math
+import random
+import numpy as np
+
+"""
+Sensor backends. A backend turns one read of a sensor into (raw, ppm) and
+says how long to wait until that sensor's next read, so the acquisition code
+runs the same on the Pi (sensorlib), on a dev box (synthetic) and against an
+old recording (replay).
+
+    backend.read(sensor, settings) -> (raw, ppm)
+    backend.readBurst(sensor, settings, count) -> count raw values read back to back
+    backend.delay(sensor, period)  -> seconds until the next read
+    backend.rawToPPM(raw, v400, v40000)
+"""
+
+
+"""
+ppm from a raw value, logarithmic between the 400 and 40000 ppm calibration
+points; the conversion used by the simulated backends
+"""
+def logRawToPPM(raw, v400, v40000):
+    return 400 * 10 ** (2 * (raw - v400) / (v40000 - v400))
+
+def logPPMToRaw(ppm, v400, v40000):
+    return v400 + (v40000 - v400) * math.log10(max(ppm, 1) / 400) / 2
+
+
+"""
+The real hardware via sensorlib (only importable on the Pi)
+"""
+class SensorlibBackend:
+    def __init__(self):
+        import sensorlib
+        self.sensorlib = sensorlib
+
+    def read(self, sensor, settings):
+        if sensor.channel is None:
+            raw = self.sensorlib.readRawCO2()
+        else:
+            raw = self.sensorlib.readRawCO2(sensor.channel)
+        v400, v40000 = sensor.calibration(settings)
+        return raw, self.sensorlib.rawToPPM(raw, v400, v40000)
+
+    def readBurst(self, sensor, settings, count):
+        if sensor.channel is None:
+            return [self.sensorlib.readRawCO2() for i in range(count)]
+        return [self.sensorlib.readRawCO2(sensor.channel) for i in range(count)]
+
+    def delay(self, sensor, period):
+        return period
+
+    def rawToPPM(self, raw, v400, v40000):
+        return self.sensorlib.rawToPPM(raw, v400, v40000)
+
+
+"""
+Simulated room: outdoor baseline plus gaussian noise, with occupancy events
+arriving at random (eventsPerHour) that add CO2 at emission ppm/s while they
+last and then decay with the room's air change rate. rate is in samples per
+second; every sensor is its own room.
+"""
+class SyntheticBackend:
+    def __init__(self, rate=1.0, noise=15.0, eventsPerHour=2.0, baseline=420.0, emission=2.0,
+                 airChangeRate=1.0, seed=None):
+        self.rate = rate
+        self.noise = noise
+        self.eventsPerHour = eventsPerHour
+        self.baseline = baseline
+        self.emission = emission
+        self.airChangeRate = airChangeRate
+        self.random = random.Random(seed)
+        # sensor name -> [ppm above baseline, seconds of emission left]
+        self.rooms = {}
+
+    """
+    advances the sensor's room by one sample; returns its true ppm
+    """
+    def step(self, sensor):
+        room = self.rooms.setdefault(sensor.name, [0.0, 0.0])
+        step = 1 / self.rate
+        if room[1] <= 0 and self.random.random() < self.eventsPerHour * step / 3600:
+            room[1] = self.random.uniform(600, 3600)
+        if room[1] > 0:
+            room[0] += self.emission * step
+            room[1] -= step
+        room[0] *= math.exp(-self.airChangeRate * step / 3600)
+        return self.baseline + room[0]
+
+    def read(self, sensor, settings):
+        ppm = max(self.step(sensor) + self.random.gauss(0, self.noise), 1)
+        v400, v40000 = sensor.calibration(settings)
+        return logPPMToRaw(ppm, v400, v40000), ppm
+
+    """
+    a burst is read within one sample, so the room doesn't change during it
+    """
+    def readBurst(self, sensor, settings, count):
+        ppm = self.step(sensor)
+        v400, v40000 = sensor.calibration(settings)
+        return [logPPMToRaw(max(ppm + self.random.gauss(0, self.noise), 1), v400, v40000) for i in range(count)]
+
+    def delay(self, sensor, period):
+        return 1 / self.rate
+
+    def rawToPPM(self, raw, v400, v40000):
+        return logRawToPPM(raw, v400, v40000)
+
+
+"""
+Streams a recording file as if it was being measured, speed times faster
+than it was recorded, starting over at its end. Every sensor replays the
+same file.
+"""
+class ReplayBackend:
+    def __init__(self, path, speed=1.0):
+        # imported here so the recording module isn't needed by the other backends
+        from recording import loadRecording
+        recording = loadRecording(path)
+        if len(recording) < 2:
+            raise ValueError("nothing to replay in " + path)
+        self.time = np.asarray(recording.time)
+        self.ppm = np.asarray(recording.ppm, dtype=np.float64)
+        self.raw = np.asarray(recording.raw, dtype=np.float64)
+        self.speed = speed
+        # sensor name -> index of the next sample
+        self.position = {}
+
+    def read(self, sensor, settings):
+        i = self.position.get(sensor.name, 0)
+        self.position[sensor.name] = (i + 1) % len(self.time)
+        return float(self.raw[i]), float(self.ppm[i])
+
+    """
+    the recording holds one value per sample, so a burst repeats it
+    """
+    def readBurst(self, sensor, settings, count):
+        i = self.position.get(sensor.name, 0)
+        self.position[sensor.name] = (i + 1) % len(self.time)
+        return [float(self.raw[i])] * count
+
+    def delay(self, sensor, period):
+        i = self.position.get(sensor.name, 0)
+        if i == 0:
+            return period / self.speed
+        return (self.time[i] - self.time[i - 1]) / 1000 / self.speed
+
+    def rawToPPM(self, raw, v400, v40000):
+        return logRawToPPM(raw, v400, v40000)
+
+
+"""
+Creates a backend from a command line spec:
+
+    sensorlib                 the hardware (default)
+    synthetic[:rate]          simulated sensors, rate samples per second
+    replay:<file>[:speed]     a recording file, speed times faster
+"""
+def createBackend(spec="sensorlib"):
+    name, _, argument = spec.partition(":")
+    if name == "sensorlib":
+        return SensorlibBackend()
+    if name == "synthetic":
+        return SyntheticBackend(float(argument) if argument else 1.0)
+    if name == "replay":
+        path, _, speed = argument.rpartition(":")
+        # no ":speed" suffix (or a path containing ':') means the whole argument is the path
+        try:
+            speed = float(speed)
+        except ValueError:
+            path, speed = argument, 1.0
+        return ReplayBackend(path, speed)
+    raise ValueError("unknown sensor backend: " + spec)
@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import dashboard
+from acquisition import Sample
+from backends import SyntheticBackend
+from sensors import Sensor
+from settings import defaults, loadSettings, saveSettings
+from recording import (RecordingWriter, Recording, writeRecording, openRecording, compactJournal,
+                       loadRecording, JOURNAL_EXT)
+from archive import writeArchive
+
+"""
+Headless benchmarks of the hot paths: the live graph buffer, live graph
+blitting, recording plots over 1k to 10M samples, recording save/load
+(columnar, compressed archive and old pickles) and settings load. Plotting runs on the Agg backend, data comes from the
+synthetic sensor backend.
+
+    python benchmark.py [--sizes 1000 100000] [--output benchmark.json]
+                        [--baseline baseline.json] [--save-baseline]
+
+Results (ms per operation) are written as JSON. With a baseline every
+result more than --tolerance slower than its baseline value is reported and
+the exit status is 1.
+"""
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000, 10000000]
+# the synthetic sensor is run for at most this many samples, larger
+# recordings repeat its output
+GENERATED_SAMPLES = 100000
+# old pickles parse every time stamp; beyond this they take minutes to load
+MAX_PICKLE_SAMPLES = 1000000
+# recording header of the benchmark recordings
+HEADER = {"v400": defaults["v400"], "v40000": defaults["v40000"],
+          "measurementInterval": defaults["recordingInterval"] / 60}
+
+
+"""
+FigureCanvasTkAgg stand-in: renders with Agg, nothing is put on screen
+"""
+class AggCanvas(FigureCanvasAgg):
+    def __init__(self, figure, master=None):
+        FigureCanvasAgg.__init__(self, figure)
+
+    def get_tk_widget(self):
+        return NullWidget()
+
+    def blit(self, bbox=None):
+        pass
+
+
+"""
+accepts and ignores every call a tk widget would get
+"""
+class NullWidget:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+"""
+runs fn repeat times (after one warm-up call); returns ms per call
+"""
+def timeit(fn, repeat=5, number=1):
+    fn()
+    runs = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            fn()
+        runs.append((time.perf_counter() - start) * 1000 / number)
+    return {"median": statistics.median(runs), "min": min(runs), "runs": repeat}
+
+
+"""
+(epoch ms, ppm, raw) columns of a simulated recording, one sample a second
+"""
+def simulatedRecording(size):
+    backend = SyntheticBackend(eventsPerHour=6, seed=1)
+    sensor = Sensor("benchmark")
+    generated = min(size, GENERATED_SAMPLES)
+    raw = np.empty(generated)
+    ppm = np.empty(generated)
+    for i in range(generated):
+        raw[i], ppm[i] = backend.read(sensor, defaults)
+    times = 1700000000000 + np.arange(size, dtype=np.int64) * 1000
+    return times, np.resize(ppm, size).astype(np.float32), np.resize(raw, size).astype(np.float32)
+
+
+def benchmarkGraphBuffer(results):
+    # samples arrive as python floats
+    values = simulatedRecording(10000)[1].astype(float).tolist()
+    buffer = dashboard.GraphBuffer(601, 5)
+    buffer.setThreshold("highCO2", defaults["highCO2"])
+    buffer.setThreshold("veryHighCO2", defaults["veryHighCO2"])
+
+    def append():
+        for value in values:
+            buffer.append(value)
+    results["GraphBuffer.append"] = perSample(timeit(append), len(values))
+    results["GraphBuffer.mean"] = timeit(buffer.mean, number=10000)
+
+
+def perSample(result, count):
+    return {"median": result["median"] / count, "min": result["min"] / count, "runs": result["runs"]}
+
+
+def benchmarkUIGraph(results):
+    graph = dashboard.UIGraph(NullWidget(), "Time (s)", "CO2 (ppm)", -600, 0, step=5, figx=15)
+    graph.addHLine("veryHighCO2", "r", "solid", "very high")
+    graph.addHLine("highCO2", "orange", "dashed", "high")
+    graph.addHLine("lowCO2", "g", "dashed", "normal")
+    graph.enableBars()
+    graph.enableLegend()
+    graph.setYAxis(0, 8000)
+    values = iter(np.resize(simulatedRecording(1000)[1], 1000000).tolist())
+
+    def blit():
+        graph.buffer.append(next(values))
+        graph.updatePlot()
+    results["UIGraph.updatePlot"] = timeit(blit, number=50)
+    results["UIGraph.redraw"] = timeit(graph.redraw)
+
+
+"""
+a RecordingTab whose figures render with Agg; only what the plot methods use
+"""
+def headlessRecordingTab():
+    tab = dashboard.RecordingTab.__new__(dashboard.RecordingTab)
+    tab.figure1 = dashboard.Figure(figsize=(15, 4), dpi=100)
+    tab.figure2 = dashboard.Figure(figsize=(9, 2), dpi=100)
+    tab.subplot1 = tab.figure1.add_subplot(111)
+    tab.subplot2 = tab.figure2.add_subplot(111)
+    tab.canvas1 = AggCanvas(tab.figure1)
+    tab.canvas2 = AggCanvas(tab.figure2)
+    tab.entry = {"avgCO2": NullWidget(), "avgDeltaCO2": NullWidget()}
+    tab.warningLabel = {"avgCO2": NullWidget(), "avgDeltaCO2": NullWidget()}
+    tab.view = None
+    tab.writers = {}
+    tab.files = {}
+    tab.pyramid = None
+    tab.deltaPyramid = None
+    tab.pyramidKey = None
+    tab.analytics = None
+    return tab
+
+
+def benchmarkRecordingPlots(results, sizes):
+    tab = headlessRecordingTab()
+    for size in sizes:
+        times, ppm, raw = simulatedRecording(size)
+        dashboard.recorded = Recording(dict(HEADER), times, ppm, raw)
+
+        # cold: a newly loaded recording builds its pyramids and analytics
+        def cold():
+            tab.pyramidKey = None
+            tab.analytics = None
+            tab.plotCO2Update()
+        results["RecordingTab.plotCO2Update cold %d" % size] = timeit(cold, repeat=3)
+        results["RecordingTab.plotCO2Update %d" % size] = timeit(tab.plotCO2Update)
+        results["RecordingTab.plotCO2DeltaUpdate %d" % size] = timeit(tab.plotCO2DeltaUpdate)
+
+        # zoomed in on the middle tenth
+        middle = int(times[len(times) // 2])
+        span = int(times[-1] - times[0]) // 20
+        tab.view = (middle - span, middle + span)
+        results["RecordingTab.plotCO2Update zoomed %d" % size] = timeit(tab.plotCO2Update)
+        tab.view = None
+    dashboard.recorded = dashboard.deque(maxlen=dashboard.maxRecorded)
+
+
+def benchmarkRecordingFiles(results, sizes, directory):
+    # journal appends as done for every live sample (fsync batching included)
+    path = os.path.join(directory, "benchmark" + JOURNAL_EXT)
+    writer = RecordingWriter(path, HEADER["v400"], HEADER["v40000"], HEADER["measurementInterval"])
+    sample = Sample(time.time(), 2000.0, 800.0)
+    results["RecordingWriter.append"] = timeit(lambda: writer.append(sample), number=1000)
+    compactJournal(writer.close())
+
+    for size in sizes:
+        times, ppm, raw = simulatedRecording(size)
+        path = os.path.join(directory, "benchmark%d.co2r" % size)
+        results["writeRecording %d" % size] = timeit(
+            lambda: writeRecording(path, HEADER, times, ppm, raw), repeat=3)
+        # open plus one full pass over the columns, like a plot of the whole recording
+        results["openRecording %d" % size] = timeit(lambda: float(openRecording(path).ppm.sum()), repeat=3)
+        os.remove(path)
+
+        path = os.path.join(directory, "benchmark%d.co2a" % size)
+        results["writeArchive %d" % size] = timeit(lambda: writeArchive(path, HEADER, times, ppm, raw), repeat=3)
+        results["loadRecording archive %d" % size] = timeit(lambda: float(loadRecording(path).ppm.sum()), repeat=3)
+        os.remove(path)
+
+        # what the dashboard saved before the columnar format: ("%H:%M", ppm) tuples
+        if size <= MAX_PICKLE_SAMPLES:
+            path = os.path.join(directory, "00-01-01_at_00-00_benchmark%d.pickle" % size)
+            stamps = [time.strftime("%H:%M", time.localtime(t / 1000)) for t in times.tolist()]
+            with open(path, "wb") as handle:
+                pickle.dump(list(zip(stamps, ppm.tolist())), handle, protocol=pickle.HIGHEST_PROTOCOL)
+            results["loadRecording pickle %d" % size] = timeit(lambda: float(loadRecording(path).ppm.sum()),
+                                                               repeat=3)
+            os.remove(path)
+
+
+def benchmarkSettings(results, directory):
+    path = os.path.join(directory, "settings.opt")
+    # the settings functions report on stdout, which is not what is being measured
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        saveSettings(dict(defaults), path)
+        results["loadSettings"] = timeit(lambda: loadSettings(path), number=100)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+"""
+names of results more than tolerance (fraction) slower than in baseline
+"""
+def regressions(results, baseline, tolerance):
+    slower = []
+    for name, result in results.items():
+        if name in baseline and result["median"] > baseline[name]["median"] * (1 + tolerance):
+            slower.append(name)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the CO2 dashboard's hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="recording sizes in samples")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results to --baseline")
+    args = parser.parse_args()
+    if args.save_baseline and args.baseline is None:
+        parser.error("--save-baseline needs --baseline")
+
+    dashboard.importPlotting()
+    dashboard.FigureCanvasTkAgg = AggCanvas
+
+    results = {}
+    steps = [("graph buffer", lambda: benchmarkGraphBuffer(results)),
+             ("live graph", lambda: benchmarkUIGraph(results)),
+             ("recording plots", lambda: benchmarkRecordingPlots(results, args.sizes))]
+    with tempfile.TemporaryDirectory() as directory:
+        steps += [("recording files", lambda: benchmarkRecordingFiles(results, args.sizes, directory)),
+                  ("settings", lambda: benchmarkSettings(results, directory))]
+        for step, run in steps:
+            print("benchmarking", step, "...")
+            run()
+
+    for name, result in results.items():
+        print("%-45s %12.4f ms" % (name, result["median"]))
+
+    report = {"python": platform.python_version(), "numpy": np.__version__,
+              "matplotlib": matplotlib.__version__, "machine": platform.machine(),
+              "platform": platform.platform(), "time": time.time(), "results": results}
+    with open(args.output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    print("results written to", args.output)
+
+    if args.baseline is None:
+        return 0
+    if args.save_baseline:
+        with open(args.baseline, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print("baseline written to", args.baseline)
+        return 0
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)["results"]
+    slower = regressions(results, baseline, args.tolerance)
+    for name in slower:
+        print("REGRESSION %s: %.4f ms (baseline %.4f ms)" % (name, results[name]["median"],
+                                                             baseline[name]["median"]))
+    if not slower:
+        print("no regressions against", args.baseline)
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from backends import logRawToPPM
+from history import History, HISTORY_FILE, sensorFromFileName
+from recording import loadRecording, writeRecording, RECORDING_EXT
+from archive import writeArchive, ARCHIVE_EXT
+from tiers import writeTiers
+
+"""
+Recalibration of recorded data. Recordings keep the raw ADC value of every
+sample, so their ppm can be recomputed with other calibration values, e.g.
+after the sensor was calibrated again in the options tab.
+
+A calibration file lists from when which values apply, optionally per sensor:
+
+    [{"from": "2024-01-01", "v400": 4010, "v40000": 990},
+     {"from": "2024-03-15 12:00", "sensor": "kitchen", "v400": 4025, "v40000": 985}]
+
+Every sample uses the last entry starting at or before it; samples before
+the first entry, and samples without a raw value (old pickles), keep their
+ppm.
+
+    python calibration.py <calibration.json | --v400 X --v40000 Y> <recordings or directories> ...
+                          [--curve sensorlib|log] [--dry-run] [--jobs N] [--history saves/history.db]
+
+Recordings (.co2r) and archives (.co2a) are rewritten together with their
+minute/hour tiers, one process per file, and their span in the history
+database is replaced. The original of every rewritten file is kept as
+<name>.co2r.bak or <name>.co2a.bak (the first original, a later run doesn't
+replace it); --dry-run only reports what would change.
+
+--curve is the conversion the recordings were made with: sensorlib (the
+default, the hardware's sensorlib.rawToPPM, only importable on the Pi) or
+log for recordings of the synthetic and replay backends.
+"""
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "saves", HISTORY_FILE)
+BACKUP_EXT = ".bak"
+# ppm an archived sample must move by to count as recalibrated
+ARCHIVE_TOLERANCE = 0.1
+
+
+"""
+ppm of arrays of raw values; v400 and v40000 may be arrays too (one value
+per sample). Same two-point logarithmic curve as the simulated backends.
+"""
+def rawToPPM(raw, v400, v40000):
+    return logRawToPPM(np.asarray(raw, dtype=np.float64), np.asarray(v400, dtype=np.float64),
+                       np.asarray(v40000, dtype=np.float64))
+
+
+"""
+array version of sensorlib.rawToPPM, for recordings made with the hardware
+conversion (only importable on the Pi)
+"""
+def sensorlibRawToPPM(raw, v400, v40000):
+    import sensorlib
+    return np.vectorize(sensorlib.rawToPPM, otypes=[np.float64])(raw, v400, v40000)
+
+
+CURVES = {"log": rawToPPM, "sensorlib": sensorlibRawToPPM}
+
+
+def parseTime(text):
+    for format in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return int(datetime.strptime(text, format).timestamp() * 1000)
+        except ValueError:
+            pass
+    raise ValueError("not a date (YYYY-MM-DD [HH:MM]): " + text)
+
+
+"""
+calibration entries as a list of (start epoch ms, sensor or None, v400, v40000)
+"""
+def loadCalibration(path):
+    with open(path) as handle:
+        entries = json.load(handle)
+    return [(parseTime(entry["from"]), entry.get("sensor"), entry["v400"], entry["v40000"]) for entry in entries]
+
+
+"""
+(starts, v400s, v40000s) arrays of the entries applying to sensor, by start
+"""
+def sensorSegments(calibration, sensor):
+    entries = sorted((start, v400, v40000) for start, name, v400, v40000 in calibration if name in (None, sensor))
+    columns = np.array(entries, dtype=np.float64).reshape(-1, 3)
+    return columns[:, 0].astype(np.int64), columns[:, 1], columns[:, 2]
+
+
+"""
+ppm of a recording recalibrated with segments; returns (ppm, header
+calibration). The header gets the values if one entry covers every sample,
+NaN otherwise.
+"""
+def recalibrate(times, raw, ppm, segments, convert=rawToPPM):
+    starts, v400s, v40000s = segments
+    ppm = np.array(ppm, dtype=np.float32)
+    segment = np.searchsorted(starts, times, side="right") - 1
+    # before the first entry, or no raw value to convert
+    apply = (segment >= 0) & ~np.isnan(raw)
+    if apply.any():
+        index = segment[apply]
+        ppm[apply] = convert(np.asarray(raw)[apply], v400s[index], v40000s[index])
+    used = np.unique(segment)
+    if len(used) == 1 and used[0] >= 0:
+        return ppm, (float(v400s[used[0]]), float(v40000s[used[0]]))
+    return ppm, (float("nan"), float("nan"))
+
+
+"""
+rewrites one recording and its tiers, keeping the original as a backup;
+runs in a worker process. Returns (path, sensor, samples changed), with
+dryRun only counting them.
+"""
+def recalibrateFile(path, calibration, curve="sensorlib", dryRun=False):
+    sensor = sensorFromFileName(path)
+    segments = sensorSegments(calibration, sensor)
+    archived = path.endswith(ARCHIVE_EXT)
+    recording = loadRecording(path)
+    if len(recording) == 0 or len(segments[0]) == 0:
+        return path, sensor, 0
+    ppm, (v400, v40000) = recalibrate(recording.time, recording.raw, recording.ppm, segments, CURVES[curve])
+    if archived:
+        # archives keep raw and ppm to two decimals, so with the same calibration
+        # the ppm recomputed from their raw still moves by a few hundredths
+        different = np.abs(ppm - recording.ppm) >= ARCHIVE_TOLERANCE
+    else:
+        different = ppm != recording.ppm
+    # gaps are NaN before and after and don't count
+    changed = int(np.count_nonzero(different & ~np.isnan(ppm)))
+    if changed and not dryRun:
+        header = dict(recording.header, v400=v400, v40000=v40000)
+        times = np.array(recording.time)
+        raw = np.array(recording.raw)
+        # the memory maps must be closed before the file is replaced
+        del recording
+        if not os.path.exists(path + BACKUP_EXT):
+            shutil.copy2(path, path + BACKUP_EXT)
+        # retention and archiving go by the mtime, the data didn't get newer
+        mtime = os.path.getmtime(path)
+        (writeArchive if archived else writeRecording)(path, header, times, ppm, raw)
+        os.utime(path, (mtime, mtime))
+        writeTiers(os.path.splitext(path)[0], times, ppm)
+    return path, sensor, changed
+
+
+def recordingPaths(paths, extensions=(RECORDING_EXT, ARCHIVE_EXT)):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(extensions))
+        elif path.endswith(extensions):
+            found.append(path)
+        else:
+            print("skipped (not a .co2r recording or .co2a archive):", path)
+    if not found:
+        print("no recordings found")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalibrates CO2 recordings from their raw values")
+    parser.add_argument("calibration", nargs="?", help="calibration file (JSON); or give --v400 and --v40000")
+    parser.add_argument("paths", nargs="+", help=".co2r recordings, .co2a archives or directories of them")
+    parser.add_argument("--v400", type=float, help="400 ppm calibration value for all of time")
+    parser.add_argument("--v40000", type=float, help="40000 ppm calibration value for all of time")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--curve", choices=sorted(CURVES), default="sensorlib",
+                        help="raw to ppm conversion the recordings were made with (default sensorlib)")
+    parser.add_argument("--dry-run", action="store_true", help="only report how many samples would change")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="history database to update ('' for none)")
+    args = parser.parse_args()
+    if args.v400 is not None and args.v40000 is not None:
+        # a calibration file name in front of the paths is a path then
+        if args.calibration is not None:
+            args.paths.insert(0, args.calibration)
+        calibration = [(0, None, args.v400, args.v40000)]
+    elif args.calibration is not None:
+        calibration = loadCalibration(args.calibration)
+    else:
+        parser.error("give a calibration file or --v400 and --v40000")
+    if args.curve == "sensorlib":
+        try:
+            import sensorlib
+        except ImportError:
+            parser.error("sensorlib can't be imported here (only on the Pi); recordings of the synthetic or "
+                         "replay backends need --curve log")
+
+    paths = recordingPaths(args.paths)
+    history = None
+    if args.history and os.path.exists(args.history) and not args.dry_run:
+        history = History(args.history)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for path, sensor, changed in pool.map(recalibrateFile, paths, [calibration] * len(paths),
+                                              [args.curve] * len(paths), [args.dry_run] * len(paths)):
+            if args.dry_run:
+                print("%s: %d samples would be recalibrated" % (path, changed))
+                continue
+            print("%s: %d samples recalibrated" % (path, changed))
+            # the database has one writer, this process
+            if changed and history is not None:
+                recording = loadRecording(path)
+                history.replaceSamples(sensor, recording.time, recording.ppm, recording.raw)
+    if history is not None:
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import os
+import signal
+import socket
+import sys
+import threading
+from datetime import datetime
+from acquisition import SensorWorker, SampleHub, encodeSample, DAEMON_PORT
+from settings import setSaveDir, loadSettings, SETTINGS_FILE
+from recording import (RecordingWriter, recoverJournals, compactJournal, openRecording, archiveRecordings,
+                       JOURNAL_EXT)
+from tiers import applyRetention
+from history import History
+from sensors import loadSensors
+from backends import createBackend
+from instrumentation import timings
+from liveserver import LiveFeed, LiveServer, parseAddress
+from alerts import AlertEngine, createSink
+
+"""
+Headless acquisition daemon: samples the sensors, evaluates thresholds and
+records continuously without tkinter or matplotlib. Dashboards attach as
+viewers with "python dashboard.py --attach" and receive every sample over a
+loopback socket, so closing or restarting the GUI leaves no gap in the data.
+
+    python co2daemon.py [port] [--backend synthetic[:rate] | replay:<file>[:speed]]
+                        [--http [host:]port] [--alert log | file:<path> | command:<cmd>] ...
+                        [--filter median:<n> | ema:<n>[:alpha] | kalman:<n>[:q]]
+
+--http also serves the readings to browsers and other remote viewers (see
+liveserver.py). Every --alert adds an alert sink (see alerts.py); without
+any, alerts are logged. --filter reads every sensor in bursts of n and
+records the filtered value (see filters.py).
+"""
+
+
+"""
+Re-reads the settings file whenever the GUI saved new options
+"""
+class Settings:
+    def __init__(self):
+        self.values = loadSettings()
+        self.mtime = self.currentMtime()
+
+    def currentMtime(self):
+        try:
+            return os.path.getmtime(SETTINGS_FILE)
+        except OSError:
+            return None
+
+    def __getitem__(self, name):
+        mtime = self.currentMtime()
+        if mtime != self.mtime:
+            try:
+                self.values = loadSettings()
+            except Exception as e:
+                # keeps the old values and tries again on the next lookup
+                print("settings not reloaded:", e)
+            else:
+                self.mtime = mtime
+        return self.values[name]
+
+
+"""
+Streams every sample to the attached viewers as JSON lines
+"""
+class ViewerServer(threading.Thread):
+    def __init__(self, port, host="127.0.0.1"):
+        threading.Thread.__init__(self, name="ViewerServer", daemon=True)
+        self.listener = socket.create_server((host, port))
+        self.clients = []
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            try:
+                client, address = self.listener.accept()
+            except OSError:
+                return
+            # a viewer that can't take a sample within a second gets dropped
+            client.settimeout(1)
+            print("viewer attached:", address)
+            with self.lock:
+                self.clients.append(client)
+
+    def broadcast(self, sample):
+        line = encodeSample(sample)
+        with self.lock:
+            for client in list(self.clients):
+                try:
+                    client.sendall(line)
+                except OSError:
+                    print("viewer detached")
+                    client.close()
+                    self.clients.remove(client)
+
+    def close(self):
+        self.listener.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+
+
+"""
+Records one sensor every recordingInterval into one journal per day;
+finished days are compacted into columnar recordings and their tiers
+"""
+class Recorder:
+    def __init__(self, settings, sensor, history):
+        self.settings = settings
+        self.sensor = sensor
+        self.history = history
+        self.writer = None
+        self.day = None
+
+    def record(self, sample):
+        if sample.sensor != self.sensor.name:
+            return
+        stamp = datetime.fromtimestamp(sample.time)
+        if stamp.date() != self.day:
+            self.close()
+            pruneRecordings(self.settings, self.history)
+            self.day = stamp.date()
+            v400, v40000 = self.sensor.calibration(self.settings)
+            self.writer = RecordingWriter(stamp.strftime("%y-%m-%d_at_%H-%M") + self.sensor.fileTag() + JOURNAL_EXT,
+                                          v400, v40000, self.settings["recordingInterval"] / 60)
+        self.writer.append(sample)
+
+    def close(self):
+        if self.writer is not None:
+            # a failing close must not leave every later record() writing to it
+            writer, self.writer = self.writer, None
+            path = compactJournal(writer.close())
+            print("recording saved:", path)
+            self.history.importRecording(path, openRecording(path), self.sensor.name)
+
+
+"""
+Archives old raw recordings and deletes raw recordings and minute tiers past
+their retention, in files and history
+"""
+def pruneRecordings(settings, history):
+    for path in archiveRecordings(os.getcwd(), settings["archiveAfterDays"], history):
+        print("archived:", path)
+    for path in applyRetention(os.getcwd(), settings["rawRetentionDays"], settings["minuteRetentionDays"]):
+        print("retention: deleted", path)
+    history.prune(settings["rawRetentionDays"], settings["minuteRetentionDays"])
+
+
+def main(port, backend, liveAddress=None, alertSinks=("log",), filterSpec=None):
+    setSaveDir()
+    for path in recoverJournals(os.getcwd()):
+        print("recovered unfinished recording:", compactJournal(path))
+
+    settings = Settings()
+    # recordings made before (or by the dashboard) go into the history first
+    history = History()
+    for path in history.importDirectory(os.getcwd()):
+        print("added to history:", path)
+    pruneRecordings(settings, history)
+    sensors = loadSensors()
+    worker = SensorWorker(lambda: settings, sensors, backend, filterSpec=filterSpec)
+    hub = SampleHub()
+    server = ViewerServer(port)
+    recorders = [Recorder(settings, sensor, history) for sensor in sensors]
+
+    hub.subscribe(server.broadcast)
+    liveServer = None
+    if liveAddress is not None:
+        host, livePort = liveAddress
+        liveServer = LiveServer(LiveFeed(sensors), livePort, host)
+        liveServer.start(hub)
+    alertEngine = AlertEngine(settings, sensors, [createSink(spec) for spec in alertSinks])
+    hub.subscribe(alertEngine.check)
+    for recorder in recorders:
+        hub.subscribe(recorder.record, lambda: settings["recordingInterval"], gaps=True)
+
+    stopEvent = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopEvent.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopEvent.set())
+    # "kill -USR1" dumps the sensor read timings
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: print("timings saved:", timings.dump(
+            datetime.now().strftime("timings_%y-%m-%d_at_%H-%M-%S.json"))))
+
+    worker.start()
+    server.start()
+    print("co2daemon running, viewers attach on port", port)
+    while not stopEvent.is_set():
+        sample = worker.next(timeout=1)
+        if sample is not None:
+            hub.publish(sample)
+
+    worker.stop()
+    server.close()
+    if liveServer is not None:
+        liveServer.close()
+    for recorder in recorders:
+        recorder.close()
+    history.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    spec = "sensorlib"
+    if "--backend" in args:
+        index = args.index("--backend")
+        spec = args[index + 1]
+        del args[index:index + 2]
+    liveAddress = None
+    if "--http" in args:
+        index = args.index("--http")
+        liveAddress = parseAddress(args[index + 1])
+        del args[index:index + 2]
+    alertSinks = []
+    while "--alert" in args:
+        index = args.index("--alert")
+        alertSinks.append(args[index + 1])
+        del args[index:index + 2]
+    filterSpec = None
+    if "--filter" in args:
+        index = args.index("--filter")
+        filterSpec = args[index + 1]
+        del args[index:index + 2]
+    main(int(args[0]) if args else DAEMON_PORT, createBackend(spec), liveAddress, alertSinks or ["log"], filterSpec)
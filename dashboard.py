@@ -1,62 +1,138 @@
-import matplotlib.pyplot as plt
-import matplotlib.collections as collections
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2Tk)
+import time
+startupBegin = time.perf_counter()
 import numpy as np
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import ttk
 from datetime import datetime
-import pickle
+from collections import deque
 import os
-import sensorlib
-
-optVal = {
-    "v400": 4000,
-    "v40000": 1000,
-    "lowCO2": 413,
-    "highCO2": 2000,
-    "veryHighCO2": 5000,
-    "measurementInterval": 2
-}
+import sys
+import threading
+from acquisition import SensorWorker, DaemonClient, SampleHub, DAEMON_PORT
+from settings import defaults, minimums, setSaveDir, loadSettings, saveSettings
+from sensors import Sensor, loadSensors, DEFAULT_SENSOR
+from backends import createBackend
+from instrumentation import timings
+from decimation import Pyramid
+from graphbuffer import GraphBuffer
+from analytics import RecordingAnalytics, deltas, rollingMean
+from recording import (RecordingWriter, Recording, recoverJournals, compactJournal, openRecording,
+                       loadRecording, readJournal, archiveRecordings, JOURNAL_EXT, RECORDING_EXT)
+from archive import ARCHIVE_EXT
+from tiers import applyRetention, MINUTE_EXT, HOUR_EXT
+from history import History, parseDate
+from liveserver import LiveFeed, LiveServer, parseAddress
+from alerts import AlertEngine, createSink, level
+
+optVal = dict(defaults)
+# all sensors and the one whose graphs/recording are shown
+sensors = [Sensor(DEFAULT_SENSOR)]
+selectedSensor = sensors[0]
+# sensor backend (sensorlib, synthetic or replay); None when attached to a daemon
+backend = None
+# noise filter of oversampled reads (filters.py spec), None reads once per tick
+filterSpec = None
+# long-term sample database (history.py), opened on start-up
+history = None
+# matplotlib is imported in the background by importPlotting() once the
+# window is up; these module names are filled in then
+Figure = None
+collections = None
+mdates = None
+FigureCanvasTkAgg = None
+NavigationToolbar2Tk = None
+plottingReady = threading.Event()
+
 recordingStart = "00-01-01_at_00-00"
 recordingEnd = "00-01-01_at_00-00"
-recorded = []
+# in-memory (epoch ms, ppm) copy of a running recording is bounded, the full
+# data is on disk; a loaded recording is a memory-mapped Recording instead
+maxRecorded = 10080
+recorded = deque(maxlen=maxRecorded)
+# text and colour of the average label per threshold band (alerts.level)
+AVERAGE_LABELS = {"low": ("Average CO2 is low", "lightgreen"), "normal": ("Average CO2 is normal", "green"),
+                  "high": ("Average CO2 is high", "orange"), "very high": ("Average CO2 is very high", "red")}
+LEVEL_COLORS = {"low": "lightgreen", "normal": "green", "high": "orange", "very high": "red"}
+
+
+"""
+a threshold or calibration value of the selected sensor (falls back to optVal)
+"""
+def setting(name):
+    return selectedSensor.get(name, optVal)
+
+"""
+adds recordings not in the history yet (older ones, recovered ones), then
+compresses the old ones into archives; runs in the background on start-up
+"""
+def updateHistory(directory, archiveAfterDays):
+    backgroundHistory = History()
+    backgroundHistory.importDirectory(directory)
+    for path in archiveRecordings(directory, archiveAfterDays, backgroundHistory):
+        print("archived:", path)
+    backgroundHistory.close()
+
+"""
+Imports saved recordings ({sensor: path}) into the history on a background
+thread (with its own connection, other writers may hold the database for a
+while); failures are collected in errors
+"""
+def importRecordings(files, errors):
+    backgroundHistory = History()
+    for name, filename in files.items():
+        try:
+            backgroundHistory.importRecording(filename, openRecording(filename), name)
+        except Exception as e:
+            errors.append("%s: %s" % (filename, e))
+    backgroundHistory.close()
 
+"""
+Returns the current recording as (epoch ms, ppm) arrays
+"""
+def recordedColumns():
+    if isinstance(recorded, Recording):
+        return recorded.time, recorded.ppm
+    columns = np.array(recorded, dtype=float).reshape(-1, 2)
+    return columns[:, 0].astype(np.int64), columns[:, 1]
+
+"""
+date ticks for a recording axis (at most 24, concise local-time labels across days)
+"""
+def setDateTicks(subplot):
+    localZone = datetime.now().astimezone().tzinfo
+    locator = mdates.AutoDateLocator(tz=localZone, maxticks=24)
+    subplot.xaxis.set_major_locator(locator)
+    subplot.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator, tz=localZone))
+
+def importPlotting():
+    global Figure, collections, mdates, FigureCanvasTkAgg, NavigationToolbar2Tk
+    from matplotlib.figure import Figure
+    import matplotlib.collections as collections
+    import matplotlib.dates as mdates
+    from matplotlib.backends.backend_tkagg import (
+        FigureCanvasTkAgg, NavigationToolbar2Tk)
+    plottingReady.set()
 
 """
-Returns specified number of ticks along an axis
+prints how long after start-up a step finished
 """
-def generateTicks(axis, numTicks):
-    tickGap = round(len(axis) / numTicks)
-    ticks = []
-    counter = 0
-    for t in axis:
-        if counter % tickGap == 0:
-            ticks.append(t)
-        counter += 1
-    return ticks
-
-def calculateAvg(values):
-    return int(round(sum(values)/len(values)))
-
-def setSaveDir():
-    localPath = os.path.dirname(os.path.abspath(__file__))
-    print('local directory:', localPath)
-    # if localPath == "":
-    #     localPath = "/home/pi/Documents/sensor"
-    saveDirPath = localPath + "/saves"
-    if not os.path.exists(saveDirPath):
-        print("saves directory not found. Creating...")
-        os.mkdir(saveDirPath)
-    os.chdir(saveDirPath)
-    print("set saves directory as cwd: ", os.getcwd())
+lastStartupMark = startupBegin
+def markStartup(step):
+    global lastStartupMark
+    now = time.perf_counter()
+    print("startup: %-28s %6.2f s (+%.2f s)" % (step, now - startupBegin, now - lastStartupMark))
+    lastStartupMark = now
+
+def formatDuration(ms):
+    minutes = int(ms // 60000)
+    return "%dh %02dm" % (minutes // 60, minutes % 60)
 
 """
 TK Main
 """
 class Main(tk.Frame):
-    def __init__(self, parent, *args, **kwargs):
+    def __init__(self, parent, sampleSource=None, *args, **kwargs):
         tk.Frame.__init__(self, parent, *args, **kwargs)
         self.configure(background='white')
         # GUI Values
@@ -66,21 +142,144 @@ class Main(tk.Frame):
         self.title = parent.wm_title("CO2 Dashboard")
         # self.minimum_size = parent.minsize(width=self.width, height=self.height)
 
-        menubar = ttk.Notebook(master=root)
-
+        # sensor reads happen on the worker thread (or in an attached daemon), the
+        # Tk loop only drains its queue and fans each sample out through the hub
+        self.sampleHub = SampleHub()
+        if sampleSource is None:
+            sampleSource = SensorWorker(lambda: optVal, sensors, backend, filterSpec=filterSpec)
+        self.sampleSource = sampleSource
+        self.sampleSource.start()
+        self.firstSample = True
+        self.drainDue = None
+        self.drainSamples()
+
+        # with more than one sensor a selector picks the one the tabs show
+        if len(sensors) > 1:
+            self.sensorChoice = ttk.Combobox(master=root, state="readonly",
+                                             values=[sensor.name for sensor in sensors])
+            self.sensorChoice.current(sensors.index(selectedSensor))
+            self.sensorChoice.bind("<<ComboboxSelected>>", lambda event: self.selectSensor())
+            self.sensorChoice.pack(anchor=tk.W, padx=10, pady=5)
+
+        self.menubar = ttk.Notebook(master=root)
+
+        # only the live dashboard is built up front; the other tabs start as
+        # placeholders and are built once plotting is available
         self.dashboardTab = DashboardTab(root)
-        self.optionsTab = OptionsTab(root)
-        self.recordTab = RecordingTab(root)
+        self.recordTab = None
+        self.optionsTab = None
+        self.placeholder = {}
+        for name, text in (("record", "Recording"), ("options", "Options & Calibration")):
+            self.placeholder[name] = tk.Frame(root, background="white")
+            ttk.Label(master=self.placeholder[name], text="Loading...").pack(padx=50, pady=50)
+
+        self.menubar.add(self.dashboardTab, text="Live Dashboard")
+        self.menubar.add(self.placeholder["record"], text="Recording")
+        self.menubar.add(self.placeholder["options"], text="Options & Calibration")
+        self.menubar.pack()
+        renderer.attach(self.menubar)
+        self.menubar.bind("<<NotebookTabChanged>>", lambda event: self.buildSelectedTab(), add="+")
+
+        self.sampleHub.subscribe(self.dashboardTab.autoUpdate, 5)
+
+        # performance overlay: F12 shows/hides it, Ctrl+F12 dumps the timings to a file
+        self.perfOverlay = tk.Label(master=root, justify=tk.LEFT, anchor=tk.W, font=("TkFixedFont", 9),
+                                    background="lightyellow")
+        self.perfOverlayShown = False
+        root.bind("<F12>", lambda event: self.togglePerfOverlay())
+        root.bind("<Control-F12>", lambda event: self.dumpTimings())
+
+        root.update_idletasks()
+        markStartup("dashboard shown")
+
+        threading.Thread(target=importPlotting, name="importPlotting", daemon=True).start()
+        self.waitForPlotting()
+
+    def waitForPlotting(self):
+        if not plottingReady.is_set():
+            self.after(20, self.waitForPlotting)
+            return
+        markStartup("matplotlib imported")
+        self.dashboardTab.buildGraphs()
+        markStartup("dashboard graphs built")
+        # the remaining tabs are built one per idle slot so the GUI stays responsive
+        self.after_idle(lambda: self.buildTab("record"))
+        self.after_idle(lambda: self.buildTab("options"))
+
+    def buildSelectedTab(self):
+        for name, placeholder in self.placeholder.items():
+            if self.menubar.select() == str(placeholder):
+                self.buildTab(name)
+
+    """
+    replaces a placeholder with its real tab
+    """
+    def buildTab(self, name):
+        if name not in self.placeholder or not plottingReady.is_set():
+            return
+        placeholder = self.placeholder.pop(name)
+        if name == "record":
+            tab = self.recordTab = RecordingTab(root)
+            text = "Recording"
+            # missed measurement intervals are recorded as explicit (NaN) gaps
+            self.sampleHub.subscribe(tab.autoUpdate, lambda: optVal["recordingInterval"], gaps=True)
+        else:
+            tab = self.optionsTab = OptionsTab(root)
+            text = "Options & Calibration"
+            self.sampleHub.subscribe(tab.autoUpdate, 5)
+        selected = self.menubar.select() == str(placeholder)
+        self.menubar.insert(placeholder, tab, text=text)
+        self.menubar.forget(placeholder)
+        placeholder.destroy()
+        if selected:
+            self.menubar.select(tab)
+        markStartup(text + " tab built")
+
+    """
+    moves samples from the acquisition queue into the Tk thread
+    """
+    def drainSamples(self):
+        # how late the Tk loop ran us is the best measure of event loop stalls
+        if self.drainDue is not None:
+            timings.drift("drainSamples", self.drainDue)
+        for sample in self.sampleSource.drain():
+            if self.firstSample:
+                markStartup("first reading")
+                self.firstSample = False
+            self.sampleHub.publish(sample)
+        self.drainDue = time.monotonic() + 0.25
+        self.after(250, self.drainSamples)
+
+    def togglePerfOverlay(self):
+        self.perfOverlayShown = not self.perfOverlayShown
+        if self.perfOverlayShown:
+            self.perfOverlay.place(relx=0, rely=1, anchor=tk.SW)
+            self.perfOverlay.lift()
+            self.perfOverlayUpdate()
+        else:
+            self.perfOverlay.place_forget()
+
+    def perfOverlayUpdate(self):
+        if not self.perfOverlayShown:
+            return
+        self.perfOverlay.config(text=timings.report() or "no timings yet")
+        self.after(1000, self.perfOverlayUpdate)
 
-        menubar.add(self.dashboardTab, text="Live Dashboard")
-        menubar.add(self.recordTab, text="Recording")
-        menubar.add(self.optionsTab, text="Options & Calibration")
-        menubar.pack()
+    def dumpTimings(self):
+        path = timings.dump(datetime.now().strftime("timings_%y-%m-%d_at_%H-%M-%S.json"))
+        print("timings saved: " + os.path.join(os.getcwd(), path))
 
     def updateAllFrames(self):
-        self.dashboardTab.uiUpdate()
-        self.optionsTab.uiUpdate()
-        self.recordTab.uiUpdate()
+        for tab in (self.dashboardTab, self.optionsTab, self.recordTab):
+            if tab is not None:
+                tab.uiUpdate()
+
+    def selectSensor(self):
+        global selectedSensor
+        selectedSensor = sensors[self.sensorChoice.current()]
+        for tab in (self.dashboardTab, self.optionsTab, self.recordTab):
+            if tab is not None:
+                tab.selectSensor()
 
 
 class DashboardTab(tk.Frame):
@@ -100,28 +299,16 @@ class DashboardTab(tk.Frame):
         self.graphAutoUpdateTime = 1000
 
 
-        # CO2 Graph init
-        self.graphCO2 = UIGraph(self, "Time (s)", "CO2 (ppm)", -600, 0, step=5, row=0, column=0, rowspan=1, columnspan=5, figx = 15)
-        self.graphCO2.addHLine("veryHighCO2", "r", "solid", "very high")
-        self.graphCO2.addHLine("highCO2", "orange", "dashed", "high")
-        self.graphCO2.addHLine("lowCO2", "g", "dashed", "normal")
-        self.graphCO2.enableBars()
-        self.graphCO2.enableLegend()
-        self.graphCO2.setYAxis(0, 8000)
-        self.graphCO2.updatePlot()
-
-
+        # graphs are built by buildGraphs once matplotlib is imported
+        self.graphCO2 = None
+        self.graphCO2Delta = None
+        # sensor name -> (co2 buffer, delta buffer); the graphs show the selected one
+        self.buffers = {}
+        self.lastRead = {}
 
         # Seperator
         ttk.Separator(master=self, orient=tk.HORIZONTAL).grid(row=1, column=0, columnspan=12, sticky=tk.E + tk.W)
 
-        # CO2 Delta Graph init
-        self.graphCO2Delta = UIGraph(self, "Time (s)", "\u0394 CO2 (ppm)", -300, 0, step=5, row=2, column=0, rowspan=5, columnspan=2, figx = 9, figy=2)
-        self.graphCO2Delta.zeroLine = True
-        # self.graphCO2Delta.addHLine(0, "grey")
-        self.lastRead = 0
-        self.graphCO2Delta.updatePlot()
-
         # Seperator
         # ttk.Separator(master=self, orient=tk.VERTICAL).grid(row=0, column=1, rowspan=10, sticky=tk.N+tk.S)
         ttk.Label(master=self, text="Averages over the last 10 minutes").grid(column=2, columnspan=2, row=2, sticky=tk.E+tk.W, padx=105, pady=0)
@@ -156,57 +343,110 @@ class DashboardTab(tk.Frame):
         self.updatePlotButton = ttk.Button(master=self, text="Clear", command=self.clear)
         self.updatePlotButton.grid(row=3, column=4, sticky=tk.N+tk.S+tk.W+tk.E, padx=10, pady=7)
 
+        # latest reading of every sensor, colored by its own thresholds
+        self.overview = {}
+        if len(sensors) > 1:
+            overviewFrame = tk.Frame(master=self, background="white")
+            overviewFrame.grid(row=4, column=4, rowspan=3, sticky=tk.N + tk.W, padx=10)
+            for sensor in sensors:
+                label = tk.Label(master=overviewFrame, text=sensor.name + ": -", width=20)
+                label.pack(anchor=tk.W, pady=2)
+                self.overview[sensor.name] = (sensor, label)
 
         self.lastUpdateTime = datetime.now()
-        self.autoUpdate()
 
-    def clear(self):
-        self.graphCO2.buffer.clear()
-        self.graphCO2Delta.buffer.clear()
-        self.graphCO2.updatePlot()
-        self.graphCO2Delta.updatePlot()
-        self.lastRead = 0
-
-    def graphTick(self):
-        read = sensorlib.readPPM(optVal["v400"], optVal["v40000"])
-        self.graphCO2.appendToBuffer(read)
-        self.graphCO2Delta.appendToBuffer((read - self.lastRead))
-        self.lastRead = read
+    def buildGraphs(self):
+        # CO2 Graph init
+        self.graphCO2 = UIGraph(self, "Time (s)", "CO2 (ppm)", -600, 0, step=5, row=0, column=0, rowspan=1, columnspan=5, figx = 15)
+        self.graphCO2.addHLine("veryHighCO2", "r", "solid", "very high")
+        self.graphCO2.addHLine("highCO2", "orange", "dashed", "high")
+        self.graphCO2.addHLine("lowCO2", "g", "dashed", "normal")
+        self.graphCO2.enableBars()
+        self.graphCO2.enableLegend()
+        self.graphCO2.setYAxis(0, 8000)
+        self.graphCO2.requestRedraw()
+
+        # CO2 Delta Graph init
+        self.graphCO2Delta = UIGraph(self, "Time (s)", "\u0394 CO2 (ppm)", -300, 0, step=5, row=2, column=0, rowspan=5, columnspan=2, figx = 9, figy=2)
+        self.graphCO2Delta.zeroLine = True
+        # self.graphCO2Delta.addHLine(0, "grey")
+        self.graphCO2Delta.requestRedraw()
 
+        for sensor in sensors:
+            self.buffers[sensor.name] = tuple(GraphBuffer(graph.buffer.length, graph.buffer.step)
+                                              for graph in (self.graphCO2, self.graphCO2Delta))
+            self.lastRead[sensor.name] = 0
+        self.selectSensor()
+
+    """
+    points the graphs at the selected sensor's buffers
+    """
+    def selectSensor(self):
+        if self.graphCO2 is None:
+            return
+        self.graphCO2.buffer, self.graphCO2Delta.buffer = self.buffers[selectedSensor.name]
         self.uiUpdate()
 
+    def clear(self):
+        if self.graphCO2 is None:
+            return
+        for name, (co2Buffer, deltaBuffer) in self.buffers.items():
+            co2Buffer.clear()
+            deltaBuffer.clear()
+            self.lastRead[name] = 0
+        self.graphCO2.requestRedraw()
+        self.graphCO2Delta.requestRedraw()
+
+    @timings.timed("graphTick")
+    def graphTick(self, sample):
+        if sample.sensor not in self.buffers:
+            return
+        read = sample.ppm
+        co2Buffer, deltaBuffer = self.buffers[sample.sensor]
+        co2Buffer.append(read)
+        deltaBuffer.append(read - self.lastRead[sample.sensor])
+        self.lastRead[sample.sensor] = read
+
+        # other sensors only fill their buffers until they are selected
+        if sample.sensor == selectedSensor.name:
+            self.uiUpdate()
+
+    def overviewUpdate(self, sample):
+        if sample.sensor not in self.overview:
+            return
+        sensor, label = self.overview[sample.sensor]
+        label.config(text="%s: %d ppm" % (sample.sensor, sample.ppm),
+                     bg=LEVEL_COLORS[level(sample.ppm, sensor, optVal)])
+
     def uiUpdate(self):
-        self.graphCO2.updatePlot()
-        self.graphCO2Delta.updatePlot()
+        if self.graphCO2 is None:
+            return
+        self.graphCO2.requestRedraw()
+        self.graphCO2Delta.requestRedraw()
         self.avgUpdate()
 
-    def autoUpdate(self):
-        if self.graphAutoUpdateIsRun.get():
-            self.graphTick()
-        self.after(5000, self.autoUpdate)
+    @timings.timed("DashboardTab.autoUpdate")
+    def autoUpdate(self, sample):
+        self.overviewUpdate(sample)
+        if self.graphAutoUpdateIsRun.get() and self.graphCO2 is not None:
+            self.graphTick(sample)
 
     def graphAutoUpdateToggle(self):
         self.graphAutoUpdateIsRun = not self.graphAutoUpdateIsRun
 
     def avgUpdate(self):
         # update avg
-        avgCO2 = calculateAvg(self.graphCO2.buffer.buffer)
+        avgCO2 = int(round(self.graphCO2.buffer.mean()))
         self.entry["avgCO2"].configure(state="normal")
         self.entry["avgCO2"].delete(0, tk.END)
         self.entry["avgCO2"].insert(0, avgCO2)
         self.entry["avgCO2"].configure(state="readonly")
 
         # color avg label
-        if avgCO2 <= optVal["lowCO2"]:
-            self.warningLabel["avgCO2"].config(text="Average CO2 is low", bg="lightgreen")
-        elif avgCO2 < optVal["highCO2"]:
-            self.warningLabel["avgCO2"].config(text="Average CO2 is normal", bg="green")
-        elif avgCO2 >= optVal["highCO2"]:
-            self.warningLabel["avgCO2"].config(text="Average CO2 is high", bg="orange")
-        elif avgCO2 >= optVal["veryHighCO2"]:
-            self.warningLabel["avgCO2"].config(text="Average CO2 is very high", bg="red")
-
-        avgDeltaCO2 = calculateAvg(self.graphCO2Delta.buffer.buffer)
+        text, color = AVERAGE_LABELS[level(avgCO2, selectedSensor, optVal)]
+        self.warningLabel["avgCO2"].config(text=text, bg=color)
+
+        avgDeltaCO2 = int(round(self.graphCO2Delta.buffer.mean()))
         self.entry["avgDeltaCO2"].configure(state="normal")
         self.entry["avgDeltaCO2"].delete(0, tk.END)
         self.entry["avgDeltaCO2"].insert(0, avgDeltaCO2)
@@ -237,14 +477,23 @@ class RecordingTab(tk.Frame):
         self.state = "loaded"
 
         # Graphs innit
-        self.figure1 = plt.Figure(figsize=(15, 4), dpi=100)
-        self.figure2 = plt.Figure(figsize=(9, 2), dpi=100)
+        self.figure1 = Figure(figsize=(15, 4), dpi=100)
+        self.figure2 = Figure(figsize=(9, 2), dpi=100)
         self.subplot1 = self.figure1.add_subplot(111)
         self.subplot2 = self.figure2.add_subplot(111)
-        self.canvas1 = FigureCanvasTkAgg(self.figure1, master=self)
+        # co2 plot shares its frame with the zoom/pan toolbar
+        self.plotFrame = tk.Frame(master=self, background="white")
+        self.canvas1 = FigureCanvasTkAgg(self.figure1, master=self.plotFrame)
         self.canvas2 = FigureCanvasTkAgg(self.figure2, master=self)
-        self.canvas1.get_tk_widget().grid(row=0, column=0, rowspan=1, columnspan=6)
+        self.toolbar = NavigationToolbar2Tk(self.canvas1, self.plotFrame, pack_toolbar=False)
+        self.canvas1.get_tk_widget().pack(side=tk.TOP)
+        self.toolbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.plotFrame.grid(row=0, column=0, rowspan=1, columnspan=6)
         self.canvas2.get_tk_widget().grid(row=2, column=0, rowspan=4, columnspan=1)
+        # mouse wheel zooms around the cursor
+        self.canvas1.mpl_connect("scroll_event", self.onScroll)
+        # visible (start, end) in epoch ms; None shows the whole recording
+        self.view = None
 
 
 
@@ -290,16 +539,23 @@ class RecordingTab(tk.Frame):
         self.endRecordingButton = ttk.Button(master=self, text="End Recording & Save", command=self.stopRecording)
         self.endRecordingButton.grid(row=5, rowspan=1, column=5, sticky=tk.N+tk.S+tk.W+tk.E, padx=10, pady=7)
 
+        self.historyButton = ttk.Button(master=self, text="History", command=self.browseHistory)
+        self.historyButton.grid(row=6, rowspan=1, column=5, sticky=tk.N+tk.S+tk.W+tk.E, padx=10, pady=7)
+
         # Set button states
         self.updateButtonStates()
 
-        self.plotCO2Update()
-        self.plotCO2DeltaUpdate()
+        self.uiUpdate()
         self.clear()
 
         self.recording = False
-        # auto ui-updates
-        self.autoUpdate()
+        # sensor name -> journal writer while recording, -> saved file afterwards
+        self.writers = {}
+        self.files = {}
+        self.pyramid = None
+        self.deltaPyramid = None
+        self.pyramidKey = None
+        self.analytics = None
 
     """
     enables/disables buttons according to frame state
@@ -308,18 +564,21 @@ class RecordingTab(tk.Frame):
         if self.state == "clear":
             self.clearButton.config(state="disabled")
             self.loadButton.config(state="enabled")
+            self.historyButton.config(state="enabled")
             self.startRecordingButton.config(state="enabled")
             self.endRecordingButton.config(state="disabled")
 
         elif self.state == "loaded":
             self.clearButton.config(state="enabled")
             self.loadButton.config(state="enabled")
+            self.historyButton.config(state="enabled")
             self.startRecordingButton.config(state="disabled")
             self.endRecordingButton.config(state="disabled")
 
         elif self.state == "recording":
             self.clearButton.config(state="disabled")
             self.loadButton.config(state="disabled")
+            self.historyButton.config(state="disabled")
             self.startRecordingButton.config(state="disabled")
             self.endRecordingButton.config(state="enabled")
 
@@ -335,7 +594,10 @@ class RecordingTab(tk.Frame):
             self.updateButtonStates()
             # clear internal recording data
             global recorded
-            recorded = []
+            recorded = deque(maxlen=maxRecorded)
+            self.files = {}
+            self.analytics = None
+            self.resetView()
 
             # clear plots
             self.subplot1.cla()
@@ -364,28 +626,57 @@ class RecordingTab(tk.Frame):
             self.warningLabel["avgCO2"].config(text="Start or load a recording to gain average evaluation", bg="white")
             self.warningLabel["avgDeltaCO2"].config(text="Start or load a recording to gain average evaluation", bg="white")
 
+    """
+    finishes the recording journals (samples are already on disk), converts
+    them to columnar recordings and maps the selected sensor's one back in
+    """
     def save(self):
-        filename = recordingStart + ".pickle"
-        with open(filename, 'wb') as handle:
-            pickle.dump(recorded, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        global recorded
+        self.files = {name: compactJournal(writer.close()) for name, writer in self.writers.items()}
+        self.writers = {}
+        if history is not None:
+            errors = []
+            importThread = threading.Thread(target=importRecordings, args=(dict(self.files), errors),
+                                            name="importRecordings", daemon=True)
+            importThread.start()
+            self.after(500, self.reportImport, importThread, errors)
+        recorded = openRecording(self.files.get(selectedSensor.name, next(iter(self.files.values()))))
+        for filename in self.files.values():
             print("Recording saved: "+os.getcwd()+"\\"+filename)
-            tk.messagebox.showinfo(title="Recording saved",
-                                   message="Recording was saved at: "+os.getcwd()+"\\"+filename)
+        tk.messagebox.showinfo(title="Recording saved",
+                               message="Recording was saved at: "+os.getcwd()+"\\"
+                                       + ", ".join(self.files.values()))
+
+    """
+    waits for the history import of save() without blocking the Tk loop
+    """
+    def reportImport(self, importThread, errors):
+        if importThread.is_alive():
+            self.after(500, self.reportImport, importThread, errors)
+        elif errors:
+            tk.messagebox.showwarning(title="History import failed", message="\n".join(errors))
+        else:
+            print("Recording added to history")
 
     def load(self):
         if self.state == "loaded" or self.state == "clear":
             global recorded
             # tk file picker
             filename = filedialog.askopenfilename(initialdir=os.getcwd(), title="Select file",
-                                                       filetypes=(("pickle files", "*.pickle"), ("all files", "*.*")))
+                                                       filetypes=(("recordings", "*" + RECORDING_EXT + " *" + ARCHIVE_EXT),
+                                                                  ("recording journals", "*" + JOURNAL_EXT),
+                                                                  ("minute/hour averages",
+                                                                   "*" + MINUTE_EXT + " *" + HOUR_EXT),
+                                                                  ("pickle files", "*.pickle"), ("all files", "*.*")))
             # Check if file exists
             if filename != "":
                 if os.path.exists(filename):
-                    with open(filename, 'rb') as handle:
-                        recorded = pickle.load(handle)
+                    recorded = loadRecording(filename)
+                    self.files = {}
+                    self.analytics = None
+                    self.resetView()
 
-                    self.plotCO2Update()
-                    self.plotCO2DeltaUpdate()
+                    self.uiUpdate()
 
                     self.state = "loaded"
                     self.updateButtonStates()
@@ -393,20 +684,102 @@ class RecordingTab(tk.Frame):
                     tk.messagebox.showerror(title="Failed to load file",
                                    message="Failed to load file: file does not exist")
 
+    """
+    dialog picking a sensor and a date range from the history database
+    """
+    def browseHistory(self):
+        if history is None or self.state == "recording":
+            return
+        names = history.sensors()
+        if not names:
+            tk.messagebox.showinfo(title="History", message="No recordings in the history yet")
+            return
+        dialog = tk.Toplevel(self)
+        dialog.title("History")
+        sensorChoice = ttk.Combobox(master=dialog, values=names, state="readonly")
+        sensorChoice.current(names.index(selectedSensor.name) if selectedSensor.name in names else 0)
+        sensorChoice.grid(row=0, column=1, sticky=tk.W, padx=10, pady=5)
+        ttk.Label(master=dialog, text="Sensor:").grid(row=0, column=0, sticky=tk.E, padx=10, pady=5)
+        entries = {}
+        today = datetime.now()
+        initial = {"from": datetime.fromtimestamp(today.timestamp() - 7 * 86400), "to": today}
+        for row, name in enumerate(("from", "to"), 1):
+            ttk.Label(master=dialog, text=name.capitalize() + " (YYYY-MM-DD):").grid(row=row, column=0, sticky=tk.E,
+                                                                                      padx=10, pady=5)
+            entries[name] = ttk.Entry(master=dialog, width=12)
+            entries[name].insert(0, initial[name].strftime("%Y-%m-%d"))
+            entries[name].grid(row=row, column=1, sticky=tk.W, padx=10, pady=5)
+
+        def show():
+            try:
+                start = parseDate(entries["from"].get())
+                end = parseDate(entries["to"].get()) + 86400000
+            except ValueError:
+                tk.messagebox.showerror(title="History", message="Dates must be given as YYYY-MM-DD")
+                return
+            dialog.destroy()
+            self.showHistory(sensorChoice.get(), start, end)
+        ttk.Button(master=dialog, text="Show", command=show).grid(row=3, column=0, columnspan=2, sticky=tk.W + tk.E,
+                                                                 padx=10, pady=5)
+
+    """
+    shows a time range of one sensor from the history database
+    """
+    def showHistory(self, sensor, start, end):
+        global recorded
+        times, ppm = history.range(sensor, start, end)
+        if len(times) < 2:
+            tk.messagebox.showwarning(title="History", message="No samples of " + sensor + " in that range")
+            return
+        header = {"v400": float("nan"), "v40000": float("nan"), "measurementInterval": float("nan")}
+        recorded = Recording(header, times, ppm, np.full(len(times), np.nan, dtype="<f4"))
+        self.files = {}
+        self.analytics = None
+        self.resetView()
+        self.uiUpdate()
+        self.state = "loaded"
+        self.updateButtonStates()
+
     def uiUpdate(self):
+        renderer.markDirty(self, self, self.plotUpdate)
+
+    """
+    shows the selected sensor's part of a running or just saved recording
+    """
+    def selectSensor(self):
+        global recorded
+        if selectedSensor.name in self.writers:
+            # refill the bounded in-memory copy from that sensor's journal
+            header, records = readJournal(self.writers[selectedSensor.name].partPath)
+            recorded = deque(zip(records["time"].tolist(), records["ppm"].tolist()), maxlen=maxRecorded)
+        elif selectedSensor.name in self.files:
+            recorded = openRecording(self.files[selectedSensor.name])
+        self.analytics = None
+        self.resetView()
+        self.uiUpdate()
+
+    @timings.timed("RecordingTab.plotUpdate")
+    def plotUpdate(self):
         self.plotCO2Update()
         self.plotCO2DeltaUpdate()
 
 
-    def autoUpdate(self):
+    @timings.timed("RecordingTab.autoUpdate")
+    def autoUpdate(self, sample):
         if self.recording:
-            self.recordCurrentMeasurement()
+            self.recordCurrentMeasurement(sample)
             self.uiUpdate()
-        self.after(optVal["measurementInterval"]*60000, self.autoUpdate)
 
-    def recordCurrentMeasurement(self):
+    def recordCurrentMeasurement(self, sample):
         global recorded
-        recorded.append((datetime.now().strftime("%H:%M"), sensorlib.readPPM(optVal["v400"], optVal["v40000"])))
+        if sample.sensor not in self.writers:
+            return
+        self.writers[sample.sensor].append(sample)
+        if sample.sensor != selectedSensor.name:
+            return
+        recorded.append((int(round(sample.time * 1000)), sample.ppm))
+        if self.analytics is not None:
+            self.analytics.extend([recorded[-1][0]], [sample.ppm])
 
     def startRecording(self):
         if self.state == "clear":
@@ -415,6 +788,11 @@ class RecordingTab(tk.Frame):
             # set global recording start date&time
             global recordingStart
             recordingStart = datetime.now().strftime("%y-%m-%d_at_%H-%M")
+            # every sample is appended to its sensor's journal as it arrives
+            for sensor in sensors:
+                v400, v40000 = sensor.calibration(optVal)
+                self.writers[sensor.name] = RecordingWriter(recordingStart + sensor.fileTag() + JOURNAL_EXT,
+                                                            v400, v40000, optVal["recordingInterval"] / 60)
             self.state = "recording"
             self.recording = True
 
@@ -424,8 +802,12 @@ class RecordingTab(tk.Frame):
             global recordingEnd
             recordingEnd = datetime.now().strftime("%y-%m-%d_at_%H-%M")
             self.recording = False
-            # Check if saving recording makes sense
-            if len(recorded) >= 2:
+            # Check if saving recording makes sense (per sensor)
+            for name, writer in list(self.writers.items()):
+                if writer.count < 2:
+                    writer.discard()
+                    del self.writers[name]
+            if self.writers:
                 self.state = "loaded"
                 self.updateButtonStates()
                 self.save()
@@ -437,31 +819,95 @@ class RecordingTab(tk.Frame):
 
 
 
+    """
+    min/max pyramids of the current recording and of its deltas, rebuilt only
+    when the recording changed
+    """
+    def getPyramids(self, times, values):
+        key = (id(recorded), len(recorded), int(times[-1]))
+        if self.pyramidKey != key:
+            self.pyramid = Pyramid(times, values)
+            self.deltaPyramid = Pyramid(times[1:], deltas(values))
+            self.pyramidKey = key
+        return self.pyramid, self.deltaPyramid
+
+    """
+    analytics of the whole recording; built in one pass when a recording is
+    loaded or the thresholds change, then extended sample by sample
+    """
+    def getAnalytics(self):
+        thresholds = (setting("lowCO2"), setting("highCO2"), setting("veryHighCO2"))
+        if self.analytics is None or self.analytics.thresholds != thresholds:
+            self.analytics = RecordingAnalytics(*thresholds)
+            if selectedSensor.name in self.writers:
+                # the in-memory copy is bounded, the journal has every sample
+                header, records = readJournal(self.writers[selectedSensor.name].partPath)
+                self.analytics.extend(records["time"], records["ppm"])
+            else:
+                self.analytics.extend(*recordedColumns())
+        return self.analytics
+
+    """
+    (start, end) in epoch ms of the part of the recording being shown
+    """
+    def visibleRange(self, times):
+        if self.view is None:
+            return int(times[0]), int(times[-1])
+        return self.view
+
+    """
+    called when zoom/pan changed the co2 plot's x range; re-queries both plots
+    """
+    def onViewChanged(self, subplot):
+        start, end = subplot.get_xlim()
+        self.view = (int(mdates.num2date(start).timestamp() * 1000), int(mdates.num2date(end).timestamp() * 1000))
+        self.uiUpdate()
+
+    def onScroll(self, event):
+        if event.inaxes is not self.subplot1 or event.xdata is None:
+            return
+        scale = 0.8 if event.button == "up" else 1.25
+        start, end = self.subplot1.get_xlim()
+        self.subplot1.set_xlim(event.xdata - (event.xdata - start) * scale,
+                               event.xdata + (end - event.xdata) * scale)
+
+    """
+    shows the whole recording again and forgets the toolbar's view history
+    """
+    def resetView(self):
+        self.view = None
+        self.toolbar.update()
+
     """
     Draws co2 plot and updates avg co2 entry
     """
     def plotCO2Update(self):
         if len(recorded) >= 2:
             # recorded data conversion
-            timestamps = np.array([t for t, v in recorded])
-            values = np.array([v for t, v in recorded])
+            times, values = recordedColumns()
+            pyramid, deltaPyramid = self.getPyramids(times, values)
+            start, end = self.visibleRange(times)
+            # one min/max bucket per pixel column of the visible range keeps the draw cost constant
+            plotTimes, plotValues = pyramid.envelope(int(self.figure1.bbox.width), start, end)
+            timestamps = plotTimes.astype("datetime64[ms]")
+            analytics = self.getAnalytics()
 
             # clear & plot
             self.subplot1.cla()
-            self.subplot1.plot(timestamps, values, label="Gradient")
+            self.subplot1.plot(timestamps, plotValues, label="Gradient")
             # set margins
-            maxVal = np.amax(values)
+            maxVal = pyramid.max()
             maxVal = maxVal * 1.1
-            if maxVal < optVal["veryHighCO2"]:
-                 maxVal = optVal["veryHighCO2"]*1.1
+            if maxVal < setting("veryHighCO2"):
+                 maxVal = setting("veryHighCO2")*1.1
             self.subplot1.set_ylim(ymin = 0, ymax = maxVal)
 
             # hlines
-            self.subplot1.hlines(optVal["veryHighCO2"], timestamps[0], timestamps[-1],
-                                 "red", "solid", "Very High")
-            self.subplot1.hlines(optVal["highCO2"], timestamps[0], timestamps[-1],
-                                 "orange", "dashed", "High")
-            self.subplot1.hlines(optVal["lowCO2"], timestamps[0], timestamps[-1],
+            self.subplot1.hlines(setting("veryHighCO2"), timestamps[0], timestamps[-1],
+                                 "red", "solid", "Very High (" + formatDuration(analytics.timeAboveVeryHigh) + ")")
+            self.subplot1.hlines(setting("highCO2"), timestamps[0], timestamps[-1],
+                                 "orange", "dashed", "High (" + formatDuration(analytics.timeAboveHigh) + ")")
+            self.subplot1.hlines(setting("lowCO2"), timestamps[0], timestamps[-1],
                                  "green", "dashed", "Normal")
 
             # margins & labels
@@ -470,41 +916,43 @@ class RecordingTab(tk.Frame):
             self.subplot1.set_xlabel("time")
                 
             # fills
-            zeroLine = [0 in range(len(values))]
-            self.subplot1.fill_between(timestamps, values, zeroLine,
-                                       where=values > optVal["highCO2"], color="orange", alpha=0.3)
-            self.subplot1.fill_between(timestamps, values, zeroLine,
-                                       where=values > optVal["veryHighCO2"], color="red", alpha=0.3)
+            zeroLine = [0 in range(len(plotValues))]
+            self.subplot1.fill_between(timestamps, plotValues, zeroLine,
+                                       where=plotValues > setting("highCO2"), color="orange", alpha=0.3)
+            self.subplot1.fill_between(timestamps, plotValues, zeroLine,
+                                       where=plotValues > setting("veryHighCO2"), color="red", alpha=0.3)
+
+            # peaks of the events above highCO2 in view
+            events = analytics.eventsBetween(start, end)
+            if events:
+                self.subplot1.plot(np.array([e["peakTime"] for e in events], dtype="datetime64[ms]"),
+                                   [e["peak"] for e in events], "v", color="red", label="Peaks")
 
-            # manual xticks as matplotlib is retarded x2
-            if len(timestamps) > 24:
-                self.subplot1.set_xticks(generateTicks(timestamps, 24))
+            setDateTicks(self.subplot1)
 
             # legend
             self.subplot1.legend()
 
             # grid, axis label tilt, tight layout & draw
             self.subplot1.grid()
+            self.subplot1.set_xlim(np.datetime64(start, "ms"), np.datetime64(end, "ms"))
             self.figure1.autofmt_xdate()
             self.figure1.tight_layout()
             self.canvas1.draw()
+            # cla() drops axes callbacks, so listen for zoom/pan again
+            self.subplot1.callbacks.connect("xlim_changed", self.onViewChanged)
 
-            # update avg
-            avgCO2 = calculateAvg(values)
-            self.entry["avgCO2"].configure(state="normal")
-            self.entry["avgCO2"].delete(0, tk.END)
-            self.entry["avgCO2"].insert(0, avgCO2)
-            self.entry["avgCO2"].configure(state="readonly")
+            # update avg (a recording of gaps only has none)
+            if not np.isnan(analytics.mean()):
+                avgCO2 = int(round(analytics.mean()))
+                self.entry["avgCO2"].configure(state="normal")
+                self.entry["avgCO2"].delete(0, tk.END)
+                self.entry["avgCO2"].insert(0, avgCO2)
+                self.entry["avgCO2"].configure(state="readonly")
 
-            # color avg label
-            if avgCO2 <= optVal["lowCO2"]:
-                self.warningLabel["avgCO2"].config(text="Average CO2 is low", bg="lightgreen")
-            elif avgCO2 < optVal["highCO2"]:
-                self.warningLabel["avgCO2"].config(text="Average CO2 is normal", bg="green")
-            elif avgCO2 >= optVal["highCO2"]:
-                self.warningLabel["avgCO2"].config(text="Average CO2 is high", bg="orange")
-            elif avgCO2 >= optVal["veryHighCO2"]:
-                self.warningLabel["avgCO2"].config(text="Average CO2 is very high", bg="red")
+                # color avg label
+                text, color = AVERAGE_LABELS[level(avgCO2, selectedSensor, optVal)]
+                self.warningLabel["avgCO2"].config(text=text, bg=color)
 
 
     """
@@ -514,22 +962,16 @@ class RecordingTab(tk.Frame):
         # Check if delta plot males sense (>=3)
         if len(recorded) >= 3:
             # recorded data conversion
-            timestamps = [t for t, v in recorded]
-            values = [v for t, v in recorded]
-
-            # Calc deltas
-            deltaValues = []
-            prevVal = 0
-            for v in values:
-                deltaValues.append(v - prevVal)
-                prevVal = v
-            # Shorten axis as first delta is irrelevant
-            timestamps.pop(0)
-            deltaValues.pop(0)
+            times, values = recordedColumns()
+            pyramid, deltaPyramid = self.getPyramids(times, values)
+            start, end = self.visibleRange(times)
+            plotTimes, deltaValues = deltaPyramid.envelope(int(self.figure2.bbox.width), start, end)
+            timestamps = plotTimes.astype("datetime64[ms]")
 
             # clear & plot
             self.subplot2.cla()
             self.subplot2.plot(timestamps, deltaValues)
+            self.subplot2.plot(timestamps, rollingMean(deltaValues, 10), color="black", linewidth=0.8)
 
             # margins & labels
             self.subplot2.margins(x=0, y=0.1, tight=True)
@@ -539,18 +981,17 @@ class RecordingTab(tk.Frame):
             # hlines
             self.subplot2.hlines(0, timestamps[0], timestamps[-1], "grey", "solid")
 
-            # manual xticks as matplotlib is retarded x3
-            if len(timestamps) > 24:
-                self.subplot2.set_xticks(generateTicks(timestamps, 24))
+            setDateTicks(self.subplot2)
 
             # grid, axis label tilt, tight layout & draw
             self.subplot2.grid()
+            self.subplot2.set_xlim(np.datetime64(start, "ms"), np.datetime64(end, "ms"))
             self.figure2.autofmt_xdate()
             self.figure2.tight_layout()
             self.canvas2.draw()
 
             # update avg entry
-            avgDeltaCO2 = calculateAvg(deltaValues)
+            avgDeltaCO2 = int(round(self.getAnalytics().meanDelta()))
             self.entry["avgDeltaCO2"].configure(state="normal")
             self.entry["avgDeltaCO2"].delete(0, tk.END)
             self.entry["avgDeltaCO2"].insert(0, avgDeltaCO2)
@@ -576,12 +1017,9 @@ class OptionsTab(tk.Frame):
         # self.height = 768
         self.parent = parent
 
-        # Load settings file
-        self.loadOptions()
-
         # Raw Voltage Graph
         self.graphRaw = UIGraph(self, "Time (s)", "Raw (Digitalised)", -300, 0, step=5, row=0, column=0, rowspan=20, columnspan=1,  figx = 10, figy=6)
-        self.graphRaw.updatePlot()
+        self.graphRaw.requestRedraw()
 
         # Seperator
         ttk.Separator(master=self, orient=tk.VERTICAL).grid(row=0, column=1, rowspan=24, sticky=tk.N + tk.S)
@@ -594,7 +1032,12 @@ class OptionsTab(tk.Frame):
                 "lowCO2": "Low CO2 (in ppm):",
                 "highCO2": "High CO2 (in ppm):",
                 "veryHighCO2": "Very High CO2 (in ppm):",
-                "measurementInterval": "Interval for recording measurements (in min):"
+                "recordingInterval": "Interval for recording measurements (in s):",
+                "rawRetentionDays": "Keep full recordings for (days):",
+                "minuteRetentionDays": "Keep minute averages for (days):",
+                "archiveAfterDays": "Compress recordings after (days):",
+                "alertHysteresis": "Alert hysteresis (in ppm):",
+                "alertDwell": "Alert after (in s):"
                 }
 
         rowCounter = 0
@@ -641,29 +1084,39 @@ class OptionsTab(tk.Frame):
         self.clearButton = ttk.Button(master=self, text="Clear Graph", command=self.clear)
         self.clearButton.grid(row=rowCounter, column=3, columnspan=2, sticky=tk.W+tk.E, padx=25, pady=5)
         rowCounter += 1
-        # start auto ui updates
-        self.autoUpdate()
+        self.lastSample = None
 
     """
     auto-updates graph and read only entrys every 5s
     """
     def uiUpdate(self):
-        self.graphRaw.updatePlot()
+        self.graphRaw.requestRedraw()
         self.readOnlyEntryUpdate()
 
-    def autoUpdate(self):
+    @timings.timed("OptionsTab.autoUpdate")
+    def autoUpdate(self, sample):
+        if sample.sensor != selectedSensor.name:
+            return
+        self.lastSample = sample
         if self.autoUpdateIsRun.get():
-            self.graphRaw.appendToBuffer(sensorlib.readRawCO2())
+            self.graphRaw.appendToBuffer(sample.raw)
             self.uiUpdate()
-        self.after(5000, self.autoUpdate)
 
     """
     updates read only entrys for raw and corresponding ppm
     """
     def readOnlyEntryUpdate(self):
+        if self.lastSample is None:
+            return
         # Ensure that corresponding values are calculated using the same raw read
-        rawRead = sensorlib.readRawCO2()
-        correspondingPPM = int(round(sensorlib.rawToPPM(rawRead, optVal["v400"], optVal["v40000"])))
+        # (converted here rather than taken from the sample so new calibration shows at once)
+        rawRead = self.lastSample.raw
+        if backend is None:
+            # attached to a daemon, which did the conversion
+            correspondingPPM = int(round(self.lastSample.ppm))
+        else:
+            v400, v40000 = selectedSensor.calibration(optVal)
+            correspondingPPM = int(round(backend.rawToPPM(rawRead, v400, v40000)))
         # Update Entrys
         self.readOnlyEntry["raw"].config(state="default")
         self.readOnlyEntry["raw"].delete(0, tk.END)
@@ -681,34 +1134,82 @@ class OptionsTab(tk.Frame):
     def saveOptions(self):
         for name in optVal:
             newVal = self.entry[name].get()
-            # validity check (int and >=1)
+            # validity check (int and at least the option's minimum, 1 by default)
             if newVal.isdigit():
-                if int(newVal) >= 1:
+                if int(newVal) >= minimums.get(name, 1):
                     # adopt value
                     optVal[name] = int(newVal)
         # update other frames
         app.updateAllFrames()
         # save to settings file
-        with open("settings.opt", "wb") as handle:
-            pickle.dump(optVal, handle, protocol=pickle.HIGHEST_PROTOCOL)
-            print("settings saved")
+        saveSettings(optVal)
+
+    def clear(self):
+        self.graphRaw.buffer.clear()
+        self.graphRaw.requestRedraw()
+
+    def selectSensor(self):
+        self.lastSample = None
+        self.clear()
+
+
+"""
+Coalesces redraws: figures mark themselves dirty and each dirty one is redrawn
+at most once per frame from an after_idle callback. Figures on hidden notebook
+tabs stay dirty until their tab is selected.
+"""
+class RenderScheduler:
+    def __init__(self, frameBudget=100):
+        # minimum time between two frames in ms
+        self.frameBudget = frameBudget
+        self.notebook = None
+        # key -> (tab, redraw callable), in the order they were marked
+        self.dirty = {}
+        self.pending = False
+        self.lastFrame = 0
+        # time.monotonic() the pending frame is due at
+        self.due = None
 
     """
-    loads settings file if found (saves/settings.opt)
+    starts rendering; redraws marked before this are flushed on the first frame
     """
-    def loadOptions(self):
-        print("loading settings...")
-        if os.path.exists(os.getcwd()+"/settings.opt"):
-            with open("settings.opt", "rb") as handle:
-                global optVal
-                optVal = pickle.load(handle)
-                print("settings loaded")
+    def attach(self, notebook):
+        self.notebook = notebook
+        notebook.bind("<<NotebookTabChanged>>", lambda event: self.schedule())
+        self.schedule()
+
+    def markDirty(self, tab, key, redraw):
+        self.dirty[key] = (tab, redraw)
+        self.schedule()
+
+    def schedule(self):
+        if self.pending or self.notebook is None or not self.dirty:
+            return
+        self.pending = True
+        wait = int(self.frameBudget - (time.monotonic() - self.lastFrame) * 1000)
+        self.due = time.monotonic() + max(wait, 0) / 1000
+        if wait > 0:
+            self.notebook.after(wait, lambda: self.notebook.after_idle(self.flush))
         else:
-            print("no settings file found")
+            self.notebook.after_idle(self.flush)
 
-    def clear(self):
-        self.graphRaw.buffer.clear()
-        self.graphRaw.updatePlot()
+    def isVisible(self, tab):
+        return self.notebook.select() == str(tab)
+
+    def flush(self):
+        timings.drift("render", self.due)
+        self.pending = False
+        self.lastFrame = time.monotonic()
+        for key, (tab, redraw) in list(self.dirty.items()):
+            if not self.isVisible(tab):
+                continue
+            del self.dirty[key]
+            try:
+                redraw()
+            except Exception as e:
+                print("redraw failed:", e)
+
+renderer = RenderScheduler()
 
 
 class UIGraph:
@@ -723,7 +1224,7 @@ class UIGraph:
         self.zeroLine = False
         self.t = np.arange(xStart, xEnd+1, step)
 
-        self.figure = plt.Figure(figsize=(figx, figy), dpi=100)
+        self.figure = Figure(figsize=(figx, figy), dpi=100)
 
         self.subplot = self.figure.add_subplot(111)
         # self.subplot.axis([xStart, xEnd, 0, 7000])
@@ -740,6 +1241,19 @@ class UIGraph:
         self.yStart = 0
         self.yEnd = 0
 
+        # persistent artists, created on the first updatePlot
+        self.line = None
+        self.hLineArtist = {}
+        self.bars = {}
+        self.background = None
+        self.drawnThresholds = {}
+        self.yLimits = None
+
+        # frame-time counter (seconds per updatePlot, last 120 frames)
+        self.frameTimes = deque(maxlen=120)
+        self.frames = 0
+        self.fullRedraws = 0
+
     def enableBars(self):
         self.barsEnabled = True
 
@@ -755,94 +1269,171 @@ class UIGraph:
     def addHLine(self, name, colors='k', linestyles='solid', label=''):
         self.hLine[name] = [self.xStart, self.xEnd, colors, linestyles, label]
 
-    def drawHLines(self):
-        for name, line in self.hLine.items():
-            self.subplot.hlines(optVal[name], *line)
-            # self.subplot.text(0, line[0], line[5])
-
-    def drawAreaBars(self):
-        collection = collections.BrokenBarHCollection.span_where(
-            self.t, ymin=0, ymax=8000, where=np.array(self.buffer.buffer) > optVal["veryHighCO2"], facecolor='red', alpha=0.3)
-        self.subplot.add_collection(collection)
-
-        collection = collections.BrokenBarHCollection.span_where(
-            self.t, ymin=0, ymax=8000, where=np.array(self.buffer.buffer) > optVal["highCO2"], facecolor='orange', alpha=0.3)
-        self.subplot.add_collection(collection)
-
-    def appendToBuffer(self, newVal):
-        self.buffer.append(newVal)
-        self.updatePlot()
-
-    def updatePlot(self):
+    """
+    creates all artists once; the data line and area bars are animated and blitted
+    """
+    def build(self):
         self.subplot.cla()
-
-        self.subplot.plot(self.t, self.buffer.buffer)
-        self.subplot.margins(0, 0.2)
-
-        if self.barsEnabled:
-            self.drawAreaBars()
+        self.line, = self.subplot.plot(self.t, self.buffer.buffer, animated=True)
 
         self.subplot.set_ylabel(self.yName)
         self.subplot.set_xlabel(self.xName)
-        self.drawHLines()
+        for name, (xStart, xEnd, colors, linestyles, label) in self.hLine.items():
+            self.hLineArtist[name], = self.subplot.plot([xStart, xEnd], [setting(name), setting(name)],
+                                                        color=colors, linestyle=linestyles, label=label)
+            self.drawnThresholds[name] = setting(name)
 
         if self.zeroLine:
-            self.subplot.hlines(0, self.xStart, self.xEnd, "grey")
+            self.subplot.plot([self.xStart, self.xEnd], [0, 0], color="grey")
+
+        if self.barsEnabled:
+            for name, color in (("veryHighCO2", "red"), ("highCO2", "orange")):
+                self.bars[name] = collections.PolyCollection([], facecolor=color, alpha=0.3, animated=True)
+                self.subplot.add_collection(self.bars[name])
+                self.drawnThresholds[name] = setting(name)
 
         if self.legendEnabled:
             self.subplot.legend(loc="upper left")
+        self.subplot.set_xlim(self.xStart, self.xEnd)
         if self.fixedY:
-            self.subplot.axis([self.xStart, self.xEnd, self.yStart, self.yEnd])
+            self.subplot.set_ylim(self.yStart, self.yEnd)
         self.subplot.set_xticks(np.arange(self.xStart, self.xEnd+1, 50))
-        self.subplot.grid()
-        self.figure.tight_layout()
-        self.canvas.draw()
+        self.subplot.grid(True)
+
+        self.canvas.mpl_connect("draw_event", self.onDraw)
+        self.canvas.mpl_connect("resize_event", self.onResize)
+
+    def updateAreaBars(self, values):
+        for name, bars in self.bars.items():
+            threshold = setting(name)
+            self.buffer.setThreshold(name, threshold)
+            # skip the span search entirely while nothing is above the threshold
+            if self.buffer.exceeding(name) == 0:
+                bars.set_verts([])
+                continue
+            mask = np.concatenate(([0], (values > threshold).view(np.int8), [0]))
+            edges = np.flatnonzero(np.diff(mask))
+            starts = self.t[edges[::2]]
+            ends = self.t[edges[1::2] - 1]
+            bars.set_verts([[(a, 0), (a, 8000), (b, 8000), (b, 0)] for a, b in zip(starts, ends)])
+
+    """
+    returns True if the thresholds drawn as hlines/bars no longer match the selected sensor
+    """
+    def updateThresholds(self):
+        changed = False
+        for name, value in self.drawnThresholds.items():
+            if setting(name) != value:
+                self.drawnThresholds[name] = setting(name)
+                if name in self.hLineArtist:
+                    self.hLineArtist[name].set_ydata([setting(name), setting(name)])
+                changed = True
+        return changed
+
+    """
+    returns True if the autoscaled y range (0.2 margin) changed
+    """
+    def updateYLimits(self):
+        if self.fixedY:
+            return False
+        yMin = self.buffer.min()
+        yMax = self.buffer.max()
+        for value in self.drawnThresholds.values():
+            yMin = min(yMin, value)
+            yMax = max(yMax, value)
+        if self.zeroLine:
+            yMin = min(yMin, 0)
+            yMax = max(yMax, 0)
+        margin = (yMax - yMin) * 0.2
+        if margin == 0:
+            margin = 1
+        limits = (yMin - margin, yMax + margin)
+        if limits == self.yLimits:
+            return False
+        self.yLimits = limits
+        self.subplot.set_ylim(*limits)
+        return True
 
+    def appendToBuffer(self, newVal):
+        self.buffer.append(newVal)
+        self.requestRedraw()
 
+    """
+    marks the graph dirty; the render scheduler calls updatePlot once per frame
+    """
+    def requestRedraw(self):
+        renderer.markDirty(self.master, self, self.updatePlot)
 
+    def updatePlot(self):
+        startTime = time.perf_counter()
+        if self.line is None:
+            self.build()
 
-class GraphBuffer:
-    def __init__(self, length, step = 1):
-        self.step = step
-        self.length = length
-        self.buffer = [0 for i in range(0, length, step)]
+        values = self.buffer.buffer
+        self.line.set_ydata(values)
+        if self.barsEnabled:
+            self.updateAreaBars(values)
 
-    def __str__(self):
-        return str(self.buffer)
+        needsLayout = self.updateThresholds()
+        needsRedraw = self.updateYLimits()
+        if needsLayout or needsRedraw or self.background is None:
+            self.redraw(needsLayout or self.background is None)
+        else:
+            self.canvas.restore_region(self.background)
+            self.drawAnimated()
+            self.canvas.blit(self.figure.bbox)
 
-    def append(self, newValue):
-        self.buffer.pop(0)
-        self.buffer.append(newValue)
+        self.frames += 1
+        self.frameTimes.append(time.perf_counter() - startTime)
+        timings.record("updatePlot", self.frameTimes[-1])
+
+    """
+    full draw; the background is re-captured by onDraw
+    """
+    def redraw(self, relayout=True):
+        if relayout:
+            startTime = time.perf_counter()
+            self.figure.tight_layout()
+            timings.record("tight_layout", time.perf_counter() - startTime)
+        startTime = time.perf_counter()
+        self.canvas.draw()
+        timings.record("canvas.draw", time.perf_counter() - startTime)
+        self.fullRedraws += 1
+
+    def drawAnimated(self):
+        self.subplot.draw_artist(self.line)
+        for bars in self.bars.values():
+            self.subplot.draw_artist(bars)
+
+    def onDraw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.drawAnimated()
+
+    def onResize(self, event):
+        self.background = None
+        self.figure.tight_layout()
+
+    """
+    mean updatePlot time in ms over the last frames
+    """
+    def frameTime(self):
+        if not self.frameTimes:
+            return 0
+        return 1000 * sum(self.frameTimes) / len(self.frameTimes)
 
-    def clear(self):
-        self.buffer = [0 for i in range(0, self.length, self.step)]
-
-    def changeLength(self, newLength):
-        deltaL = newLength - self.length
-        if deltaL == 0:
-            pass
-
-        elif deltaL > 0:
-            self.buffer = [0 for i in range(deltaL)] + self.buffer
-            self.length = newLength
-
-        elif deltaL < 0:
-            deltaL = -deltaL
-            for i in range(deltaL):
-                self.buffer.pop(0)
-            self.length = newLength
-
-    def mean(self):
-        totalPPM = 0
-        for val in self.buffer:
-            totalPPM += val
-        meanPPM = totalPPM / self.length
-        return meanPPM
 
 if __name__ == "__main__":
     setSaveDir()
+    # attached to a co2daemon, the daemon maintains the saves directory: its
+    # journals are live, and archiving, retention and pruning are its job
+    attached = "--attach" in sys.argv
+    # recordings interrupted by a crash or power cut are left as .part journals
+    if not attached:
+        for path in recoverJournals(os.getcwd()):
+            print("recovered unfinished recording:", compactJournal(path))
     root = tk.Tk()
     root.configure(background='white')
+    markStartup("tk started")
 
     #ttk.Style().configure("TButton", padding=6, relief="flat",
                           #background="#ccc")
@@ -854,7 +1445,50 @@ if __name__ == "__main__":
     ttk.Style().configure("Notebook", background="white", active="white")
     ttk.Style().configure("TCheckbutton", background="white")
 
-    app = Main(root)
+    # "--attach [host:port]" views a running co2daemon instead of reading the sensor
+    source = None
+    if attached:
+        address = sys.argv[sys.argv.index("--attach") + 1:] or ["127.0.0.1:" + str(DAEMON_PORT)]
+        host, port = address[0].rsplit(":", 1)
+        source = DaemonClient(host, int(port))
+    # "--backend synthetic[:rate]" or "--backend replay:<file>[:speed]" runs without the sensor
+    if "--backend" in sys.argv:
+        backend = createBackend(sys.argv[sys.argv.index("--backend") + 1])
+    elif source is None:
+        backend = createBackend()
+    # "--filter median:8 | ema:8[:alpha] | kalman:16[:q]" oversamples every read (filters.py)
+    if "--filter" in sys.argv:
+        filterSpec = sys.argv[sys.argv.index("--filter") + 1]
+
+    optVal = loadSettings()
+    history = History()
+    if not attached:
+        for path in applyRetention(os.getcwd(), optVal["rawRetentionDays"], optVal["minuteRetentionDays"]):
+            print("retention: deleted", path)
+        history.prune(optVal["rawRetentionDays"], optVal["minuteRetentionDays"])
+        threading.Thread(target=updateHistory, args=(os.getcwd(), optVal["archiveAfterDays"]),
+                         name="updateHistory", daemon=True).start()
+    sensors = loadSensors()
+    selectedSensor = sensors[0]
+    markStartup("settings loaded")
+
+    app = Main(root, source)
+    # "--perf" shows the performance overlay from the start
+    if "--perf" in sys.argv:
+        app.togglePerfOverlay()
+    # "--http [host:]port" serves the readings to remote viewers (liveserver.py)
+    liveServer = None
+    if "--http" in sys.argv:
+        host, port = parseAddress(sys.argv[sys.argv.index("--http") + 1])
+        liveServer = LiveServer(LiveFeed(sensors), port, host)
+        liveServer.start(app.sampleHub)
+    # "--alert log | file:<path> | command:<cmd>" (repeatable) raises threshold alerts (alerts.py)
+    alertSinks = [createSink(sys.argv[i + 1]) for i, arg in enumerate(sys.argv[:-1]) if arg == "--alert"]
+    if alertSinks:
+        app.sampleHub.subscribe(AlertEngine(optVal, sensors, alertSinks).check)
     # app.pack(side="top", fill="both", expand=True)
     root.mainloop()
+    app.sampleSource.stop()
+    if liveServer is not None:
+        liveServer.close()
     # root.protocol("WM_DELETE_WINDOW", app.on_closing())
\ No newline at end of file
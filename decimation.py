@@ -0,0 +1,93 @@
+import numpy as np
+
+"""
+Multi-resolution min/max/mean pyramid over a recording.
+
+Level 0 is the raw data; every level above merges `factor` buckets of the
+level below. A plot picks the finest level that still fits into the canvas
+width, so drawing cost depends on the number of pixels rather than on the
+length of the recording. Buckets keep their min and max, so short peaks
+(e.g. above veryHighCO2) survive decimation. NaN values (recording gaps)
+stay in level 0, where they break the plotted line, and are ignored above.
+"""
+class Pyramid:
+    def __init__(self, time, values, factor=4, minBuckets=256):
+        self.factor = factor
+        # level 0 references the recording columns without copying them
+        self.levels = [{"start": time, "end": time, "min": values, "max": values,
+                        "sum": values, "count": None}]
+        while len(self.levels[-1]["start"]) > minBuckets:
+            self.levels.append(self.merge(self.levels[-1]))
+
+    def merge(self, level):
+        n = len(level["start"])
+        idx = np.arange(0, n, self.factor)
+        last = np.minimum(idx + self.factor, n) - 1
+        sums = level["sum"]
+        if level["count"] is None:
+            valid = ~np.isnan(sums)
+            count = np.add.reduceat(valid.astype(np.int64), idx)
+            sums = np.where(valid, sums, 0)
+        else:
+            count = np.add.reduceat(level["count"], idx)
+        return {"start": level["start"][idx],
+                "end": level["end"][last],
+                "min": np.fmin.reduceat(level["min"], idx),
+                "max": np.fmax.reduceat(level["max"], idx),
+                "sum": np.add.reduceat(sums, idx, dtype=np.float64),
+                "count": count}
+
+    def __len__(self):
+        return len(self.levels[0]["start"])
+
+    """
+    index range [i0, i1) of the buckets of level overlapping start..end (epoch
+    ms, None = open), plus one neighbour on each side so lines run off-screen
+    """
+    def span(self, level, start=None, end=None):
+        i0 = 0
+        i1 = len(level["start"])
+        if start is not None:
+            i0 = max(int(np.searchsorted(level["end"], start, "left")) - 1, 0)
+        if end is not None:
+            i1 = min(int(np.searchsorted(level["start"], end, "right")) + 1, i1)
+        return i0, max(i0, i1)
+
+    """
+    finest level showing start..end in at most maxBuckets buckets;
+    returns (level, i0, i1)
+    """
+    def select(self, maxBuckets, start=None, end=None):
+        for level in self.levels:
+            i0, i1 = self.span(level, start, end)
+            if i1 - i0 <= maxBuckets:
+                return level, i0, i1
+        return (level,) + self.span(level, start, end)
+
+    """
+    bucket means of level; NaN for buckets of gaps only
+    """
+    def mean(self, level):
+        if level["count"] is None:
+            return level["sum"]
+        with np.errstate(invalid="ignore"):
+            return level["sum"] / level["count"]
+
+    """
+    (time, value) points tracing the min/max envelope of start..end with at
+    most maxBuckets buckets; each bucket becomes its min at its start and its
+    max at its end. Cost is proportional to the visible buckets only.
+    """
+    def envelope(self, maxBuckets, start=None, end=None):
+        level, i0, i1 = self.select(maxBuckets, start, end)
+        if level["count"] is None:
+            return level["start"][i0:i1], level["min"][i0:i1]
+        time = np.column_stack((level["start"][i0:i1], level["end"][i0:i1])).ravel()
+        values = np.column_stack((level["min"][i0:i1], level["max"][i0:i1])).ravel()
+        return time, values
+
+    def max(self):
+        return np.nanmax(self.levels[-1]["max"])
+
+    def min(self):
+        return np.nanmin(self.levels[-1]["min"])
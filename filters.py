@@ -0,0 +1,97 @@
+import math
+import numpy as np
+
+"""
+Noise filters for oversampled sensor reads. Every tick the worker reads a
+burst of `count` raw values and a filter turns them into one value and its
+variance (in raw units squared); only those go downstream. The filters keep
+their state between bursts and cost O(1) per raw read (the median O(count)
+per burst), so the oversampling factor can be raised freely.
+
+Filters are given as a spec:
+
+    median:<count>                 median of each burst
+    ema:<count>[:<alpha>]          exponential moving average over all reads
+    kalman:<count>[:<q>]           1D Kalman filter, q is the process variance
+                                   per read (how fast the true value moves)
+"""
+
+
+"""
+variance of the reads of one burst (0 for a single read)
+"""
+def burstVariance(reads):
+    return float(np.var(reads, ddof=1)) if len(reads) > 1 else 0.0
+
+
+class MedianFilter:
+    def __init__(self, count):
+        self.count = count
+
+    def update(self, reads):
+        reads = np.asarray(reads, dtype=np.float64)
+        # the median of normal noise is pi/2 times noisier than the mean
+        return float(np.median(reads)), burstVariance(reads) * math.pi / 2 / len(reads)
+
+
+class EMAFilter:
+    def __init__(self, count, alpha=None):
+        self.count = count
+        # by default the average spans about two bursts
+        self.alpha = alpha if alpha is not None else 2 / (2 * count + 1)
+        self.mean = None
+        self.variance = 0.0
+
+    def update(self, reads):
+        alpha = self.alpha
+        for read in np.asarray(reads, dtype=np.float64).tolist():
+            if self.mean is None:
+                self.mean = read
+                continue
+            # exponentially weighted mean and variance of the reads
+            delta = read - self.mean
+            self.mean += alpha * delta
+            self.variance = (1 - alpha) * (self.variance + alpha * delta * delta)
+        # variance of the average itself rather than of a single read
+        return self.mean, self.variance * alpha / (2 - alpha)
+
+
+"""
+Random walk model: the true value moves by q per read, each read adds noise
+measured from the burst itself, so the filter adapts to the sensor.
+"""
+class KalmanFilter:
+    def __init__(self, count, processVariance=0.01):
+        self.count = count
+        self.processVariance = processVariance
+        self.estimate = None
+        self.variance = 0.0
+
+    def update(self, reads):
+        reads = np.asarray(reads, dtype=np.float64)
+        # a burst of identical reads (quantized ADC) still has some noise
+        noise = max(burstVariance(reads), 1e-6)
+        for read in reads.tolist():
+            if self.estimate is None:
+                self.estimate, self.variance = read, noise
+                continue
+            self.variance += self.processVariance
+            gain = self.variance / (self.variance + noise)
+            self.estimate += gain * (read - self.estimate)
+            self.variance *= 1 - gain
+        return self.estimate, self.variance
+
+
+def createFilter(spec):
+    name, _, arguments = spec.partition(":")
+    arguments = [float(argument) for argument in arguments.split(":") if argument]
+    if not arguments or arguments[0] < 1:
+        raise ValueError("filter needs a read count: " + spec)
+    count = int(arguments[0])
+    if name == "median":
+        return MedianFilter(count)
+    if name == "ema":
+        return EMAFilter(count, *arguments[1:2])
+    if name == "kalman":
+        return KalmanFilter(count, *arguments[1:2])
+    raise ValueError("unknown filter: " + spec)
@@ -0,0 +1,116 @@
+from collections import deque
+import numpy as np
+
+"""
+Fixed-length window of the newest samples of a live graph with running
+sum, min, max and threshold counts, so every statistic is O(1) per sample.
+Used by the dashboard graphs and the live server.
+"""
+class GraphBuffer:
+    def __init__(self, length, step = 1):
+        self.step = step
+        self.length = length
+        # threshold name -> value, and how many buffered samples lie above it
+        self.thresholds = {}
+        self.exceedCount = {}
+        self.allocate(len(range(0, length, step)))
+
+    def __str__(self):
+        return str(self.buffer.tolist())
+
+    """
+    (re)allocates the ring for size samples, keeping the newest of values
+    """
+    def allocate(self, size, values=None):
+        self.size = size
+        # every sample is stored twice (at i and i+size) so the ordered window
+        # is always the contiguous slice ring[head:head+size]
+        self.ring = np.zeros(2 * size)
+        self.head = 0
+        if values is not None and len(values) > 0:
+            values = values[-size:]
+            self.ring[size - len(values):size] = values
+            self.ring[2 * size - len(values):] = values
+        self.rebuildStats()
+
+    """
+    recomputes all running statistics from the current window
+    """
+    def rebuildStats(self):
+        window = self.buffer
+        self.sum = float(np.sum(window))
+        self.counter = self.size
+        # monotonic queues of (index, value) for sliding min / max
+        self.minQueue = deque()
+        self.maxQueue = deque()
+        for i, val in enumerate(window.tolist()):
+            self.pushMinMax(i, val)
+        for name, value in self.thresholds.items():
+            self.exceedCount[name] = int(np.count_nonzero(window > value))
+
+    def pushMinMax(self, index, val):
+        while self.minQueue and self.minQueue[-1][1] >= val:
+            self.minQueue.pop()
+        self.minQueue.append((index, val))
+        while self.maxQueue and self.maxQueue[-1][1] <= val:
+            self.maxQueue.pop()
+        self.maxQueue.append((index, val))
+        oldest = index - self.size
+        while self.minQueue[0][0] <= oldest:
+            self.minQueue.popleft()
+        while self.maxQueue[0][0] <= oldest:
+            self.maxQueue.popleft()
+
+    """
+    zero-copy view of the buffered samples, oldest first
+    """
+    @property
+    def buffer(self):
+        return self.ring[self.head:self.head + self.size]
+
+    def append(self, newValue):
+        oldValue = float(self.ring[self.head])
+        self.ring[self.head] = newValue
+        self.ring[self.head + self.size] = newValue
+        self.head += 1
+        if self.head == self.size:
+            self.head = 0
+
+        self.sum += newValue - oldValue
+        for name, value in self.thresholds.items():
+            self.exceedCount[name] += (newValue > value) - (oldValue > value)
+        self.pushMinMax(self.counter, newValue)
+        self.counter += 1
+
+        # resync the running sum once per lap so float error can't pile up
+        if self.head == 0:
+            self.sum = float(np.sum(self.buffer))
+
+    def clear(self):
+        self.allocate(self.size)
+
+    def changeLength(self, newLength):
+        deltaL = newLength - self.length
+        if deltaL != 0:
+            self.length = newLength
+            self.allocate(len(range(0, newLength, self.step)), self.buffer.copy())
+
+    """
+    tracks how many buffered samples are above value (re-counts only on change)
+    """
+    def setThreshold(self, name, value):
+        if self.thresholds.get(name) != value:
+            self.thresholds[name] = value
+            self.exceedCount[name] = int(np.count_nonzero(self.buffer > value))
+
+    def exceeding(self, name):
+        return self.exceedCount[name]
+
+    def mean(self):
+        return self.sum / self.size
+
+    def min(self):
+        return self.minQueue[0][1]
+
+    def max(self):
+        return self.maxQueue[0][1]
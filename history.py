@@ -0,0 +1,283 @@
+import os
+import sqlite3
+import sys
+from datetime import datetime
+import numpy as np
+from sensors import DEFAULT_SENSOR
+from tiers import TIERS
+
+"""
+Long-term history of every recorded sample in one SQLite database
+(saves/history.db), so any time range of any sensor can be queried without
+opening recording files.
+
+    samples(sensor, time, ppm, raw)    every sample, clustered by (sensor, time)
+    minute / hour(sensor, time, mean, min, max, count)
+                                       roll-ups for long ranges and aggregates
+    imports(path, ...)                 recording files already imported
+
+Times are epoch ms. Gap samples are stored with NULL ppm.
+"""
+HISTORY_FILE = "history.db"
+# tables of the roll-up tiers, finest first, with their bucket length in ms
+TIER_TABLES = (("minute", TIERS[0][1]), ("hour", TIERS[1][1]))
+# ranges up to this long are read sample by sample, longer ones from a tier
+RAW_RANGE = 7 * 86400000
+MINUTE_RANGE = 366 * 86400000
+# strftime() formats of the aggregate groupings (local time)
+GROUPINGS = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d", "week": "%Y-%W", "month": "%Y-%m",
+             "weekday": "%w", "hourOfDay": "%H"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (sensor TEXT NOT NULL, time INTEGER NOT NULL, ppm REAL, raw REAL,
+                                    PRIMARY KEY (sensor, time)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS minute (sensor TEXT NOT NULL, time INTEGER NOT NULL, mean REAL, min REAL, max REAL,
+                                   count INTEGER, PRIMARY KEY (sensor, time)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hour (sensor TEXT NOT NULL, time INTEGER NOT NULL, mean REAL, min REAL, max REAL,
+                                 count INTEGER, PRIMARY KEY (sensor, time)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS imports (path TEXT PRIMARY KEY, sensor TEXT, start INTEGER, end INTEGER,
+                                    count INTEGER);
+"""
+# rebuild the buckets of (bucket ms, bucket ms, sensor, start, end) from the next finer table
+ROLLUP_QUERIES = {
+    "minute": "INSERT OR REPLACE INTO minute SELECT sensor, time / ? * ? AS bucket, AVG(ppm), MIN(ppm), MAX(ppm), "
+              "COUNT(ppm) FROM samples WHERE sensor = ? AND time BETWEEN ? AND ? AND ppm IS NOT NULL GROUP BY bucket",
+    "hour": "INSERT OR REPLACE INTO hour SELECT sensor, time / ? * ? AS bucket, SUM(mean * count) / SUM(count), "
+            "MIN(min), MAX(max), SUM(count) FROM minute WHERE sensor = ? AND time BETWEEN ? AND ? GROUP BY bucket"
+}
+
+
+"""
+sensor name from a recording file name ("<recordingStart>_<sensor>.co2r")
+"""
+def sensorFromFileName(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    # recordingStart is "%y-%m-%d_at_%H-%M", 17 characters
+    if len(name) > 18 and name[17] == "_":
+        return name[18:]
+    return DEFAULT_SENSOR
+
+
+class History:
+    def __init__(self, path=HISTORY_FILE):
+        # the daemon and the dashboard may write at the same time
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    """
+    adds the samples of one recording and rebuilds the roll-ups they touch
+    """
+    def insert(self, sensor, times, ppm, raw):
+        with self.db:
+            self.writeSamples(sensor, times, ppm, raw)
+
+    def writeSamples(self, sensor, times, ppm, raw):
+        times = np.asarray(times, dtype=np.int64)
+        ppm = np.asarray(ppm, dtype=np.float64)
+        raw = np.asarray(raw, dtype=np.float64)
+        # sqlite stores NaN as NULL
+        rows = zip([sensor] * len(times), times.tolist(), ppm.tolist(), raw.tolist())
+        self.db.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?)", rows)
+        if len(times):
+            self.rebuildTiers(sensor, int(times.min()), int(times.max()))
+
+    """
+    recomputes the roll-up buckets of sensor overlapping first..last: minutes
+    from the samples, hours from the minutes. A bucket is always rebuilt whole
+    from what is stored, so importing the same samples twice (or a bucket
+    split over two recordings) counts every sample once, and hours stay
+    right after the samples under them were pruned.
+    """
+    def rebuildTiers(self, sensor, first, last):
+        for table, bucketMs in TIER_TABLES:
+            start = first // bucketMs * bucketMs
+            end = last // bucketMs * bucketMs + bucketMs - 1
+            self.db.execute(ROLLUP_QUERIES[table], (bucketMs, bucketMs, sensor, start, end))
+
+    """
+    imports a recording file once; returns False if it was imported before
+    """
+    def importRecording(self, path, recording, sensor=None):
+        if sensor is None:
+            sensor = sensorFromFileName(path)
+        return self.importChunks(path, [(sensor, recording.time, recording.ppm, recording.raw)])
+
+    """
+    imports a file once from (sensor, times, ppm, raw) chunks, so a file of
+    any size is imported in constant memory; returns False if it was
+    imported before. The imports row names the sensor if the file held one,
+    NULL if it held several (CSV, Parquet).
+    """
+    def importChunks(self, path, chunks):
+        key = os.path.abspath(path)
+        sensors, start, end, count = set(), None, None, 0
+        with self.db:
+            # check and import in one write transaction, so two processes can't both import a file
+            self.db.execute("BEGIN IMMEDIATE")
+            if self.db.execute("SELECT 1 FROM imports WHERE path = ?", (key,)).fetchone():
+                return False
+            for sensor, times, ppm, raw in chunks:
+                self.writeSamples(sensor, times, ppm, raw)
+                if len(times):
+                    sensors.add(sensor)
+                    # rows of CSV and Parquet files needn't be in time order
+                    start = int(np.min(times)) if start is None else min(start, int(np.min(times)))
+                    end = int(np.max(times)) if end is None else max(end, int(np.max(times)))
+                    count += len(times)
+            sensor = sensors.pop() if len(sensors) == 1 else None
+            self.db.execute("INSERT INTO imports VALUES (?, ?, ?, ?, ?)", (key, sensor, start, end, count))
+        return True
+
+    """
+    replaces the samples of sensor in the span of times (e.g. a recalibrated
+    recording); the roll-up buckets of the span, including those it shares
+    with neighbouring recordings, are rebuilt from all stored samples
+    """
+    def replaceSamples(self, sensor, times, ppm, raw):
+        if len(times) == 0:
+            return
+        with self.db:
+            self.db.execute("DELETE FROM samples WHERE sensor = ? AND time BETWEEN ? AND ?",
+                            (sensor, int(times[0]), int(times[-1])))
+            self.writeSamples(sensor, times, ppm, raw)
+
+    """
+    records that an imported file is now at newPath (e.g. archived)
+    """
+    def moveImport(self, path, newPath):
+        with self.db:
+            self.db.execute("UPDATE imports SET path = ? WHERE path = ?",
+                            (os.path.abspath(newPath), os.path.abspath(path)))
+
+    """
+    imports every recording in directory not imported yet; returns their paths
+    """
+    def importDirectory(self, directory, extensions=(".co2r", ".co2a", ".pickle")):
+        from recording import loadRecording
+        imported = []
+        for name in sorted(os.listdir(directory)):
+            if os.path.splitext(name)[1] in extensions:
+                path = os.path.join(directory, name)
+                try:
+                    if self.importRecording(path, loadRecording(path)):
+                        imported.append(path)
+                except Exception as e:
+                    print("history import failed:", name, e)
+        return imported
+
+    """
+    deletes samples older than rawDays and minute roll-ups older than minuteDays
+    """
+    def prune(self, rawDays, minuteDays, now=None):
+        now = datetime.now().timestamp() * 1000 if now is None else now
+        with self.db:
+            self.db.execute("DELETE FROM samples WHERE time < ?", (int(now - rawDays * 86400000),))
+            self.db.execute("DELETE FROM minute WHERE time < ?", (int(now - minuteDays * 86400000),))
+
+    def sensors(self):
+        return [row[0] for row in self.db.execute("SELECT DISTINCT sensor FROM hour ORDER BY sensor")]
+
+    """
+    (first, last) sample time of a sensor in epoch ms, or None
+    """
+    def span(self, sensor):
+        first, last = self.db.execute("SELECT MIN(time), MAX(time) FROM samples WHERE sensor = ?",
+                                      (sensor,)).fetchone()
+        if first is None:
+            return None
+        return first, last
+
+    """
+    (times, ppm) of sensor in start..end (epoch ms). Ranges longer than
+    RAW_RANGE come from the minute tier, longer than MINUTE_RANGE from the
+    hour tier (bucket means), as do ranges whose finer data was pruned;
+    tier can also be given ("samples", "minute", "hour").
+    """
+    def range(self, sensor, start, end, tier=None):
+        if tier is not None:
+            return self.query(sensor, start, end, tier)
+        tiers = ["samples", "minute", "hour"]
+        if end - start > RAW_RANGE:
+            tiers.remove("samples")
+        if end - start > MINUTE_RANGE:
+            tiers.remove("minute")
+        for tier in tiers:
+            times, ppm = self.query(sensor, start, end, tier)
+            if len(times) > 0:
+                break
+        return times, ppm
+
+    """
+    (sensor, times, ppm, raw) chunks of the samples in start..end of sensor,
+    or of every sensor, read chunkSize rows at a time
+    """
+    def iterSamples(self, sensor=None, start=None, end=None, chunkSize=65536):
+        query = "SELECT sensor, time, ppm, raw FROM samples WHERE time BETWEEN ? AND ?"
+        parameters = [-2 ** 63 if start is None else start, 2 ** 63 - 1 if end is None else end]
+        if sensor is not None:
+            query += " AND sensor = ?"
+            parameters.append(sensor)
+        cursor = self.db.execute(query + " ORDER BY sensor, time", parameters)
+        while True:
+            rows = cursor.fetchmany(chunkSize)
+            if not rows:
+                return
+            sensors = [row[0] for row in rows]
+            # split where the sensor changes, every chunk is one sensor
+            idx = [0] + [i for i in range(1, len(rows)) if sensors[i] != sensors[i - 1]] + [len(rows)]
+            for first, last in zip(idx[:-1], idx[1:]):
+                # None (NULL) becomes NaN
+                columns = np.array([row[1:] for row in rows[first:last]], dtype=np.float64)
+                yield (sensors[first], columns[:, 0].astype(np.int64), columns[:, 1].astype(np.float32),
+                       columns[:, 2].astype(np.float32))
+
+    def query(self, sensor, start, end, tier):
+        column = "ppm" if tier == "samples" else "mean"
+        rows = self.db.execute("SELECT time, " + column + " FROM " + tier +
+                               " WHERE sensor = ? AND time BETWEEN ? AND ? ORDER BY time",
+                               (sensor, start, end)).fetchall()
+        if not rows:
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        columns = np.array(rows, dtype=np.float64)
+        return columns[:, 0].astype(np.int64), columns[:, 1].astype(np.float32)
+
+    """
+    mean/min/max/count of sensor in start..end grouped by one of GROUPINGS
+    (local time), from the hour tier; weekdays limits to those days
+    (0 = Sunday .. 6 = Saturday). Returns a list of (group, mean, min, max, count).
+    """
+    def aggregate(self, sensor, start, end, groupBy="day", weekdays=None):
+        query = ("SELECT strftime(?, time / 1000, 'unixepoch', 'localtime') AS grp, "
+                 "SUM(mean * count) / SUM(count), MIN(min), MAX(max), SUM(count) FROM hour "
+                 "WHERE sensor = ? AND time BETWEEN ? AND ?")
+        parameters = [GROUPINGS[groupBy], sensor, start, end]
+        if weekdays is not None:
+            query += (" AND CAST(strftime('%w', time / 1000, 'unixepoch', 'localtime') AS INTEGER) IN (" +
+                      ", ".join("?" * len(weekdays)) + ")")
+            parameters += list(weekdays)
+        query += " GROUP BY grp ORDER BY grp"
+        return self.db.execute(query, parameters).fetchall()
+
+
+def parseDate(text):
+    return int(datetime.strptime(text, "%Y-%m-%d").timestamp() * 1000)
+
+
+if __name__ == "__main__":
+    # python history.py import
+    # python history.py aggregate <sensor> <from YYYY-MM-DD> <to YYYY-MM-DD> [day|weekday|hourOfDay|...] [weekdays]
+    history = History()
+    if sys.argv[1:2] == ["import"]:
+        for path in history.importDirectory(os.getcwd()):
+            print("imported", path)
+    elif sys.argv[1:2] == ["aggregate"]:
+        sensor, start, end = sys.argv[2], parseDate(sys.argv[3]), parseDate(sys.argv[4]) + 86400000
+        groupBy = sys.argv[5] if len(sys.argv) > 5 else "day"
+        weekdays = (1, 2, 3, 4, 5) if "weekdays" in sys.argv[6:] else None
+        for group, mean, low, high, count in history.aggregate(sensor, start, end, groupBy, weekdays):
+            print("%-16s mean %6.0f  min %6.0f  max %6.0f ppm  (%d samples)" % (group, mean, low, high, count))
+    history.close()
@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+from collections import deque
+import numpy as np
+
+"""
+Always-on timing of the hot paths. Every measurement is one deque append,
+so it is cheap enough to leave on; percentiles and histograms are only
+computed when someone looks (the overlay or a dump).
+
+    @timings.timed("updatePlot")        duration of every call
+    timings.record("sensor read", s)    a duration measured elsewhere
+    timings.drift("drainSamples", due)  lateness of a scheduled callback
+"""
+
+# histogram bucket edges in ms (log scale, 0.01 ms .. 10 s)
+BUCKET_EDGES = np.concatenate(([0], np.logspace(-2, 4, 13)))
+
+
+"""
+the last `size` values of one measurement, in ms
+"""
+class RollingHistogram:
+    def __init__(self, size=1000):
+        self.values = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, ms):
+        self.values.append(ms)
+        self.count += 1
+
+    def summary(self):
+        values = np.array(self.values)
+        if len(values) == 0:
+            return {"count": self.count}
+        p50, p95, p99 = np.percentile(values, (50, 95, 99))
+        return {"count": self.count, "mean": float(values.mean()), "p50": float(p50), "p95": float(p95),
+                "p99": float(p99), "max": float(values.max())}
+
+    def histogram(self):
+        counts, edges = np.histogram(np.array(self.values), bins=BUCKET_EDGES)
+        return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+
+class Timings:
+    def __init__(self, size=1000):
+        self.size = size
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def get(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, RollingHistogram(self.size))
+        return histogram
+
+    def record(self, name, seconds):
+        self.get(name).add(seconds * 1000)
+
+    """
+    records how late a callback due at `due` (time.monotonic()) ran
+    """
+    def drift(self, name, due):
+        self.get(name + " drift").add((time.monotonic() - due) * 1000)
+
+    """
+    decorator timing every call of a function or method
+    """
+    def timed(self, name):
+        def decorate(function):
+            histogram = self.get(name)
+
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    histogram.add((time.perf_counter() - start) * 1000)
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            return wrapper
+        return decorate
+
+    def summary(self):
+        with self.lock:
+            names = sorted(self.histograms)
+        return {name: self.histograms[name].summary() for name in names}
+
+    """
+    one line per measurement for the overlay
+    """
+    def report(self):
+        lines = []
+        for name, summary in self.summary().items():
+            if "p50" in summary:
+                lines.append("%-26s p50 %8.2f  p95 %8.2f  max %8.2f ms  (%d)" % (
+                    name, summary["p50"], summary["p95"], summary["max"], summary["count"]))
+        return "\n".join(lines)
+
+    def dump(self, path):
+        with self.lock:
+            names = sorted(self.histograms)
+        data = {"started": self.started, "dumped": time.time(),
+                "timings": {name: dict(self.histograms[name].summary(), histogram=self.histograms[name].histogram())
+                            for name in names}}
+        with open(path, "w") as handle:
+            json.dump(data, handle, indent=2)
+        return path
+
+
+timings = Timings()
@@ -0,0 +1,391 @@
+import http.client
+import json
+import math
+import sys
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from graphbuffer import GraphBuffer
+from instrumentation import timings
+
+"""
+Live readings over HTTP for viewers other than the Tk window on the Pi.
+The server subscribes to the SampleHub like any tab, so one sensor read
+serves every viewer, and pushes with server-sent events:
+
+    GET /events     snapshot event, then a sample event per reading and a
+                    window event per graph tick (text/event-stream)
+    GET /snapshot   the snapshot alone (JSON)
+    GET /           a minimal page showing the events
+
+The snapshot holds the filled part of every sensor's window and the latest
+sample. The feed keeps its own GraphBuffers of the same length and step as
+the dashboard's live graphs rather than reading the DashboardTab's: those
+belong to the Tk thread (cleared, resized and swapped with the selected
+sensor there) while the feed is read from the HTTP threads, and the daemon
+has no dashboard at all. In the GUI every window point is thus buffered
+twice, a few kB per sensor.
+
+Every client gets a bounded queue. A client that falls maxQueued events
+behind has its queue dropped and gets a fresh snapshot instead, so a slow
+viewer costs neither memory nor the other viewers' latency.
+
+    python liveserver.py [host:]port    prints the events of a running server
+"""
+LIVE_PORT = 50421
+# same windows as the dashboard's live graphs (DashboardTab.graphCO2 and
+# graphCO2Delta): seconds shown and seconds per point
+WINDOW = (601, 5)
+DELTA_WINDOW = (301, 5)
+# a comment line keeps idle connections (and proxies) from timing out
+KEEPALIVE = 15
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>CO2 live</title></head>
+<body style="font-family: sans-serif"><h1>CO2 live</h1><pre id="readings">connecting...</pre>
+<script>
+var sensors = {};
+function num(v) { return v === null || v === undefined ? "-" : Math.round(v); }
+function show() {
+    var lines = [];
+    for (var name in sensors) {
+        var s = sensors[name];
+        lines.push(name + ": " + num(s.ppm) + " ppm, 10 min mean " + num(s.mean) + " (" + num(s.min) + " .. " +
+                   num(s.max) + ")");
+    }
+    document.getElementById("readings").textContent = lines.join("\\n");
+}
+var events = new EventSource("/events");
+events.addEventListener("snapshot", function (e) {
+    var snapshot = JSON.parse(e.data);
+    sensors = {};
+    for (var name in snapshot.sensors) {
+        var s = snapshot.sensors[name];
+        sensors[name] = {ppm: s.latest ? s.latest.ppm : null, mean: s.mean, min: s.min, max: s.max};
+    }
+    show();
+});
+events.addEventListener("sample", function (e) {
+    var sample = JSON.parse(e.data);
+    (sensors[sample.sensor] = sensors[sample.sensor] || {mean: null, min: null, max: null}).ppm = sample.ppm;
+    show();
+});
+events.addEventListener("window", function (e) {
+    var w = JSON.parse(e.data);
+    Object.assign(sensors[w.sensor] = sensors[w.sensor] || {ppm: null}, {mean: w.mean, min: w.min, max: w.max});
+    show();
+});
+</script></body></html>
+"""
+
+
+"""
+NaN (gap samples, unknown raw) is null in JSON
+"""
+def jsonValue(value):
+    return None if value is None or math.isnan(value) else round(float(value), 2)
+
+
+def sseEvent(name, data, eventId=None):
+    lines = "event: " + name + "\n"
+    if eventId is not None:
+        lines += "id: %d\n" % eventId
+    return (lines + "data: " + json.dumps(data, separators=(",", ":")) + "\n\n").encode()
+
+
+"""
+One viewer's pending events; put() never blocks the publishing thread
+"""
+class LiveClient:
+    def __init__(self, maxQueued):
+        self.events = deque()
+        self.maxQueued = maxQueued
+        self.condition = threading.Condition()
+        # fell behind; the queue was dropped and it needs a new snapshot
+        self.lagging = False
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, event):
+        with self.condition:
+            if self.lagging:
+                return
+            if len(self.events) >= self.maxQueued:
+                self.dropped += len(self.events)
+                self.events.clear()
+                self.lagging = True
+            else:
+                self.events.append(event)
+            self.condition.notify()
+
+    """
+    waits up to timeout seconds; returns the pending events (empty on timeout)
+    """
+    def take(self, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.events or self.lagging or self.closed, timeout)
+            events = list(self.events)
+            self.events.clear()
+            return events
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+"""
+Keeps the window of every sensor and fans events out to the clients.
+sample() and tick() are hub callbacks; they run on the hub's thread, the
+clients are served from the HTTP server's threads.
+"""
+class LiveFeed:
+    def __init__(self, sensors, maxQueued=256):
+        self.maxQueued = maxQueued
+        self.clients = []
+        self.lock = threading.Lock()
+        self.eventId = 0
+        self.windows = {}
+        for sensor in sensors:
+            self.addSensor(sensor.name)
+
+    def addSensor(self, name):
+        # buffers, last ppm (for the delta), samples in the window, latest sample
+        self.windows[name] = {"ppm": GraphBuffer(*WINDOW), "delta": GraphBuffer(*DELTA_WINDOW), "last": 0,
+                              "filled": 0, "latest": None}
+
+    def sampleData(self, sample):
+        return {"sensor": sample.sensor, "time": sample.time, "ppm": jsonValue(sample.ppm),
+                "raw": jsonValue(sample.raw), "variance": jsonValue(sample.variance)}
+
+    """
+    the filled part of a window buffer, oldest first
+    """
+    def filledPart(self, window, key):
+        buffer = window[key].buffer
+        return buffer[len(buffer) - min(window["filled"], len(buffer)):]
+
+    """
+    aggregates of a window; until its ring is full they are taken over the
+    filled part only, the zeros the ring starts with aren't readings
+    """
+    def windowData(self, name):
+        window = self.windows[name]
+        ppm, delta = window["ppm"], window["delta"]
+        if window["filled"] >= ppm.size:
+            mean, low, high, deltaMean = ppm.mean(), ppm.min(), ppm.max(), delta.mean()
+        elif window["filled"] == 0:
+            mean = low = high = deltaMean = None
+        else:
+            values = self.filledPart(window, "ppm")
+            mean, low, high = values.mean(), values.min(), values.max()
+            deltaMean = self.filledPart(window, "delta").mean()
+        return {"sensor": name, "step": ppm.step, "mean": jsonValue(mean), "min": jsonValue(low),
+                "max": jsonValue(high), "deltaMean": jsonValue(deltaMean)}
+
+    """
+    every reading, to every client
+    """
+    def sample(self, sample):
+        with self.lock:
+            if sample.sensor not in self.windows:
+                self.addSensor(sample.sensor)
+            self.windows[sample.sensor]["latest"] = sample
+            self.broadcast("sample", self.sampleData(sample))
+
+    """
+    one point of the graph window (the hub calls this every WINDOW step),
+    like DashboardTab.graphTick
+    """
+    def tick(self, sample):
+        if math.isnan(sample.ppm):
+            return
+        with self.lock:
+            if sample.sensor not in self.windows:
+                self.addSensor(sample.sensor)
+            window = self.windows[sample.sensor]
+            window["ppm"].append(sample.ppm)
+            window["delta"].append(sample.ppm - window["last"])
+            window["last"] = sample.ppm
+            window["filled"] += 1
+            data = self.windowData(sample.sensor)
+            data.update(time=sample.time, ppm=jsonValue(sample.ppm), delta=jsonValue(window["delta"].buffer[-1]))
+            self.broadcast("window", data)
+
+    """
+    encodes an event once and queues it for every client (holding self.lock)
+    """
+    @timings.timed("live broadcast")
+    def broadcast(self, name, data):
+        self.eventId += 1
+        event = sseEvent(name, data, self.eventId)
+        for client in self.clients:
+            client.put(event)
+
+    def snapshot(self):
+        sensors = {}
+        for name, window in self.windows.items():
+            data = self.windowData(name)
+            latest = window["latest"]
+            data["latest"] = None if latest is None else self.sampleData(latest)
+            # only the part of the ring that was filled, oldest first
+            for key in ("ppm", "delta"):
+                data[key] = [jsonValue(v) for v in self.filledPart(window, key)]
+            sensors[name] = data
+        return {"sensors": sensors, "eventId": self.eventId}
+
+    """
+    registers a client; returns it with its snapshot event. Both happen under
+    the lock, so the client gets exactly the events after its snapshot.
+    """
+    def connect(self):
+        client = LiveClient(self.maxQueued)
+        with self.lock:
+            self.clients.append(client)
+            return client, sseEvent("snapshot", self.snapshot(), self.eventId)
+
+    """
+    a fresh snapshot for a client that fell behind
+    """
+    def resync(self, client):
+        with self.lock, client.condition:
+            client.events.clear()
+            client.lagging = False
+            return sseEvent("snapshot", self.snapshot(), self.eventId)
+
+    def disconnect(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        client.close()
+
+    def close(self):
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.close()
+
+
+class LiveRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # a client that can't take a write for this long is dropped
+    timeout = 30
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/events":
+            self.streamEvents()
+        elif path == "/snapshot":
+            with self.server.feed.lock:
+                body = json.dumps(self.server.feed.snapshot()).encode()
+            self.sendBody("application/json", body)
+        elif path == "/":
+            self.sendBody("text/html; charset=utf-8", PAGE)
+        else:
+            self.send_error(404)
+
+    def sendBody(self, contentType, body):
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def streamEvents(self):
+        feed = self.server.feed
+        client, snapshot = feed.connect()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            # no length: the stream ends when either side closes the connection
+            self.send_header("Connection", "close")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(snapshot)
+            self.wfile.flush()
+            while not client.closed:
+                events = client.take(KEEPALIVE)
+                if client.lagging:
+                    events = [feed.resync(client)]
+                elif not events and not client.closed:
+                    events = [b": keepalive\n\n"]
+                self.wfile.write(b"".join(events))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            feed.disconnect(client)
+
+    def log_message(self, format, *args):
+        pass
+
+
+"""
+Serves a LiveFeed on its own threads (one per connection)
+"""
+class LiveServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, feed, port=LIVE_PORT, host="127.0.0.1"):
+        ThreadingHTTPServer.__init__(self, (host, port), LiveRequestHandler)
+        self.feed = feed
+        self.port = self.server_address[1]
+
+    """
+    subscribes the feed to a SampleHub and starts serving in the background
+    """
+    def start(self, hub):
+        hub.subscribe(self.feed.sample)
+        hub.subscribe(self.feed.tick, WINDOW[1])
+        threading.Thread(target=self.serve_forever, name="LiveServer", daemon=True).start()
+        print("live server on http://%s:%d/" % (self.server_address[0], self.port))
+
+    def close(self):
+        self.feed.close()
+        self.shutdown()
+        self.server_close()
+
+
+"""
+"[host:]port" of a command line option; host defaults to loopback
+"""
+def parseAddress(text, port=LIVE_PORT):
+    host, _, portText = (text or "").rpartition(":")
+    return host or "127.0.0.1", int(portText) if portText else port
+
+
+"""
+(event, data) pairs from a live server; a loopback client for testing and
+a text viewer from the command line
+"""
+def iterEvents(host, port, timeout=60):
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    connection.request("GET", "/events")
+    response = connection.getresponse()
+    if response.status != 200:
+        raise OSError("live server answered %d" % response.status)
+    try:
+        name, data = None, []
+        for line in response:
+            line = line.decode().rstrip("\r\n")
+            if line.startswith("event:"):
+                name = line[6:].strip()
+            elif line.startswith("data:"):
+                data.append(line[5:].strip())
+            elif not line and data:
+                yield name, json.loads("\n".join(data))
+                name, data = None, []
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    host, port = parseAddress(sys.argv[1] if len(sys.argv) > 1 else None)
+    for name, data in iterEvents(host, port):
+        if name == "snapshot":
+            for sensor, window in data["sensors"].items():
+                print("%s: %d points in window, mean %s" % (sensor, len(window["ppm"]), window["mean"]))
+        else:
+            print(name, json.dumps(data))
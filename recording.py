@@ -0,0 +1,405 @@
+import os
+import pickle
+import shutil
+import struct
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (Windows); recovery can't tell live journals apart there
+    fcntl = None
+from tiers import writeTiers, readTier, MINUTE_EXT, HOUR_EXT
+from archive import ArchiveWriter, readArchive, ARCHIVE_EXT
+
+"""
+Append-only recording journal.
+
+A journal is a small fixed header followed by one fixed-size record per
+sample, written as the sample arrives. While a recording is running the file
+is called <name>.co2j.part; it is renamed to <name>.co2j when the recording
+is stopped. A .part file found on start-up is what a crash or power cut left
+behind and is recovered by cutting off a torn last record.
+"""
+JOURNAL_MAGIC = b"CO2J"
+JOURNAL_VERSION = 1
+JOURNAL_EXT = ".co2j"
+PART_EXT = ".part"
+# magic, version, record size, v400, v40000, measurementInterval (min)
+JOURNAL_HEADER = struct.Struct("<4sHHddd")
+# epoch time (ms), ppm, raw
+JOURNAL_RECORD = struct.Struct("<qff")
+JOURNAL_DTYPE = np.dtype([("time", "<i8"), ("ppm", "<f4"), ("raw", "<f4")])
+
+
+class RecordingWriter:
+    def __init__(self, path, v400, v40000, measurementInterval, syncInterval=30):
+        self.path = path
+        self.partPath = path + PART_EXT
+        # fsync at most every syncInterval seconds; a crash loses at most that much
+        self.syncInterval = syncInterval
+        self.lastSync = time.monotonic()
+        self.count = 0
+        # locked under a name recovery doesn't look at, then renamed: a .part
+        # file is never seen unlocked while it is being written
+        self.handle = open(self.partPath + ".new", "wb")
+        lockJournal(self.handle)
+        self.handle.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, JOURNAL_RECORD.size,
+                                              v400, v40000, measurementInterval))
+        self.sync()
+        os.replace(self.partPath + ".new", self.partPath)
+
+    def append(self, sample):
+        self.handle.write(JOURNAL_RECORD.pack(int(round(sample.time * 1000)), sample.ppm, sample.raw))
+        self.handle.flush()
+        self.count += 1
+        if time.monotonic() - self.lastSync >= self.syncInterval:
+            self.sync()
+
+    def sync(self):
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.lastSync = time.monotonic()
+
+    """
+    finishes the recording and gives it its final name
+    """
+    def close(self):
+        self.sync()
+        if fcntl is not None:
+            # renamed while still locked, so recovery can't take it in between
+            os.replace(self.partPath, self.path)
+            self.handle.close()
+        else:
+            self.handle.close()
+            os.replace(self.partPath, self.path)
+        return self.path
+
+    """
+    stops writing and deletes the journal
+    """
+    def discard(self):
+        self.handle.close()
+        os.remove(self.partPath)
+
+
+"""
+takes an exclusive lock on an open journal without waiting; False if
+another process (a running recorder) holds it
+"""
+def lockJournal(handle):
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+"""
+Returns (header dict, structured array with time/ppm/raw columns)
+"""
+def readJournal(path):
+    with open(path, "rb") as handle:
+        magic, version, recordSize, v400, v40000, interval = JOURNAL_HEADER.unpack(
+            handle.read(JOURNAL_HEADER.size))
+        if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION or recordSize != JOURNAL_RECORD.size:
+            raise ValueError("not a recording journal: " + path)
+        data = handle.read()
+    # ignore a torn record at the end
+    usable = len(data) - len(data) % recordSize
+    records = np.frombuffer(data[:usable], dtype=JOURNAL_DTYPE)
+    header = {"v400": v400, "v40000": v40000, "measurementInterval": interval}
+    return header, records
+
+
+"""
+Yields the records of a journal in chunks of up to chunkSize, so even a huge
+journal is read in constant memory
+"""
+def iterJournal(path, chunkSize=65536):
+    with open(path, "rb") as handle:
+        magic, version, recordSize, v400, v40000, interval = JOURNAL_HEADER.unpack(
+            handle.read(JOURNAL_HEADER.size))
+        if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION or recordSize != JOURNAL_RECORD.size:
+            raise ValueError("not a recording journal: " + path)
+        while True:
+            data = handle.read(chunkSize * recordSize)
+            # ignore a torn record at the end
+            usable = len(data) - len(data) % recordSize
+            if usable == 0:
+                return
+            yield np.frombuffer(data[:usable], dtype=JOURNAL_DTYPE)
+
+
+"""
+Truncates a torn last record and renames <name>.co2j.part to <name>.co2j.
+Returns the recovered path, None for a journal still being written (it is
+locked by its recorder, e.g. the daemon's) or one too short to hold a header.
+"""
+def recoverJournal(partPath):
+    with open(partPath, "r+b") as handle:
+        if not lockJournal(handle):
+            return None
+        size = os.fstat(handle.fileno()).st_size
+        torn = (size - JOURNAL_HEADER.size) % JOURNAL_RECORD.size
+        if size >= JOURNAL_HEADER.size and torn:
+            handle.truncate(size - torn)
+    if size < JOURNAL_HEADER.size:
+        os.remove(partPath)
+        return None
+    path = partPath[:-len(PART_EXT)]
+    os.replace(partPath, path)
+    return path
+
+
+"""
+Recovers every unfinished journal in directory; returns the recovered paths
+"""
+def recoverJournals(directory):
+    recovered = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(JOURNAL_EXT + PART_EXT):
+            path = recoverJournal(os.path.join(directory, name))
+            if path is not None:
+                recovered.append(path)
+    return recovered
+
+
+"""
+Columnar recording file (.co2r), version 1.
+
+A 64 byte header (magic, version, sample count, v400, v40000,
+measurementInterval) followed by three columns of count values each:
+epoch time in ms (int64), ppm (float32) and raw (float32). Columns start
+8-byte aligned so they can be memory-mapped without copying.
+"""
+RECORDING_MAGIC = b"CO2R"
+RECORDING_VERSION = 1
+RECORDING_EXT = ".co2r"
+RECORDING_HEADER = struct.Struct("<4sHxxqddd")
+RECORDING_HEADER_SIZE = 64
+
+
+class Recording:
+    def __init__(self, header, time, ppm, raw):
+        # header: v400, v40000, measurementInterval
+        self.header = header
+        self.time = time
+        self.ppm = ppm
+        self.raw = raw
+
+    def __len__(self):
+        return len(self.time)
+
+
+"""
+Writes a columnar recording; the file is replaced atomically
+"""
+def writeRecording(path, header, time, ppm, raw):
+    time = np.asarray(time, dtype="<i8")
+    ppm = np.asarray(ppm, dtype="<f4")
+    raw = np.asarray(raw, dtype="<f4")
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as handle:
+        handle.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, len(time), header["v400"],
+                                           header["v40000"], header["measurementInterval"])
+                     .ljust(RECORDING_HEADER_SIZE, b"\0"))
+        handle.write(time.tobytes())
+        handle.write(ppm.tobytes())
+        handle.write(raw.tobytes())
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmpPath, path)
+    return path
+
+
+"""
+Writes a columnar recording chunk by chunk when the sample count isn't known
+up front: every column goes to its own temporary file and close() joins them
+behind the header, so memory use stays constant.
+"""
+class RecordingStreamWriter:
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.count = 0
+        self.columns = [(open(path + "." + name + ".tmp", "w+b"), dtype)
+                        for name, dtype in (("time", "<i8"), ("ppm", "<f4"), ("raw", "<f4"))]
+
+    def append(self, time, ppm, raw):
+        for (handle, dtype), values in zip(self.columns, (time, ppm, raw)):
+            handle.write(np.asarray(values, dtype=dtype).tobytes())
+        self.count += len(time)
+
+    def close(self):
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "wb") as output:
+            output.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, self.count, self.header["v400"],
+                                               self.header["v40000"], self.header["measurementInterval"])
+                         .ljust(RECORDING_HEADER_SIZE, b"\0"))
+            for handle, dtype in self.columns:
+                handle.seek(0)
+                shutil.copyfileobj(handle, output)
+            output.flush()
+            os.fsync(output.fileno())
+        self.discard()
+        os.replace(tmpPath, self.path)
+        return self.path
+
+    def discard(self):
+        for handle, dtype in self.columns:
+            handle.close()
+            os.remove(handle.name)
+
+
+"""
+Opens a columnar recording; the columns are read-only memory maps
+"""
+def openRecording(path):
+    with open(path, "rb") as handle:
+        magic, version, count, v400, v40000, interval = RECORDING_HEADER.unpack(
+            handle.read(RECORDING_HEADER.size))
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise ValueError("not a recording file: " + path)
+    header = {"v400": v400, "v40000": v40000, "measurementInterval": interval}
+    if count == 0:
+        return Recording(header, np.empty(0, "<i8"), np.empty(0, "<f4"), np.empty(0, "<f4"))
+    offset = RECORDING_HEADER_SIZE
+    time = np.memmap(path, dtype="<i8", mode="r", offset=offset, shape=(count,))
+    offset += 8 * count
+    ppm = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(count,))
+    offset += 4 * count
+    raw = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(count,))
+    return Recording(header, time, ppm, raw)
+
+
+"""
+Turns a finished journal into a columnar recording plus its minute and hour
+tiers, and removes the journal
+"""
+def compactJournal(journalPath):
+    header, records = readJournal(journalPath)
+    basePath = journalPath[:-len(JOURNAL_EXT)]
+    writeRecording(basePath + RECORDING_EXT, header, records["time"], records["ppm"], records["raw"])
+    writeTiers(basePath, records["time"], records["ppm"])
+    os.remove(journalPath)
+    return basePath + RECORDING_EXT
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    # old recordings only hold lists/tuples of str and numbers; numpy scalars
+    # are the only objects they may legitimately reference
+    allowed = {("numpy.core.multiarray", "scalar"), ("numpy._core.multiarray", "scalar"), ("numpy", "dtype")}
+
+    def find_class(self, module, name):
+        if (module, name) not in self.allowed:
+            raise pickle.UnpicklingError("refusing to load " + module + "." + name)
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+"""
+Reads an old ("%H:%M", ppm) pickle. The date comes from the file name
+(recordingStart, "%y-%m-%d_at_%H-%M"); a time going backwards means midnight
+was crossed. Raw values were never stored and are NaN.
+"""
+def readPickle(path, header=None):
+    with open(path, "rb") as handle:
+        recorded = LegacyUnpickler(handle).load()
+    try:
+        day = datetime.strptime(os.path.basename(path)[:8], "%y-%m-%d")
+    except ValueError:
+        day = datetime.fromtimestamp(os.path.getmtime(path)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if header is None:
+        header = {"v400": float("nan"), "v40000": float("nan"), "measurementInterval": float("nan")}
+
+    times = []
+    previous = None
+    for stamp, ppm in recorded:
+        clock = datetime.strptime(stamp, "%H:%M")
+        if previous is not None and (clock.hour, clock.minute) < previous:
+            day += timedelta(days=1)
+        previous = (clock.hour, clock.minute)
+        times.append(int(day.replace(hour=clock.hour, minute=clock.minute).timestamp() * 1000))
+    ppm = [float(v) for t, v in recorded]
+    return Recording(header, np.array(times, dtype="<i8"), np.array(ppm, dtype="<f4"),
+                     np.full(len(ppm), np.nan, dtype="<f4"))
+
+
+def convertPickle(path, header=None):
+    recording = readPickle(path, header)
+    newPath = os.path.splitext(path)[0] + RECORDING_EXT
+    return writeRecording(newPath, recording.header, recording.time, recording.ppm, recording.raw)
+
+
+"""
+Compresses a columnar recording into an archive (archive.py) and removes
+it. The archive keeps the recording's mtime, which retention goes by, and
+takes its place in the history's list of imported files.
+"""
+def archiveRecording(path, history=None, chunkSize=65536):
+    recording = openRecording(path)
+    archivePath = path[:-len(RECORDING_EXT)] + ARCHIVE_EXT
+    writer = ArchiveWriter(archivePath, recording.header)
+    for first in range(0, len(recording), chunkSize):
+        last = first + chunkSize
+        writer.append(recording.time[first:last], recording.ppm[first:last], recording.raw[first:last])
+    writer.close()
+    del recording
+    mtime = os.path.getmtime(path)
+    os.utime(archivePath, (mtime, mtime))
+    if history is not None:
+        history.moveImport(path, archivePath)
+    os.remove(path)
+    return archivePath
+
+
+"""
+Archives the recordings in directory older than days; returns the archives
+"""
+def archiveRecordings(directory, days, history=None):
+    archived = []
+    now = time.time()
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(RECORDING_EXT) and now - os.path.getmtime(path) > days * 86400:
+            archived.append(archiveRecording(path, history))
+    return archived
+
+
+"""
+Opens any recording file by extension (.co2r, .co2a archive, .co2j, a
+.co2m/.co2h tier, shown as its bucket means, or legacy .pickle)
+"""
+def loadRecording(path):
+    if path.endswith(RECORDING_EXT):
+        return openRecording(path)
+    if path.endswith(ARCHIVE_EXT):
+        return Recording(*readArchive(path))
+    if path.endswith(JOURNAL_EXT):
+        header, records = readJournal(path)
+        return Recording(header, records["time"], records["ppm"], records["raw"])
+    if path.endswith(MINUTE_EXT) or path.endswith(HOUR_EXT):
+        bucketMs, buckets = readTier(path)
+        header = {"v400": float("nan"), "v40000": float("nan"), "measurementInterval": bucketMs / 60000}
+        return Recording(header, buckets["time"], buckets["mean"], np.full(len(buckets), np.nan, dtype="<f4"))
+    return readPickle(path)
+
+
+if __name__ == "__main__":
+    # python recording.py old1.pickle old2.co2r ...
+    # converts pickles to columnar recordings and archives columnar recordings
+    from history import History, HISTORY_FILE
+    historyPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "saves", HISTORY_FILE)
+    # the history must follow an archived recording, or it imports the archive again
+    history = History(historyPath) if os.path.exists(historyPath) else None
+    for name in sys.argv[1:]:
+        if name.endswith(RECORDING_EXT):
+            print(name, "->", archiveRecording(name, history))
+        else:
+            print(name, "->", convertPickle(name))
+    if history is not None:
+        history.close()
@@ -0,0 +1,60 @@
+import json
+import os
+
+SENSORS_FILE = "sensors.json"
+DEFAULT_SENSOR = "CO2"
+
+# settings a sensor may override; anything it leaves out comes from optVal
+SENSOR_SETTINGS = ("v400", "v40000", "lowCO2", "highCO2", "veryHighCO2", "alertHysteresis", "alertDwell")
+
+
+"""
+One CO2 sensor: its name, the sensorlib channel it is read from (None for
+the single default sensor), its own calibration/thresholds and the noise
+filter of its reads (a filters.py spec, None for the default)
+"""
+class Sensor:
+    def __init__(self, name, channel=None, settings=None, filter=None):
+        self.name = name
+        self.channel = channel
+        self.settings = dict(settings or {})
+        self.filter = filter
+
+    def __repr__(self):
+        return "Sensor(%r, %r)" % (self.name, self.channel)
+
+    def get(self, name, fallback):
+        return self.settings.get(name, fallback[name])
+
+    def calibration(self, fallback):
+        return self.get("v400", fallback), self.get("v40000", fallback)
+
+    """
+    suffix for recording file names; empty for the default sensor so
+    single-sensor setups keep their old names
+    """
+    def fileTag(self):
+        if self.name == DEFAULT_SENSOR:
+            return ""
+        return "_" + self.name
+
+
+"""
+Loads the sensor registry (saves/sensors.json), e.g.
+
+    [{"name": "kitchen", "channel": 0, "v400": 4010, "v40000": 990},
+     {"name": "office", "channel": 1, "highCO2": 1500, "filter": "kalman:16"}]
+
+Without a registry there is one default sensor using the global settings.
+"""
+def loadSensors(path=SENSORS_FILE):
+    if not os.path.exists(path):
+        return [Sensor(DEFAULT_SENSOR)]
+    with open(path) as handle:
+        entries = json.load(handle)
+    sensors = []
+    for entry in entries:
+        settings = {name: entry[name] for name in SENSOR_SETTINGS if name in entry}
+        sensors.append(Sensor(entry["name"], entry.get("channel"), settings, entry.get("filter")))
+    print("sensors:", ", ".join(sensor.name for sensor in sensors))
+    return sensors
@@ -0,0 +1,78 @@
+import os
+import pickle
+
+SETTINGS_FILE = "settings.opt"
+
+defaults = {
+    "v400": 4000,
+    "v40000": 1000,
+    "lowCO2": 413,
+    "highCO2": 2000,
+    "veryHighCO2": 5000,
+    # seconds between two recorded samples
+    "recordingInterval": 120,
+    # days raw recordings / minute tiers are kept once coarser tiers exist
+    "rawRetentionDays": 30,
+    "minuteRetentionDays": 365,
+    # days after which raw recordings are compressed into archives
+    "archiveAfterDays": 7,
+    # ppm an alert must fall back past its threshold to clear, and seconds a
+    # threshold must stay crossed before an alert is raised or cleared
+    "alertHysteresis": 50,
+    "alertDwell": 60
+}
+
+# smallest valid value of an option; every option not listed must be at least 1
+minimums = {
+    # no hysteresis, and alerts as soon as a threshold is crossed
+    "alertHysteresis": 0,
+    "alertDwell": 0
+}
+
+
+"""
+Creates the saves directory next to the program if needed and makes it the cwd
+"""
+def setSaveDir():
+    localPath = os.path.dirname(os.path.abspath(__file__))
+    print('local directory:', localPath)
+    # if localPath == "":
+    #     localPath = "/home/pi/Documents/sensor"
+    saveDirPath = localPath + "/saves"
+    if not os.path.exists(saveDirPath):
+        print("saves directory not found. Creating...")
+        os.mkdir(saveDirPath)
+    os.chdir(saveDirPath)
+    print("set saves directory as cwd: ", os.getcwd())
+
+
+"""
+loads settings file if found (saves/settings.opt), otherwise the defaults
+"""
+def loadSettings(path=SETTINGS_FILE):
+    print("loading settings...")
+    values = dict(defaults)
+    if os.path.exists(path):
+        with open(path, "rb") as handle:
+            values.update(pickle.load(handle))
+            print("settings loaded")
+        # older settings files give the recording interval in minutes
+        if "measurementInterval" in values:
+            values["recordingInterval"] = int(values.pop("measurementInterval")) * 60
+    else:
+        print("no settings file found")
+    return values
+
+
+"""
+writes a temporary file and replaces the settings with it, so a reader (the
+daemon) never sees a half-written file
+"""
+def saveSettings(values, path=SETTINGS_FILE):
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as handle:
+        pickle.dump(values, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmpPath, path)
+    print("settings saved")
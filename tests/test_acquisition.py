@@ -0,0 +1,102 @@
+import math
+from acquisition import Sample, SampleHub, decodeSample, encodeSample
+
+
+def subscribe(hub, interval, gaps=True):
+    delivered = []
+    hub.subscribe(delivered.append, interval, gaps)
+    return delivered
+
+
+def publish(hub, clocks, wallOffset=1_700_000_000.0, sensor="co2"):
+    for clock in clocks:
+        hub.publish(Sample(wallOffset + clock, 3000.0, 500.0, sensor, math.nan, clock))
+
+
+def testDeadlineGrid():
+    hub = SampleHub()
+    every, grid = subscribe(hub, 0), subscribe(hub, 10)
+    # a sample every 2 s, one of them late
+    publish(hub, [0, 2, 4, 6, 8, 10.3, 12, 14, 16, 18, 20, 22])
+    assert len(every) == 12
+    # late by 0.3 s doesn't push the next deadline back
+    assert [sample.monotonic for sample in grid] == [0, 10.3, 20]
+    # early within the slack counts as on time
+    grid.clear()
+    publish(hub, [29.8, 32])
+    assert [sample.monotonic for sample in grid] == [29.8]
+
+
+def testGapSample():
+    hub = SampleHub()
+    withGaps, withoutGaps = subscribe(hub, 10), subscribe(hub, 10, gaps=False)
+    publish(hub, [0, 10, 45])
+    assert [sample.monotonic for sample in withoutGaps] == [0, 10, 45]
+    gap = withGaps[2]
+    # one gap sample at the first missed deadline, at its wall time
+    assert [sample.monotonic for sample in withGaps] == [0, 10, 20, 45]
+    assert math.isnan(gap.ppm) and math.isnan(gap.raw) and gap.sensor == "co2"
+    assert gap.time == 1_700_000_020.0
+    # the grid keeps its deadlines after the late sample
+    withGaps.clear()
+    publish(hub, [50, 55, 60])
+    assert [sample.monotonic for sample in withGaps] == [50, 60]
+
+
+def testSensorsHaveTheirOwnGrid():
+    hub = SampleHub()
+    delivered = subscribe(hub, 10)
+    publish(hub, [0, 5, 10], sensor="a")
+    publish(hub, [5, 10, 15], sensor="b")
+    assert [(sample.sensor, sample.monotonic) for sample in delivered] == [("a", 0), ("a", 10), ("b", 5), ("b", 15)]
+
+
+def testWallClockStep():
+    hub = SampleHub()
+    delivered = subscribe(hub, 60)
+    # NTP steps the wall clock an hour back after 5 minutes; the monotonic clock runs on
+    for clock in range(0, 600, 5):
+        wall = 1_700_000_000.0 + clock - (3600 if clock >= 300 else 0)
+        hub.publish(Sample(wall, 3000.0, 500.0, "co2", math.nan, clock))
+    assert [sample.monotonic for sample in delivered] == list(range(0, 600, 60))
+    assert not any(math.isnan(sample.ppm) for sample in delivered)
+
+
+def testWallTimeWithoutMonotonic():
+    hub = SampleHub()
+    delivered = subscribe(hub, 10)
+    for clock in (0, 5, 10, 35):
+        hub.publish(Sample(1_700_000_000.0 + clock, 3000.0, 500.0, "co2"))
+    assert [sample.time - 1_700_000_000.0 for sample in delivered] == [0, 10, 20, 35]
+    assert math.isnan(delivered[2].ppm)
+
+
+def testClockGoesBack():
+    hub = SampleHub()
+    delivered = subscribe(hub, 10)
+    publish(hub, [1000, 1010])
+    # a restarted daemon: its monotonic clock starts over
+    publish(hub, [3, 8, 13])
+    assert [sample.monotonic for sample in delivered] == [1000, 1010, 3, 13]
+
+
+def testIntervalChange():
+    hub = SampleHub()
+    interval = [600]
+    delivered = []
+    hub.subscribe(delivered.append, lambda: interval[0], gaps=True)
+    publish(hub, [0, 5])
+    interval[0] = 5
+    publish(hub, range(10, 30, 5))
+    # the grid starts over at the first sample of the new interval, without gaps
+    assert [sample.monotonic for sample in delivered] == [0, 10, 15, 20, 25]
+    interval[0] = 20
+    publish(hub, range(30, 80, 5))
+    assert [sample.monotonic for sample in delivered][5:] == [30, 50, 70]
+
+
+def testEncodeSample():
+    sample = Sample(1_700_000_000.5, 3000.0, 512.5, "kitchen", 4.0, 12.25)
+    assert decodeSample(encodeSample(sample)) == sample
+    old = decodeSample(b'{"time": 1.0, "raw": 2.0, "ppm": 3.0}\n')
+    assert old[:4] == (1.0, 2.0, 3.0, "CO2") and math.isnan(old.monotonic)
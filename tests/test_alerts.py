@@ -0,0 +1,88 @@
+import math
+import pytest
+from acquisition import Sample
+from alerts import AlertEngine, ThresholdState, FileSink, createSink, level, logSink
+from sensors import Sensor
+from settings import defaults
+
+
+def feed(state, readings, limit=1000, hysteresis=50, dwell=10):
+    return [(time, state.update(time, ppm, limit, hysteresis, dwell)) for time, ppm in readings]
+
+
+def changes(results):
+    return [(time, change) for time, change in results if change is not None]
+
+
+def testRaisedOnlyAfterDwell():
+    state = ThresholdState("highCO2", True)
+    results = feed(state, [(0, 1000), (5, 1100), (9, 1200), (10, 1200)])
+    assert changes(results) == [(10, "raised")]
+    assert state.active
+
+
+def testShortExcursionsDontRaise():
+    state = ThresholdState("highCO2", True)
+    # crossed for 9 s twice, back below in between: the dwell starts again
+    assert changes(feed(state, [(0, 1100), (9, 1100), (10, 900), (11, 1100), (20, 1100)])) == []
+    assert not state.active
+
+
+def testHysteresis():
+    state = ThresholdState("highCO2", True)
+    feed(state, [(0, 1100), (10, 1100)])
+    # below the threshold but inside the hysteresis band: stays raised
+    assert changes(feed(state, [(20, 990), (40, 960)])) == []
+    assert changes(feed(state, [(50, 940), (55, 949), (60, 900)])) == [(60, "cleared")]
+    assert not state.active
+
+
+def testLowThreshold():
+    state = ThresholdState("lowCO2", False)
+    assert changes(feed(state, [(0, 400), (10, 400)], limit=413)) == [(10, "raised")]
+    # back above, but inside the hysteresis band at 450
+    assert changes(feed(state, [(20, 450), (25, 470), (34, 470), (35, 470)], limit=413)) == [(35, "cleared")]
+
+
+def testLevel():
+    sensor = Sensor("kitchen", settings={"highCO2": 1500})
+    assert level(1499, sensor, defaults) == "normal"
+    assert level(1500, sensor, defaults) == "high"
+    assert level(defaults["veryHighCO2"], sensor, defaults) == "very high"
+    assert level(defaults["lowCO2"], sensor, defaults) == "low"
+
+
+def testEngine(tmp_path):
+    alerts = []
+    path = str(tmp_path / "alerts.jsonl")
+    sensors = [Sensor("kitchen", settings={"highCO2": 1000, "alertDwell": 10, "alertHysteresis": 50}),
+               Sensor("office")]
+    engine = AlertEngine(defaults, sensors, [alerts.append, FileSink(path)])
+    for time, ppm in [(0, 1100), (5, math.nan), (10, 1100), (20, 900), (30, 900)]:
+        engine.check(Sample(float(time), 0.0, ppm, "kitchen"))
+    # the gap sample neither raised nor reset anything
+    assert [(a.time, a.sensor, a.threshold, a.state, a.limit) for a in alerts] == [
+        (10.0, "kitchen", "highCO2", "raised", 1000), (30.0, "kitchen", "highCO2", "cleared", 1000)]
+    assert engine.active() == []
+    with open(path) as handle:
+        assert len(handle.readlines()) == 2
+
+
+def testFailingSinkDoesntStopOthers():
+    alerts = []
+
+    def failing(alert):
+        raise RuntimeError("sink down")
+
+    engine = AlertEngine(defaults, [Sensor("kitchen", settings={"alertDwell": 0})], [failing, alerts.append])
+    engine.check(Sample(0.0, 0.0, 10000.0, "kitchen"))
+    assert {a.threshold for a in alerts} == {"highCO2", "veryHighCO2"}
+    assert sorted(engine.active()) == [("kitchen", "highCO2"), ("kitchen", "veryHighCO2")]
+
+
+def testCreateSink(tmp_path):
+    assert createSink("log") is logSink
+    assert isinstance(createSink("file:" + str(tmp_path / "a.jsonl")), FileSink)
+    for spec in ("mail:me", "file:", "command"):
+        with pytest.raises(ValueError):
+            createSink(spec)
@@ -0,0 +1,70 @@
+import math
+import numpy as np
+import pytest
+from analytics import RecordingAnalytics, decayRate, rollingMean, timeAbove
+
+
+def recording(count, seed=1):
+    rng = np.random.default_rng(seed)
+    times = 1_700_000_000_000 + np.arange(count, dtype=np.int64) * 60000
+    # a few rises above 1000 and 2000 ppm, and some gaps
+    values = 700 + 900 * np.sin(np.arange(count) / 40) ** 2 + rng.normal(0, 20, count)
+    values[rng.choice(count, count // 50, replace=False)] = np.nan
+    return times, values
+
+
+def analyse(times, values, splits=()):
+    analytics = RecordingAnalytics(450, 1000, 2000)
+    for part in zip(np.split(times, splits), np.split(values, splits)):
+        analytics.extend(*part)
+    return analytics
+
+
+@pytest.mark.parametrize("splits", [[1], [2, 3, 4], [137, 500, 501], list(range(10, 1000, 10)), list(range(1000))])
+def testIncrementalEqualsBatch(splits):
+    times, values = recording(1000)
+    batch = analyse(times, values)
+    incremental = analyse(times, values, splits)
+    for name in ("count", "first", "last", "lastValid", "timeAboveHigh", "timeAboveVeryHigh", "events"):
+        assert getattr(incremental, name) == getattr(batch, name)
+    assert incremental.mean() == pytest.approx(batch.mean())
+    assert incremental.meanDelta() == pytest.approx(batch.meanDelta())
+    assert len(batch.events) > 3 and batch.events[0]["decayRate"] > 0
+
+
+def testBatchValues():
+    times, values = recording(1000)
+    analytics = analyse(times, values)
+    assert analytics.mean() == pytest.approx(np.nanmean(values))
+    assert analytics.timeAboveHigh == timeAbove(times, values, 1000)
+    assert analytics.timeAboveHigh == np.count_nonzero(values[:-1] > 1000) * 60000
+    event = analytics.events[0]
+    run = values[(times >= event["start"]) & (times < event["end"])]
+    # gaps don't split an event
+    assert np.isnan(run).any() and event["decayRate"] > 0
+    assert event["peak"] == np.nanmax(run) and np.all(run[~np.isnan(run)] > 1000)
+
+
+def testOpenEvent():
+    analytics = RecordingAnalytics(450, 1000, 2000)
+    analytics.extend([0, 60000], [900, 1200])
+    analytics.extend([120000], [1500])
+    assert analytics.events == [{"start": 60000, "end": None, "peak": 1500, "peakTime": 120000, "decayRate": None}]
+    assert analytics.eventsBetween(600000, 700000) == analytics.events
+    analytics.extend([180000, 3780000], [1300, 900])
+    assert analytics.events[0]["end"] == 3780000
+    assert analytics.events[0]["decayRate"] == pytest.approx(decayRate(120000, 1500, 3780000, 900, 450))
+    assert analytics.eventsBetween(3800000, 3900000) == []
+
+
+def testWithoutValues():
+    analytics = RecordingAnalytics(450, 1000, 2000)
+    assert math.isnan(analytics.mean()) and analytics.meanDelta() == 0
+    analytics.extend([0, 1000], [np.nan, np.nan])
+    assert math.isnan(analytics.mean()) and analytics.first is None
+
+
+def testRollingMean():
+    values = np.array([1, 2, np.nan, 4, np.nan, np.nan, np.nan])
+    assert rollingMean(values, 2)[:5].tolist() == [1, 1.5, 2, 4, 4]
+    assert np.isnan(rollingMean(values, 2)[-1])
@@ -0,0 +1,122 @@
+import os
+import numpy as np
+import pytest
+from archive import (decodeTimes, decodeValues, decodeVarints, encodeTimes, encodeValues, encodeVarints,
+                     iterArchive, readArchive, writeArchive, ArchiveWriter, PPM_SCALE)
+from history import History
+from recording import archiveRecording, loadRecording, openRecording, writeRecording
+
+HEADER = {"v400": 4000.0, "v40000": 1000.0, "measurementInterval": 1 / 60}
+
+
+def samples(count, start=1_700_000_000_000, step=1000, seed=1):
+    rng = np.random.default_rng(seed)
+    times = start + np.arange(count, dtype=np.int64) * step
+    ppm = (800 + np.cumsum(rng.normal(0, 3, count))).astype(np.float32)
+    raw = (3000 + np.cumsum(rng.normal(0, 1, count))).astype(np.float32)
+    return times, ppm, raw
+
+
+def testVarintEdgeValues():
+    values = [0, 1, -1, 63, -64, 64, -65, 127, 128, 8191, 8192, -8193, 2 ** 31, -2 ** 31,
+              2 ** 62, -2 ** 62, 2 ** 63 - 1, -2 ** 63]
+    encoded = encodeVarints(values)
+    assert decodeVarints(encoded).tolist() == values
+    # zigzag keeps small magnitudes short whatever their sign
+    assert len(encodeVarints([0, -1, 1, 63, -64])) == 5
+    assert len(encodeVarints([2 ** 63 - 1])) == 10
+    assert decodeVarints(encodeVarints([])).tolist() == []
+
+
+def testTimesExact():
+    times = np.array([5, 1005, 2005, 2006, 9000, 9000, 100_000_000_000_000], dtype=np.int64)
+    assert decodeTimes(encodeTimes(times), times[0]).tolist() == times.tolist()
+    assert decodeTimes(encodeTimes(times[:1]), times[0]).tolist() == [5]
+
+
+@pytest.mark.parametrize("missing", [[], [0], [9], [0, 1, 2], [3, 7, 8, 9], list(range(10))])
+def testNaNPositions(missing):
+    values = np.linspace(400, 5000, 10).astype(np.float32)
+    values[missing] = np.nan
+    decoded = decodeValues(encodeValues(values, PPM_SCALE), len(values), PPM_SCALE)
+    assert np.flatnonzero(np.isnan(decoded)).tolist() == missing
+    valid = ~np.isnan(values)
+    assert np.all(np.abs(decoded[valid] - values[valid]) <= 0.5 / PPM_SCALE + 1e-3)
+
+
+def testRoundTrip(tmp_path):
+    path = str(tmp_path / "a.co2a")
+    times, ppm, raw = samples(10000)
+    ppm[100:200] = np.nan
+    raw[:] = np.round(raw)
+    raw[5000] = np.nan
+    writeArchive(path, HEADER, times, ppm, raw, blockSize=1024)
+    header, readTimes, readPPM, readRaw = readArchive(path)
+    assert header == HEADER
+    assert readTimes.tolist() == times.tolist()
+    assert np.array_equal(np.isnan(readPPM), np.isnan(ppm))
+    # ppm to two decimals, integer raw values exactly
+    assert np.nanmax(np.abs(readPPM - ppm)) <= 0.5 / PPM_SCALE + 1e-3
+    assert np.array_equal(readRaw, raw, equal_nan=True)
+
+
+def testEmptyArchive(tmp_path):
+    path = str(tmp_path / "a.co2a")
+    writeArchive(path, HEADER, [], [], [])
+    header, times, ppm, raw = readArchive(path)
+    assert header == HEADER and len(times) == len(ppm) == len(raw) == 0
+    assert list(iterArchive(path)) == []
+
+
+def testAllNaNBlock(tmp_path):
+    path = str(tmp_path / "a.co2a")
+    times, ppm, raw = samples(300)
+    ppm[100:200] = np.nan
+    raw[:] = np.nan
+    writeArchive(path, HEADER, times, ppm, raw, blockSize=100)
+    blocks = list(iterArchive(path))
+    assert len(blocks) == 3
+    assert np.isnan(blocks[1][1]).all() and np.isnan(blocks[0][2]).all()
+    assert blocks[1][0].tolist() == times[100:200].tolist()
+
+
+def testChunksOfAnySize(tmp_path):
+    path = str(tmp_path / "a.co2a")
+    times, ppm, raw = samples(1000)
+    writer = ArchiveWriter(path, HEADER, blockSize=128)
+    for first, last in [(0, 1), (1, 300), (300, 301), (301, 1000)]:
+        writer.append(times[first:last], ppm[first:last], raw[first:last])
+    writer.close()
+    assert [len(block[0]) for block in iterArchive(path)] == [128] * 7 + [104]
+    assert readArchive(path)[1].tolist() == times.tolist()
+    assert not os.path.exists(path + ".tmp")
+
+
+def testSkipsBlocksOutsideRange(tmp_path):
+    path = str(tmp_path / "a.co2a")
+    times, ppm, raw = samples(1000)
+    writeArchive(path, HEADER, times, ppm, raw, blockSize=100)
+    blocks = list(iterArchive(path, times[250], times[420]))
+    # the blocks holding 250..420, whole; the caller cuts them to the range
+    assert [block[0][0] for block in blocks] == [times[200], times[300], times[400]]
+    assert list(iterArchive(path, times[-1] + 1)) == []
+    assert len(list(iterArchive(path, end=times[0]))) == 1
+
+
+def testArchiveRecording(tmp_path):
+    path = str(tmp_path / "23-11-14_at_22-13_kitchen.co2r")
+    times, ppm, raw = samples(5000)
+    writeRecording(path, HEADER, times, ppm, raw)
+    os.utime(path, (1_000_000_000, 1_000_000_000))
+    history = History(str(tmp_path / "history.db"))
+    history.importRecording(path, openRecording(path))
+    archivePath = archiveRecording(path, history)
+    assert not os.path.exists(path)
+    assert os.path.getmtime(archivePath) == 1_000_000_000
+    archived = loadRecording(archivePath)
+    assert archived.time.tolist() == times.tolist()
+    assert np.max(np.abs(archived.ppm - ppm)) <= 0.5 / PPM_SCALE + 1e-3
+    # the history knows the archive is the file it imported
+    assert history.importDirectory(str(tmp_path)) == []
+    assert history.db.execute("SELECT SUM(count) FROM minute").fetchone()[0] == 5000
+    history.close()
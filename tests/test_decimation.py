@@ -0,0 +1,64 @@
+import numpy as np
+from decimation import Pyramid
+
+
+def recording(count, seed=1):
+    rng = np.random.default_rng(seed)
+    times = 1_700_000_000_000 + np.arange(count, dtype=np.int64) * 1000
+    values = (800 + rng.normal(0, 5, count)).astype(np.float32)
+    return times, values
+
+
+def testLevels():
+    times, values = recording(10000)
+    pyramid = Pyramid(times, values)
+    assert len(pyramid) == 10000
+    assert [len(level["start"]) for level in pyramid.levels] == [10000, 2500, 625, 157]
+    # level 0 is the recording itself
+    assert pyramid.levels[0]["min"] is values
+    top = pyramid.levels[-1]
+    assert top["count"].sum() == 10000
+    assert top["start"][0] == times[0] and top["end"][-1] == times[-1]
+    assert np.isclose(top["sum"].sum(), values.astype(np.float64).sum())
+    assert np.allclose(pyramid.mean(pyramid.levels[1]), values.reshape(-1, 4).mean(axis=1))
+
+
+def testPeaksSurvive():
+    times, values = recording(100000)
+    values[31337] = 5000
+    values[77777] = 100
+    pyramid = Pyramid(times, values)
+    for level in pyramid.levels:
+        assert np.nanmax(level["max"]) == 5000 and np.nanmin(level["min"]) == 100
+    assert pyramid.max() == 5000 and pyramid.min() == 100
+    # a single sample peak shows in the envelope at any zoom
+    for maxBuckets in (100, 1000, 10000):
+        time, envelope = pyramid.envelope(maxBuckets)
+        assert len(envelope) <= 2 * maxBuckets and envelope.max() == 5000 and envelope.min() == 100
+
+
+def testGaps():
+    times, values = recording(1000)
+    values[100:200] = np.nan
+    values[0:4] = np.nan
+    pyramid = Pyramid(times, values, minBuckets=16)
+    level = pyramid.levels[1]
+    # an all-gap bucket has no values; partly missing buckets count only what is there
+    assert level["count"][0] == 0 and np.isnan(level["min"][0])
+    assert level["count"][25:50].sum() == 0 and level["count"][50] == 4
+    assert pyramid.levels[-1]["count"].sum() == 896
+    assert np.isclose(np.nansum(pyramid.mean(pyramid.levels[-1]) * pyramid.levels[-1]["count"]), np.nansum(values))
+
+
+def testSelectVisibleRange():
+    times, values = recording(100000)
+    pyramid = Pyramid(times, values)
+    # zoomed into 1000 samples, level 0 fits 2000 buckets
+    start, end = int(times[50000]), int(times[50999])
+    level, i0, i1 = pyramid.select(2000, start, end)
+    assert level is pyramid.levels[0] and (i0, i1) == (49999, 51001)
+    # the whole recording in 1000 buckets needs a coarser level
+    level, i0, i1 = pyramid.select(1000)
+    assert i1 - i0 <= 1000 and level is pyramid.levels[4]
+    time, envelope = pyramid.envelope(1000, start, end)
+    assert time[0] <= start and time[-1] >= end and np.all(np.diff(time) >= 0)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from filters import EMAFilter, KalmanFilter, MedianFilter, createFilter
+
+
+def bursts(count, bursts=200, value=2000.0, noise=30.0, seed=1):
+    return np.random.default_rng(seed).normal(value, noise, (bursts, count))
+
+
+def testMedian():
+    value, variance = MedianFilter(5).update([1, 2, 100, 3, 4])
+    assert value == 3
+    assert MedianFilter(1).update([7]) == (7, 0.0)
+
+
+def testMedianVarianceMatchesSpread():
+    results = np.array([MedianFilter(16).update(burst) for burst in bursts(16)])
+    measured = np.var(results[:, 0])
+    assert 0.5 < np.mean(results[:, 1]) / measured < 2
+
+
+def testEMAStartsAtFirstRead():
+    ema = EMAFilter(4, 0.5)
+    assert ema.update([100]) == (100, 0.0)
+    value, variance = ema.update([200])
+    assert value == 150 and variance > 0
+
+
+def testEMAVarianceMatchesSpread():
+    ema = EMAFilter(16)
+    results = np.array([ema.update(burst) for burst in bursts(16)])[20:]
+    measured = np.var(results[:, 0])
+    assert 0.3 < np.mean(results[:, 1]) / measured < 3
+
+
+def testKalmanConverges():
+    kalman = KalmanFilter(16)
+    results = np.array([kalman.update(burst) for burst in bursts(16)])
+    assert abs(results[-1, 0] - 2000) < 10
+    # more reads, more certainty
+    assert results[-1, 1] < results[0, 1]
+
+
+def testKalmanFollowsStep():
+    kalman = KalmanFilter(16, processVariance=1.0)
+    for burst in bursts(16, value=2000.0):
+        kalman.update(burst)
+    for burst in bursts(16, bursts=50, value=1000.0, seed=2):
+        value, variance = kalman.update(burst)
+    assert abs(value - 1000) < 20
+
+
+def testIdenticalReads():
+    # a quantized ADC can read the same value a whole burst long
+    for spec in ("median:4", "ema:4", "kalman:4"):
+        value, variance = createFilter(spec).update([1234] * 4)
+        assert value == 1234 and variance >= 0
+
+
+def testCreateFilter():
+    assert isinstance(createFilter("median:8"), MedianFilter)
+    ema = createFilter("ema:8:0.2")
+    assert ema.count == 8 and ema.alpha == 0.2
+    kalman = createFilter("kalman:4:0.5")
+    assert kalman.count == 4 and kalman.processVariance == 0.5
+    for spec in ("median", "median:0", "mean:4", "kalman:x"):
+        with pytest.raises(ValueError):
+            createFilter(spec)
@@ -0,0 +1,94 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from history import History, RAW_RANGE
+from recording import Recording
+
+HEADER = {"v400": 4000.0, "v40000": 1000.0, "measurementInterval": 1 / 60}
+# a Monday, local time like the aggregates
+MONDAY = int(datetime(2023, 11, 13).timestamp() * 1000)
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = History(str(tmp_path / "history.db"))
+    yield history
+    history.close()
+
+
+def recording(count, start=MONDAY, step=60000, ppm=None):
+    times = start + np.arange(count, dtype=np.int64) * step
+    if ppm is None:
+        ppm = 400 + np.arange(count) % 100
+    return Recording(HEADER, times, np.asarray(ppm, dtype=np.float32), np.full(count, 3000, dtype=np.float32))
+
+
+def hourCounts(history, sensor):
+    return history.db.execute("SELECT SUM(count) FROM hour WHERE sensor = ?", (sensor,)).fetchone()[0]
+
+
+def testImportOnce(history, tmp_path):
+    path = str(tmp_path / "23-11-13_at_00-00_kitchen.co2r")
+    assert history.importRecording(path, recording(120))
+    assert not history.importRecording(path, recording(120))
+    assert history.db.execute("SELECT sensor, start, end, count FROM imports").fetchall() == [
+        ("kitchen", MONDAY, MONDAY + 119 * 60000, 120)]
+    # the same samples from another file don't count twice in the roll-ups
+    assert history.importRecording(str(tmp_path / "copy.co2r"), recording(120), "kitchen")
+    assert history.db.execute("SELECT COUNT(*) FROM samples").fetchone()[0] == 120
+    assert hourCounts(history, "kitchen") == 120
+
+
+def testGapsAreNotCounted(history):
+    ppm = np.full(60, 500, dtype=np.float32)
+    ppm[10:20] = np.nan
+    history.insert("co2", recording(60, ppm=ppm).time, ppm, np.zeros(60))
+    assert hourCounts(history, "co2") == 50
+    times, values = history.range("co2", MONDAY, MONDAY + 3600000)
+    assert len(times) == 60 and np.isnan(values[10:20]).all()
+
+
+def testRangeTiers(history):
+    # two samples a minute, so the tiers can be told apart
+    data = recording(10 * 2880, step=30000)
+    history.insert("co2", data.time, data.ppm, data.raw)
+    day = MONDAY + 86400000
+    times, ppm = history.range("co2", day, day + 86400000 - 1)
+    assert len(times) == 2880 and ppm.tolist() == data.ppm[2880:5760].tolist()
+    # longer than RAW_RANGE: minute buckets
+    times, ppm = history.range("co2", MONDAY, MONDAY + RAW_RANGE + 86400000 - 1)
+    assert len(times) == 8 * 1440 and ppm[0] == pytest.approx(np.mean(data.ppm[:2]))
+    times, ppm = history.range("co2", MONDAY, MONDAY + 86400000 - 1, tier="hour")
+    assert len(times) == 24 and ppm[0] == pytest.approx(np.mean(data.ppm[:120]))
+    # raw samples pruned: the same short range falls back to the minutes
+    history.prune(0, 365, now=MONDAY + 10 * 86400000)
+    times, ppm = history.range("co2", day, day + 86400000 - 1)
+    assert len(times) == 1440 and history.span("co2") is None
+
+
+def testAggregateWeekdays(history):
+    # two weeks, hourly, 500 ppm on workdays and 400 ppm at the weekend
+    times = MONDAY + np.arange(14 * 24, dtype=np.int64) * 3600000
+    weekday = np.array([datetime.fromtimestamp(t / 1000).isoweekday() for t in times.tolist()])
+    ppm = np.where(weekday <= 5, 500.0, 400.0)
+    history.insert("co2", times, ppm, np.zeros(len(times)))
+    rows = history.aggregate("co2", MONDAY, int(times[-1]), "weekday")
+    assert [row[0] for row in rows] == ["0", "1", "2", "3", "4", "5", "6"]
+    assert [row[1] for row in rows] == [400.0, 500.0, 500.0, 500.0, 500.0, 500.0, 400.0]
+    assert all(row[4] == 48 for row in rows)
+    rows = history.aggregate("co2", MONDAY, int(times[-1]), "day", weekdays=(1, 2, 3, 4, 5))
+    assert len(rows) == 10 and {row[1] for row in rows} == {500.0}
+    assert rows[0][0] == "2023-11-13"
+
+
+def testReplaceSamplesKeepsNeighbours(history):
+    # two recordings sharing the bucket of minute 0 and hour 0
+    first = recording(30, step=1000, ppm=np.full(30, 400))
+    second = recording(30, start=MONDAY + 30000, step=1000, ppm=np.full(30, 600))
+    history.insert("co2", first.time, first.ppm, first.raw)
+    history.insert("co2", second.time, second.ppm, second.raw)
+    history.replaceSamples("co2", first.time, np.full(30, 800, dtype=np.float32), first.raw)
+    assert history.db.execute("SELECT mean, min, max, count FROM minute").fetchall() == [(700.0, 600.0, 800.0, 60)]
+    assert history.db.execute("SELECT mean, count FROM hour").fetchall() == [(700.0, 60)]
+    times, ppm = history.range("co2", MONDAY, MONDAY + 60000)
+    assert ppm.tolist() == [800.0] * 30 + [600.0] * 30
@@ -0,0 +1,93 @@
+import socket
+import threading
+import time
+import pytest
+from acquisition import Sample
+from liveserver import LiveFeed, LiveServer, LiveRequestHandler, iterEvents, WINDOW
+
+
+@pytest.fixture
+def server():
+    server = LiveServer(LiveFeed([], maxQueued=8), 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.close()
+
+
+def connect(server):
+    return iterEvents("127.0.0.1", server.port, timeout=10)
+
+
+def waitFor(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def testSnapshotThenEvents(server):
+    feed = server.feed
+    for i in range(3):
+        feed.tick(Sample(1000.0 + i * WINDOW[1], 0.0, 500.0 + i, "kitchen"))
+    events = connect(server)
+    name, snapshot = next(events)
+    assert name == "snapshot"
+    window = snapshot["sensors"]["kitchen"]
+    assert window["ppm"] == [500.0, 501.0, 502.0]
+    # the aggregates cover the filled part only, not the zeros of the ring
+    assert (window["mean"], window["min"], window["max"]) == (501.0, 500.0, 502.0)
+
+    feed.sample(Sample(1020.0, 1234.0, 503.0, "kitchen"))
+    feed.tick(Sample(1020.0, 1234.0, 503.0, "kitchen"))
+    name, data = next(events)
+    assert name == "sample" and data["ppm"] == 503.0 and data["raw"] == 1234.0
+    name, data = next(events)
+    assert name == "window" and data["ppm"] == 503.0 and data["delta"] == 1.0 and data["max"] == 503.0
+    events.close()
+
+
+def testLaggingClientGetsNewSnapshot(server):
+    feed = server.feed
+    events = connect(server)
+    assert next(events)[0] == "snapshot"
+    client = feed.clients[0]
+    # the handler can't take events while the condition is held, so they pile up
+    with client.condition:
+        for i in range(feed.maxQueued + 5):
+            feed.sample(Sample(1000.0 + i, 0.0, 400.0 + i, "kitchen"))
+        assert client.lagging and client.dropped == feed.maxQueued
+    name, snapshot = next(events)
+    assert name == "snapshot"
+    assert snapshot["sensors"]["kitchen"]["latest"]["ppm"] == 400.0 + feed.maxQueued + 4
+    # and from there on the events again
+    feed.sample(Sample(2000.0, 0.0, 600.0, "kitchen"))
+    name, data = next(events)
+    assert name == "sample" and data["ppm"] == 600.0
+    events.close()
+
+
+def testStalledClientIsDropped(server, monkeypatch):
+    monkeypatch.setattr(LiveRequestHandler, "timeout", 0.5)
+    feed = server.feed
+    # full windows make every resync snapshot large, so the socket buffers fill quickly
+    for sensor in range(50):
+        for i in range(WINDOW[0] // WINDOW[1] + 1):
+            feed.tick(Sample(float(i), 0.0, 400.0 + i, "sensor%d" % sensor))
+    stalled = socket.socket()
+    stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    stalled.connect(("127.0.0.1", server.port))
+    stalled.sendall(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    waitFor(lambda: len(feed.clients) == 1)
+    # never read: once the socket buffers are full the handler's write times out
+    deadline = time.monotonic() + 20
+    published = 0
+    while feed.clients:
+        assert time.monotonic() < deadline, "stalled client was not dropped"
+        start = time.monotonic()
+        for i in range(1000):
+            feed.sample(Sample(float(published), 0.0, 400.0, "kitchen"))
+            published += 1
+        # publishing never waits for the client
+        assert time.monotonic() - start < 1
+        time.sleep(0.01)
+    stalled.close()
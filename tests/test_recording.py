@@ -0,0 +1,91 @@
+import os
+import pickle
+from datetime import datetime
+import numpy as np
+import pytest
+from acquisition import Sample
+from recording import (RecordingWriter, compactJournal, convertPickle, loadRecording, openRecording, readJournal,
+                       readPickle, recoverJournal, recoverJournals, JOURNAL_HEADER, JOURNAL_RECORD)
+from tiers import readTier, HOUR_EXT, MINUTE_EXT
+
+START = 1_700_000_000.0
+
+
+def writeJournal(directory, count, name="23-11-14_at_22-13.co2j"):
+    writer = RecordingWriter(os.path.join(directory, name), 4000.0, 1000.0, 2.0)
+    for i in range(count):
+        writer.append(Sample(START + i * 30, 3000.0 + i, 500.0 + i))
+    return writer
+
+
+def testRecoverTruncatesTornRecord(tmp_path):
+    writer = writeJournal(str(tmp_path), 10)
+    writer.handle.close()
+    # a power cut in the middle of the 11th record
+    with open(writer.partPath, "ab") as handle:
+        handle.write(b"\x01" * (JOURNAL_RECORD.size // 2))
+    path = recoverJournal(writer.partPath)
+    assert path == writer.path and not os.path.exists(writer.partPath)
+    assert os.path.getsize(path) == JOURNAL_HEADER.size + 10 * JOURNAL_RECORD.size
+    header, records = readJournal(path)
+    assert header == {"v400": 4000.0, "v40000": 1000.0, "measurementInterval": 2.0}
+    assert records["ppm"].tolist() == [500.0 + i for i in range(10)]
+
+
+def testRecoverDropsJournalWithoutHeader(tmp_path):
+    partPath = str(tmp_path / "23-11-14_at_22-13.co2j.part")
+    with open(partPath, "wb") as handle:
+        handle.write(b"CO2J\x01")
+    assert recoverJournal(partPath) is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+def testRecoverSkipsLiveJournal(tmp_path):
+    writer = writeJournal(str(tmp_path), 3)
+    # the recorder still holds its lock
+    assert recoverJournals(str(tmp_path)) == []
+    writer.append(Sample(START + 90, 3003.0, 503.0))
+    assert len(readJournal(writer.close())[1]) == 4
+
+
+def testCompactJournal(tmp_path):
+    writer = writeJournal(str(tmp_path), 240)
+    path = compactJournal(writer.close())
+    assert not os.path.exists(writer.path)
+    recording = openRecording(path)
+    assert recording.header == {"v400": 4000.0, "v40000": 1000.0, "measurementInterval": 2.0}
+    assert recording.time.tolist() == [int((START + i * 30) * 1000) for i in range(240)]
+    assert recording.ppm.tolist() == [500.0 + i for i in range(240)]
+    assert recording.raw.tolist() == [3000.0 + i for i in range(240)]
+    base = path[:-len(".co2r")]
+    bucketMs, minutes = readTier(base + MINUTE_EXT)
+    assert bucketMs == 60000 and minutes["count"].sum() == 240
+    bucketMs, hours = readTier(base + HOUR_EXT)
+    assert bucketMs == 3600000 and hours["count"].sum() == 240
+    assert np.isclose(hours["mean"] @ hours["count"] / 240, np.mean(recording.ppm))
+    assert loadRecording(path).ppm.tolist() == recording.ppm.tolist()
+
+
+def testPickleAcrossMidnight(tmp_path):
+    path = str(tmp_path / "23-11-14_at_23-58.pickle")
+    with open(path, "wb") as handle:
+        pickle.dump([("23:58", 500), ("23:59", 510.0), ("00:00", 520), ("00:01", 530)], handle)
+    recording = readPickle(path)
+    stamps = [datetime.fromtimestamp(t / 1000) for t in recording.time.tolist()]
+    assert stamps == [datetime(2023, 11, 14, 23, 58), datetime(2023, 11, 14, 23, 59),
+                      datetime(2023, 11, 15, 0, 0), datetime(2023, 11, 15, 0, 1)]
+    assert recording.ppm.tolist() == [500.0, 510.0, 520.0, 530.0]
+    assert np.isnan(recording.raw).all()
+
+    converted = openRecording(convertPickle(path, {"v400": 4000.0, "v40000": 1000.0, "measurementInterval": 1.0}))
+    assert converted.header["v400"] == 4000.0
+    assert converted.time.tolist() == recording.time.tolist()
+    assert converted.ppm.tolist() == recording.ppm.tolist()
+
+
+def testPickleRefusesObjects(tmp_path):
+    path = str(tmp_path / "23-11-14_at_23-58.pickle")
+    with open(path, "wb") as handle:
+        pickle.dump([("23:58", datetime(2023, 11, 14))], handle)
+    with pytest.raises(pickle.UnpicklingError):
+        readPickle(path)
@@ -0,0 +1,57 @@
+import os
+import time
+import numpy as np
+from tiers import applyRetention, readTier, rollUp, writeTiers, HOUR_EXT, MINUTE_EXT
+
+
+def testRollUp():
+    # every 10 s from 30 s before to 2:20 after the start of an hour
+    start = 1_700_000_000_000 // 3600000 * 3600000 + 8 * 3600000 - 30000
+    times = start + np.arange(18, dtype=np.int64) * 10000
+    values = np.arange(18, dtype=np.float64) * 10
+    values[[4, 5, 6, 7, 8]] = np.nan
+    buckets = rollUp(times, values, 60000)
+    assert buckets["time"].tolist() == [start - 30000, start + 30000, start + 90000, start + 150000]
+    assert buckets["count"].tolist() == [3, 1, 6, 3]
+    assert buckets["mean"].tolist() == [10, 30, 115, 160]
+    assert buckets["min"].tolist() == [0, 30, 90, 150]
+    assert buckets["max"].tolist() == [20, 30, 140, 170]
+    hours = rollUp(times, values, 3600000)
+    assert hours["count"].tolist() == [3, 10]
+    assert len(rollUp(times[:0], values[:0], 60000)) == 0
+    assert len(rollUp(times[4:9], values[4:9], 60000)) == 0
+
+
+def testWriteTiers(tmp_path):
+    times = 1_700_000_000_000 + np.arange(7200, dtype=np.int64) * 1000
+    values = 400 + np.arange(7200) % 500
+    minutePath, hourPath = writeTiers(str(tmp_path / "rec"), times, values)
+    assert minutePath.endswith(MINUTE_EXT) and hourPath.endswith(HOUR_EXT)
+    bucketMs, minutes = readTier(minutePath)
+    assert bucketMs == 60000 and minutes.tobytes() == rollUp(times, values, 60000).tobytes()
+    bucketMs, hours = readTier(hourPath)
+    assert bucketMs == 3600000 and hours["count"].sum() == 7200
+    assert hours["min"].min() == 400 and hours["max"].max() == 899
+
+
+def touch(path, days):
+    with open(path, "wb"):
+        pass
+    mtime = time.time() - days * 86400
+    os.utime(path, (mtime, mtime))
+
+
+def testRetention(tmp_path):
+    directory = str(tmp_path)
+    for name, days in (("old.co2r", 10), ("old.co2m", 10), ("old.co2h", 10),
+                       ("archived.co2a", 10), ("archived.co2m", 400), ("archived.co2h", 400),
+                       ("new.co2r", 1), ("new.co2m", 1), ("new.co2h", 1),
+                       ("untiered.co2r", 10), ("hourless.co2r", 10), ("hourless.co2m", 400)):
+        touch(os.path.join(directory, name), days)
+    deleted = applyRetention(directory, 7, 365)
+    assert sorted(os.path.basename(path) for path in deleted) == [
+        "archived.co2a", "archived.co2m", "hourless.co2r", "old.co2r"]
+    # without the coarser tier nothing is deleted; hour tiers are kept
+    assert sorted(os.listdir(directory)) == [
+        "archived.co2h", "hourless.co2m", "new.co2h", "new.co2m", "new.co2r", "old.co2h", "old.co2m",
+        "untiered.co2r"]
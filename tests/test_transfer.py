@@ -0,0 +1,74 @@
+import io
+import numpy as np
+from history import History
+from archive import PPM_SCALE
+from transfer import readCSV, readFile, timeRange, writeCSV, writeFile
+
+
+def samples(count, start=1_700_000_000_000, step=1000, seed=1):
+    rng = np.random.default_rng(seed)
+    times = start + np.arange(count, dtype=np.int64) * step
+    ppm = (800 + np.cumsum(rng.normal(0, 3, count))).astype(np.float32)
+    raw = (3000 + np.cumsum(rng.normal(0, 1, count))).astype(np.float32)
+    return times, ppm, raw
+
+
+def roundTrip(chunks):
+    handle = io.StringIO()
+    count = writeCSV(handle, chunks)
+    handle.seek(0)
+    return count, handle.getvalue(), list(readCSV(handle))
+
+
+def testCSVRoundTripWithGaps():
+    times, ppm, raw = samples(100)
+    ppm[[0, 40, 41, 99]] = np.nan
+    raw[[40, 41]] = np.nan
+    count, text, chunks = roundTrip([("kitchen", times, ppm, raw), ("hall", times[:3], ppm[:3], raw[:3])])
+    assert count == 103
+    # gaps are empty fields
+    assert text.splitlines()[1] == "kitchen,1700000000000,2023-11-14T22:13:20.000Z,,%s" % raw[0]
+    assert [chunk[0] for chunk in chunks] == ["kitchen", "hall"]
+    sensor, readTimes, readPPM, readRaw = chunks[0]
+    assert readTimes.tolist() == times.tolist()
+    # the same float32 bits, NaN included
+    assert readPPM.tobytes() == ppm.tobytes() and readRaw.tobytes() == raw.tobytes()
+
+
+def testUnorderedRows(tmp_path):
+    text = ("sensor,time_ms,time_utc,ppm,raw\n"
+            "hall,5000,,505,\n"
+            "hall,1000,,501,\n"
+            "kitchen,3000,,,\n"
+            "kitchen,9000,,609,\n"
+            "kitchen,2000,,602,\n")
+    chunks = list(timeRange(readCSV(io.StringIO(text)), 2000, 5000, ordered=False))
+    assert [(sensor, times.tolist()) for sensor, times, ppm, raw in chunks] == [("hall", [5000]),
+                                                                                 ("kitchen", [3000, 2000])]
+    assert np.isnan(chunks[1][2][0]) and chunks[1][2][1] == 602
+
+    path = tmp_path / "mixed.csv"
+    path.write_text(text)
+    history = History(str(tmp_path / "history.db"))
+    assert history.importChunks(str(path), readFile(str(path)))
+    assert not history.importChunks(str(path), readFile(str(path)))
+    # several sensors: the imports row names none
+    assert history.db.execute("SELECT sensor, start, end, count FROM imports").fetchall() == [(None, 1000, 9000, 5)]
+    assert history.range("kitchen", 0, 10000)[0].tolist() == [2000, 3000, 9000]
+    history.close()
+
+
+def testRecordingRoundTrip(tmp_path):
+    times, ppm, raw = samples(1000)
+    ppm[500:510] = np.nan
+    header = {"v400": 4000.0, "v40000": 1000.0, "measurementInterval": 1 / 60}
+    # archives round ppm to steps of 1/PPM_SCALE (in float32)
+    for name, tolerance in (("out.co2r", 0), ("out.co2a", 1 / PPM_SCALE)):
+        path = str(tmp_path / name)
+        assert writeFile(path, [("co2", times[:600], ppm[:600], raw[:600]), ("co2", times[600:], ppm[600:],
+                                                                            raw[600:])], header) == 1000
+        chunks = list(timeRange(readFile(path, "co2"), int(times[100]), int(times[899])))
+        assert sum(len(chunk[1]) for chunk in chunks) == 800
+        assert np.concatenate([chunk[1] for chunk in chunks]).tolist() == times[100:900].tolist()
+        np.testing.assert_allclose(np.concatenate([chunk[2] for chunk in chunks]), ppm[100:900], rtol=0,
+                                   atol=tolerance)
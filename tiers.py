@@ -0,0 +1,104 @@
+import os
+import struct
+import time
+import numpy as np
+
+"""
+Downsampled tiers of a recording.
+
+When a recording is compacted its samples are rolled up into per-minute
+(<name>.co2m) and per-hour (<name>.co2h) aggregates with mean, min, max and
+count per bucket. Buckets are aligned to the epoch, NaN gap samples are left
+out. The raw recording can then be pruned after rawRetentionDays and the
+minute tier after minuteRetentionDays; the hour tier is kept.
+
+A tier file is a small header (magic, version, record size, bucket length
+in ms) followed by one record per bucket.
+"""
+TIER_MAGIC = b"CO2T"
+TIER_VERSION = 1
+MINUTE_EXT = ".co2m"
+HOUR_EXT = ".co2h"
+# extension, bucket length in ms
+TIERS = ((MINUTE_EXT, 60000), (HOUR_EXT, 3600000))
+TIER_HEADER = struct.Struct("<4sHHq")
+# bucket start (epoch ms), mean, min, max, number of samples
+TIER_DTYPE = np.dtype([("time", "<i8"), ("mean", "<f4"), ("min", "<f4"), ("max", "<f4"), ("count", "<u4")])
+
+
+"""
+(time, mean, min, max, count) structured array of the bucketMs buckets of a
+recording; empty buckets are left out
+"""
+def rollUp(times, values, bucketMs):
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    times = times[valid]
+    values = values[valid]
+    buckets = np.empty(0, dtype=TIER_DTYPE)
+    if len(times) == 0:
+        return buckets
+    starts = times // bucketMs * bucketMs
+    # recordings are in time order, so every bucket is one run
+    idx = np.flatnonzero(np.concatenate(([True], starts[1:] != starts[:-1])))
+    counts = np.diff(np.append(idx, len(values)))
+    buckets = np.empty(len(idx), dtype=TIER_DTYPE)
+    buckets["time"] = starts[idx]
+    buckets["mean"] = np.add.reduceat(values, idx) / counts
+    buckets["min"] = np.minimum.reduceat(values, idx)
+    buckets["max"] = np.maximum.reduceat(values, idx)
+    buckets["count"] = counts
+    return buckets
+
+
+def writeTier(path, buckets, bucketMs):
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as handle:
+        handle.write(TIER_HEADER.pack(TIER_MAGIC, TIER_VERSION, TIER_DTYPE.itemsize, bucketMs))
+        handle.write(buckets.tobytes())
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmpPath, path)
+    return path
+
+
+"""
+Returns (bucket length in ms, structured array of buckets)
+"""
+def readTier(path):
+    with open(path, "rb") as handle:
+        magic, version, recordSize, bucketMs = TIER_HEADER.unpack(handle.read(TIER_HEADER.size))
+        if magic != TIER_MAGIC or version != TIER_VERSION or recordSize != TIER_DTYPE.itemsize:
+            raise ValueError("not a recording tier: " + path)
+        data = handle.read()
+    return bucketMs, np.frombuffer(data, dtype=TIER_DTYPE)
+
+
+"""
+Writes the minute and hour tiers of a recording next to it (basePath without
+extension); returns their paths
+"""
+def writeTiers(basePath, times, values):
+    return [writeTier(basePath + ext, rollUp(times, values, bucketMs), bucketMs) for ext, bucketMs in TIERS]
+
+
+"""
+Deletes raw recordings (columnar or archived) older than rawDays and minute
+tiers older than minuteDays, but only where the coarser tier exists. Returns
+the deleted paths.
+"""
+def applyRetention(directory, rawDays, minuteDays, rawExts=(".co2r", ".co2a")):
+    now = time.time()
+    limits = tuple((ext, rawDays, MINUTE_EXT) for ext in rawExts) + ((MINUTE_EXT, minuteDays, HOUR_EXT),)
+    deleted = []
+    for name in sorted(os.listdir(directory)):
+        for ext, days, coarser in limits:
+            if not name.endswith(ext):
+                continue
+            path = os.path.join(directory, name)
+            base = path[:-len(ext)]
+            if os.path.exists(base + coarser) and now - os.path.getmtime(path) > days * 86400:
+                os.remove(path)
+                deleted.append(path)
+    return deleted
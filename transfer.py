@@ -0,0 +1,318 @@
+import argparse
+import csv
+import os
+import sys
+import numpy as np
+from history import History, HISTORY_FILE, parseDate, sensorFromFileName
+from sensors import DEFAULT_SENSOR
+from recording import (iterJournal, openRecording, loadRecording, RecordingStreamWriter, RECORDING_EXT,
+                       JOURNAL_EXT, PART_EXT)
+from archive import ArchiveWriter, iterArchive, readHeader, ARCHIVE_EXT
+
+"""
+Streaming export and import of recordings without the GUI. Data moves in
+chunks of CHUNK_SIZE samples, so memory use doesn't grow with the size of a
+recording or of the history.
+
+    python transfer.py export <recording | history> <out.csv | out.co2r | out.co2a | out.parquet | ->
+                              [--sensor CO2] [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+    python transfer.py import <in.csv | in.parquet | in.co2r | in.co2a | in.co2j | in.pickle | ->
+                              [history | out.co2r | out.co2a] [--sensor CO2]
+
+"-" is CSV on stdout/stdin. CSV and Parquet files have the columns
+sensor, time_ms (epoch ms), time_utc (ISO 8601, ignored on import), ppm and
+raw; gap samples have empty (null) ppm and raw. Parquet needs pyarrow.
+"""
+CHUNK_SIZE = 65536
+CSV_COLUMNS = ["sensor", "time_ms", "time_utc", "ppm", "raw"]
+PARQUET_EXT = ".parquet"
+CSV_EXT = ".csv"
+# header of recordings whose calibration isn't known (CSV, Parquet, history)
+UNKNOWN_HEADER = {"v400": float("nan"), "v40000": float("nan"), "measurementInterval": float("nan")}
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "saves", HISTORY_FILE)
+
+
+def importPyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet files need pyarrow (pip install pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+
+"""
+(sensor, times, ppm, raw) chunks of a recording file; start..end (epoch ms)
+lets archives skip blocks, the chunks still need timeRange()
+"""
+def readFile(path, sensor=None, start=None, end=None):
+    if path == "-":
+        return readCSV(sys.stdin, sensor)
+    if sensor is None:
+        sensor = sensorFromFileName(path)
+    if path.endswith(CSV_EXT):
+        return readCSVFile(path, sensor)
+    if path.endswith(PARQUET_EXT):
+        return readParquet(path, sensor)
+    if path.endswith(RECORDING_EXT):
+        return readRecording(path, sensor)
+    if path.endswith(ARCHIVE_EXT):
+        return ((sensor, times, ppm, raw) for times, ppm, raw in iterArchive(path, start, end))
+    if path.endswith(JOURNAL_EXT) or path.endswith(JOURNAL_EXT + PART_EXT):
+        return ((sensor, records["time"], records["ppm"], records["raw"]) for records in iterJournal(path, CHUNK_SIZE))
+    # tiers and old pickles are small enough to load at once
+    recording = loadRecording(path)
+    return iter([(sensor, recording.time, recording.ppm, recording.raw)])
+
+
+def readRecording(path, sensor):
+    recording = openRecording(path)
+    # slices of the memory maps; only the slice being written is paged in
+    for first in range(0, len(recording), CHUNK_SIZE):
+        last = first + CHUNK_SIZE
+        yield sensor, recording.time[first:last], recording.ppm[first:last], recording.raw[first:last]
+
+
+def readCSVFile(path, sensor):
+    with open(path, newline="") as handle:
+        yield from readCSV(handle, sensor)
+
+
+"""
+sensor is used for rows without a sensor column
+"""
+def readCSV(handle, sensor=None):
+    chunk = []
+    for row in csv.DictReader(handle):
+        chunk.append((row.get("sensor") or sensor, int(row["time_ms"]), parseValue(row.get("ppm")),
+                      parseValue(row.get("raw"))))
+        if len(chunk) == CHUNK_SIZE:
+            yield from splitSensors(chunk)
+            chunk = []
+    yield from splitSensors(chunk)
+
+
+def parseValue(text):
+    return float(text) if text else float("nan")
+
+
+"""
+chunks of one sensor each from a list of (sensor, time, ppm, raw) rows
+"""
+def splitSensors(rows):
+    first = 0
+    for i in range(1, len(rows) + 1):
+        if i == len(rows) or rows[i][0] != rows[first][0]:
+            sensor, times, ppm, raw = zip(*rows[first:i])
+            yield (sensor[0] or DEFAULT_SENSOR, np.array(times, dtype=np.int64), np.array(ppm, dtype=np.float32),
+                   np.array(raw, dtype=np.float32))
+            first = i
+
+
+def readParquet(path, sensor):
+    pyarrow, parquet = importPyarrow()
+    for batch in parquet.ParquetFile(path).iter_batches(batch_size=CHUNK_SIZE):
+        columns = batch.to_pydict()
+        rows = list(zip(columns.get("sensor", [sensor] * batch.num_rows), columns["time_ms"], columns["ppm"],
+                        columns.get("raw", [None] * batch.num_rows)))
+        # null values become NaN
+        yield from splitSensors([(s or sensor, t, float("nan") if p is None else p, float("nan") if r is None else r)
+                                 for s, t, p, r in rows])
+
+
+"""
+only the parts of the chunks in start..end (epoch ms); recordings are in
+time order, rows of CSV and Parquet files needn't be (ordered=False)
+"""
+def timeRange(chunks, start, end, ordered=True):
+    for sensor, times, ppm, raw in chunks:
+        if not ordered:
+            keep = np.ones(len(times), dtype=bool)
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times <= end
+            if keep.any():
+                yield sensor, times[keep], ppm[keep], raw[keep]
+            continue
+        first = 0 if start is None else np.searchsorted(times, start)
+        last = len(times) if end is None else np.searchsorted(times, end, side="right")
+        if last > first:
+            yield sensor, times[first:last], ppm[first:last], raw[first:last]
+
+
+def writeCSV(handle, chunks):
+    count = 0
+    handle.write(",".join(CSV_COLUMNS) + "\n")
+    for sensor, times, ppm, raw in chunks:
+        stamps = np.datetime_as_string(np.asarray(times, dtype="datetime64[ms]"), unit="ms", timezone="UTC")
+        ppmText = formatValues(ppm)
+        rawText = formatValues(raw)
+        handle.writelines("%s,%d,%s,%s,%s\n" % row
+                          for row in zip([sensor] * len(times), np.asarray(times).tolist(), stamps, ppmText, rawText))
+        count += len(times)
+    return count
+
+
+"""
+shortest text that reads back as the same float32; NaN (gaps, unknown raw)
+is an empty field
+"""
+def formatValues(values):
+    text = np.asarray(values, dtype=np.float32).astype(str)
+    text[np.isnan(values)] = ""
+    return text.tolist()
+
+
+def writeCSVFile(path, chunks):
+    with open(path, "w", newline="") as handle:
+        return writeCSV(handle, chunks)
+
+
+def writeParquet(path, chunks):
+    pyarrow, parquet = importPyarrow()
+    schema = pyarrow.schema([("sensor", pyarrow.string()), ("time_ms", pyarrow.int64()),
+                             ("time_utc", pyarrow.timestamp("ms", tz="UTC")), ("ppm", pyarrow.float32()),
+                             ("raw", pyarrow.float32())])
+    count = 0
+    with parquet.ParquetWriter(path, schema) as writer:
+        for sensor, times, ppm, raw in chunks:
+            times = np.asarray(times, dtype=np.int64)
+            writer.write_table(pyarrow.table({
+                "sensor": [sensor] * len(times), "time_ms": times,
+                "time_utc": pyarrow.array(times, pyarrow.timestamp("ms", tz="UTC")),
+                "ppm": pyarrow.array(ppm, pyarrow.float32(), from_pandas=True),
+                "raw": pyarrow.array(raw, pyarrow.float32(), from_pandas=True)}, schema=schema))
+            count += len(times)
+    return count
+
+
+"""
+A .co2r or .co2a holds one sensor; mixing sensors is an error
+"""
+def writeRecordingFile(path, chunks, header):
+    writer = ArchiveWriter(path, header) if path.endswith(ARCHIVE_EXT) else RecordingStreamWriter(path, header)
+    written = None
+    try:
+        for sensor, times, ppm, raw in chunks:
+            if written is not None and sensor != written:
+                raise SystemExit("a recording holds one sensor, use --sensor to pick one of %s, %s" % (written, sensor))
+            written = sensor
+            writer.append(times, ppm, raw)
+    except BaseException:
+        writer.discard()
+        raise
+    writer.close()
+    return writer.count
+
+
+def writeFile(path, chunks, header=UNKNOWN_HEADER):
+    if path == "-":
+        return writeCSV(sys.stdout, chunks)
+    if path.endswith(CSV_EXT):
+        return writeCSVFile(path, chunks)
+    if path.endswith(PARQUET_EXT):
+        return writeParquet(path, chunks)
+    if path.endswith(RECORDING_EXT) or path.endswith(ARCHIVE_EXT):
+        return writeRecordingFile(path, chunks, header)
+    raise SystemExit("unknown output format: " + path)
+
+
+def recordingHeader(path):
+    if path.endswith(RECORDING_EXT):
+        return openRecording(path).header
+    if path.endswith(ARCHIVE_EXT):
+        with open(path, "rb") as handle:
+            return readHeader(handle, path)[0]
+    return UNKNOWN_HEADER
+
+
+"""
+counts the samples going through
+"""
+class Counter:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.count = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.count += len(chunk[1])
+            yield chunk
+
+
+"""
+whether a file holds a sensor column rather than one sensor's recording
+"""
+def hasSensorColumn(path):
+    return path == "-" or path.endswith(CSV_EXT) or path.endswith(PARQUET_EXT)
+
+
+def export(args):
+    start = None if args.start is None else parseDate(args.start)
+    # --to is the last day included
+    end = None if args.end is None else parseDate(args.end) + 86400000 - 1
+    if args.source == "history":
+        history = History(args.db)
+        count = writeFile(args.destination, history.iterSamples(args.sensor, start, end, CHUNK_SIZE))
+        history.close()
+    elif hasSensorColumn(args.source):
+        # --sensor picks the rows of one sensor
+        chunks = timeRange(readFile(args.source), start, end, ordered=False)
+        count = writeFile(args.destination, (chunk for chunk in chunks if args.sensor in (None, chunk[0])))
+    else:
+        # --sensor names the sensor of the recording
+        chunks = timeRange(readFile(args.source, args.sensor, start, end), start, end)
+        count = writeFile(args.destination, chunks, recordingHeader(args.source))
+    if args.destination != "-":
+        print("exported %d samples to %s" % (count, args.destination))
+
+
+def importFile(args):
+    chunks = readFile(args.source, args.sensor)
+    if args.destination != "history":
+        count = writeFile(args.destination, chunks, recordingHeader(args.source))
+        if args.destination != "-":
+            print("imported %d samples into %s" % (count, args.destination))
+        return
+    history = History(args.db)
+    counter = Counter(chunks)
+    if args.source == "-":
+        # stdin has no path to remember; it is imported every time
+        with history.db:
+            for sensor, times, ppm, raw in counter:
+                history.writeSamples(sensor, times, ppm, raw)
+        imported = True
+    else:
+        imported = history.importChunks(args.source, counter)
+    history.close()
+    if imported:
+        print("imported %d samples into %s" % (counter.count, args.db))
+    else:
+        print(args.source, "was imported before")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports and imports CO2 recordings")
+    parser.add_argument("--db", default=DEFAULT_HISTORY, help="history database (default saves/history.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    exporting = commands.add_parser("export", help="recording or history to CSV, Parquet or .co2r")
+    exporting.add_argument("source", help="recording file or 'history'")
+    exporting.add_argument("destination", help=".csv, .parquet, .co2r, .co2a or - (CSV on stdout)")
+    exporting.add_argument("--sensor", help="sensor to export (default every sensor)")
+    exporting.add_argument("--from", dest="start", help="first day, YYYY-MM-DD")
+    exporting.add_argument("--to", dest="end", help="last day, YYYY-MM-DD")
+    importing = commands.add_parser("import", help="CSV, Parquet or a recording into the history or a .co2r")
+    importing.add_argument("source", help=".csv, .parquet, .co2r, .co2a, .co2j, .pickle or - (CSV on stdin)")
+    importing.add_argument("destination", nargs="?", default="history",
+                           help="'history' (default), a .co2r or a .co2a")
+    importing.add_argument("--sensor", help="sensor of samples without a sensor column (default from the file name)")
+    args = parser.parse_args()
+    if args.command == "export":
+        export(args)
+    else:
+        importFile(args)
+
+
+if __name__ == "__main__":
+    main()